@@ -0,0 +1,381 @@
+"""
+End-to-end streaming benchmark for the FastAPI endpoints.
+
+Starts the backend in a subprocess, with the model either served by the
+Responses API stand-in (loadtest/openai_stub.py, `--agents stub`) or mocked
+inside the server process (`--agents mock`, no HTTP hop to a model), then
+drives the endpoints with N concurrent clients over real loopback HTTP and
+WebSocket connections.
+
+Reported per endpoint: time to first event, events per second, p50/p95/p99
+end-to-end latency, errors, and the server's peak RSS. Results are written as
+JSON so runs of different commits can be compared:
+
+    python -m loadtest.bench_streaming --clients 20 --requests 200 --output base.json
+    python -m loadtest.bench_streaming --clients 20 --requests 200 --compare base.json
+
+With --compare the exit status is 1 when any latency got worse, or
+throughput dropped, by more than --tolerance.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Callable
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "loadtest", "results")
+ENDPOINTS = [
+    "popup-optimization",
+    "popup-optimization-structured",
+    "ws-popup-optimization",
+    "implement-popup-changes",
+    "implement-popup-changes-stream",
+]
+# The popup the frontend starts from, so modifications see a real FlexibleContent configuration
+SAMPLE_CONFIG_PATH = os.path.join(os.path.dirname(BACKEND_DIR), "frontend", "data", "sample-flexible-content.json")
+# The structured WebSocket has no end-of-run event; a run that goes quiet this long has failed
+WS_IDLE_SECONDS = 30.0
+PRODUCTS = ["baseball bats", "running shoes", "yoga mats", "coffee beans", "camping gear", "skin care", "pet food"]
+# Lower is better for these; higher is better for the throughput keys
+LATENCY_KEYS = ["ttfe_p50_ms", "ttfe_p95_ms", "e2e_p50_ms", "e2e_p95_ms", "e2e_p99_ms"]
+THROUGHPUT_KEYS = ["events_per_second", "requests_per_second"]
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = math.ceil(q / 100 * len(ordered))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def read_rss_mb(pid: int) -> dict[str, float]:
+    """Current and peak resident set size of a process (Linux /proc)"""
+    sizes = {}
+    with contextlib.suppress(OSError):
+        with open(f"/proc/{pid}/status", "r", encoding="utf-8") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    sizes[key] = int(value.split()[0]) / 1024
+    return {"rss_mb": round(sizes.get("VmRSS", 0.0), 1), "peak_rss_mb": round(sizes.get("VmHWM", 0.0), 1)}
+
+
+def git_commit() -> str | None:
+    with contextlib.suppress(OSError, subprocess.CalledProcessError):
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    return None
+
+
+def load_sample_config() -> dict[str, Any]:
+    with open(SAMPLE_CONFIG_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def request_payload(index: int) -> dict[str, str]:
+    # Distinct inputs, so the run cache and tool memo do not turn the benchmark into a cache test
+    product = PRODUCTS[index % len(PRODUCTS)]
+    return {
+        "business_description": f"Benchmark store #{index} selling {product} online",
+        "optimization_goals": "Increase email signups",
+    }
+
+
+class Sample:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_event: float | None = None
+        self.events = 0
+        self.finished: float | None = None
+        self.error: str | None = None
+
+    def event(self) -> None:
+        if self.first_event is None:
+            self.first_event = time.perf_counter() - self.started
+        self.events += 1
+
+    def finish(self) -> None:
+        self.finished = time.perf_counter() - self.started
+
+
+def implement_payload(index: int, config: dict[str, Any]) -> dict[str, Any]:
+    return {"insights": f"Make the call to action of store #{index} more prominent", "current_config": config}
+
+
+async def sse_request(client: httpx.AsyncClient, path: str, payload: dict[str, Any]) -> Sample:
+    sample = Sample()
+    async with client.stream("POST", path, json=payload) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith("data: "):
+                sample.event()
+    sample.finish()
+    return sample
+
+
+async def ws_request(base_url: str, index: int) -> Sample:
+    import websockets
+
+    sample = Sample()
+    async with websockets.connect(base_url.replace("http", "ws", 1) + "/ws/popup-optimization") as ws:
+        await ws.send(json.dumps(request_payload(index)))
+        while True:
+            event = json.loads(await asyncio.wait_for(ws.recv(), WS_IDLE_SECONDS))
+            if event["type"] == "error":
+                raise RuntimeError(event.get("message"))
+            sample.event()
+            # The socket stays open for further requests; the run ends with the agent's message
+            if event["type"] == "message_complete":
+                break
+    sample.finish()
+    return sample
+
+
+async def implement_request(client: httpx.AsyncClient, payload: dict[str, Any]) -> Sample:
+    sample = Sample()
+    async with client.stream("POST", "/implement-popup-changes", json=payload) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            if chunk:
+                sample.event()
+    sample.finish()
+    return sample
+
+
+def request_for(endpoint: str, client: httpx.AsyncClient, base_url: str) -> Callable[[int], Any]:
+    if endpoint == "popup-optimization":
+        return lambda index: sse_request(client, "/popup-optimization", request_payload(index))
+    if endpoint == "popup-optimization-structured":
+        return lambda index: sse_request(client, "/popup-optimization-structured", request_payload(index))
+    if endpoint == "ws-popup-optimization":
+        return lambda index: ws_request(base_url, index)
+    config = load_sample_config()
+    if endpoint == "implement-popup-changes-stream":
+        return lambda index: sse_request(client, "/implement-popup-changes/stream", implement_payload(index, config))
+    return lambda index: implement_request(client, implement_payload(index, config))
+
+
+async def bench_endpoint(endpoint: str, base_url: str, clients: int, requests: int, offset: int) -> dict[str, Any]:
+    """Run `requests` requests against one endpoint, at most `clients` at a time"""
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, timeout=httpx.Timeout(300.0), limits=limits) as client:
+        send = request_for(endpoint, client, base_url)
+        # One warm-up request so first-use setup is not counted
+        await send(offset)
+
+        semaphore = asyncio.Semaphore(clients)
+        samples: list[Sample] = []
+
+        async def one(index: int):
+            async with semaphore:
+                try:
+                    samples.append(await send(index))
+                except Exception as e:
+                    failed = Sample()
+                    failed.error = f"{type(e).__name__}: {e}"
+                    samples.append(failed)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(offset + 1 + i) for i in range(requests)))
+        wall = time.perf_counter() - started
+
+    completed = [s for s in samples if s.error is None]
+    first_events = [s.first_event * 1000 for s in completed if s.first_event is not None]
+    latencies = [s.finished * 1000 for s in completed]
+    events = sum(s.events for s in completed)
+    errors = [s.error for s in samples if s.error is not None]
+    return {
+        "requests": requests,
+        "clients": clients,
+        "errors": len(errors),
+        "error_examples": sorted(set(errors))[:3],
+        "wall_seconds": round(wall, 3),
+        "requests_per_second": round(len(completed) / wall, 2),
+        "events_per_second": round(events / wall, 1),
+        "events_per_request": round(events / len(completed), 1) if completed else 0,
+        "ttfe_p50_ms": round(percentile(first_events, 50), 1),
+        "ttfe_p95_ms": round(percentile(first_events, 95), 1),
+        "ttfe_p99_ms": round(percentile(first_events, 99), 1),
+        "e2e_p50_ms": round(percentile(latencies, 50), 1),
+        "e2e_p95_ms": round(percentile(latencies, 95), 1),
+        "e2e_p99_ms": round(percentile(latencies, 99), 1),
+    }
+
+
+async def wait_until_healthy(base_url: str, process: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with status {process.returncode}")
+            with contextlib.suppress(httpx.HTTPError):
+                if (await client.get("/health")).status_code == 200:
+                    return
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not become healthy within {timeout}s")
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict[str, Any]:
+    processes = []
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_AGENTS_DISABLE_TRACING": "1",
+        "RUN_CACHE_ENABLED": "false",
+        # Every benchmark client comes from 127.0.0.1, so per-client limits would serialize them
+        "RUN_MAX_PER_CLIENT": str(args.clients),
+        "RUN_MAX_CONCURRENT": str(args.clients),
+        "RUN_QUEUE_SIZE": str(max(args.clients, args.requests)),
+    }
+    try:
+        if args.agents == "stub":
+            stub_port = free_port()
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "loadtest.openai_stub", "--port", str(stub_port),
+                 "--tokens-per-second", str(args.tokens_per_second), "--ttft-ms", str(args.ttft_ms)],
+                cwd=BACKEND_DIR, env=env,
+            ))
+            env["OPENAI_BASE_URL"] = f"http://127.0.0.1:{stub_port}/v1"
+
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "loadtest.bench_streaming", "--serve", "--agents", args.agents, "--port", str(port),
+             "--tokens-per-second", str(args.tokens_per_second), "--ttft-ms", str(args.ttft_ms)],
+            cwd=BACKEND_DIR, env=env,
+        )
+        processes.append(server)
+        base_url = f"http://127.0.0.1:{port}"
+        await wait_until_healthy(base_url, server)
+
+        results = {}
+        for position, endpoint in enumerate(args.endpoints):
+            print(f"→ {endpoint}: {args.requests} requests, {args.clients} clients", flush=True)
+            results[endpoint] = await bench_endpoint(
+                endpoint, base_url, args.clients, args.requests, offset=position * (args.requests + 1)
+            )
+            results[endpoint].update(read_rss_mb(server.pid))
+            print(format_row(endpoint, results[endpoint]), flush=True)
+
+        return {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "config": {
+                "agents": args.agents,
+                "clients": args.clients,
+                "requests": args.requests,
+                "tokens_per_second": args.tokens_per_second,
+                "ttft_ms": args.ttft_ms,
+            },
+            "server_peak_rss_mb": read_rss_mb(server.pid)["peak_rss_mb"],
+            "endpoints": results,
+        }
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            with contextlib.suppress(subprocess.TimeoutExpired):
+                process.wait(10)
+
+
+def format_row(endpoint: str, result: dict[str, Any]) -> str:
+    return (
+        f"  ttfe p50/p95 {result['ttfe_p50_ms']}/{result['ttfe_p95_ms']} ms  "
+        f"e2e p50/p95/p99 {result['e2e_p50_ms']}/{result['e2e_p95_ms']}/{result['e2e_p99_ms']} ms  "
+        f"{result['events_per_second']} events/s  {result['errors']} errors  peak RSS {result['peak_rss_mb']} MB"
+    )
+
+
+def compare(baseline: dict[str, Any], current: dict[str, Any], tolerance: float) -> list[str]:
+    """Regressions of current against baseline beyond the relative tolerance"""
+    regressions = []
+    for endpoint, result in current["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(endpoint)
+        if base is None:
+            continue
+        for key in LATENCY_KEYS:
+            if base[key] > 0 and result[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{endpoint} {key}: {base[key]} → {result[key]}")
+        for key in THROUGHPUT_KEYS:
+            if result[key] < base[key] * (1 - tolerance):
+                regressions.append(f"{endpoint} {key}: {base[key]} → {result[key]}")
+        if result["errors"] > base["errors"]:
+            regressions.append(f"{endpoint} errors: {base['errors']} → {result['errors']}")
+    return regressions
+
+
+def serve(args: argparse.Namespace) -> None:
+    """Run the backend for the benchmark; with --agents mock the model is replaced in-process"""
+    sys.path.insert(0, BACKEND_DIR)
+    import uvicorn
+
+    import main
+
+    if args.agents == "mock":
+        from loadtest import mock_model
+
+        mock_model.install(main, tokens_per_second=args.tokens_per_second, ttft_ms=args.ttft_ms)
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--agents", choices=["stub", "mock"], default="stub",
+                        help="stub: Responses API stand-in over HTTP; mock: model mocked inside the server")
+    parser.add_argument("--clients", type=int, default=10, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=50, help="requests per endpoint")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--ttft-ms", type=float, default=100.0)
+    parser.add_argument("--output", help=f"result file (default: {os.path.relpath(RESULTS_DIR)}/<commit>-<time>.json)")
+    parser.add_argument("--compare", help="baseline result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.serve:
+        serve(args)
+        return
+
+    result = asyncio.run(run_benchmark(args))
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{result['commit'] or 'local'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(json.load(f), result, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
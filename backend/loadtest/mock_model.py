@@ -0,0 +1,76 @@
+"""
+In-process model mock for the streaming benchmark (`--agents mock`).
+
+Replaces Runner.run_streamed in the popup optimization agent, and
+amodify_popup_configuration and astream_popup_modification in the app, with
+stand-ins that produce the
+openai_stub text template at a fixed token rate, so everything else
+(scheduling, tool prefetch, coalescing, serialization) runs for real
+"""
+
+import asyncio
+import json
+from types import SimpleNamespace
+from typing import Any, AsyncGenerator, Dict
+
+from openai.types.responses import ResponseOutputText
+
+from loadtest.openai_stub import DEFAULT_TEXT, TOKEN_PATTERN
+
+
+class MockRunResult:
+    """Enough of RunResultStreaming for PopupOptimizationAgent.create_stream"""
+
+    def __init__(self, text: str, tokens_per_second: float, ttft_ms: float):
+        self.text = text
+        self.pieces = TOKEN_PATTERN.findall(text)
+        self.delay = 1 / tokens_per_second if tokens_per_second > 0 else 0
+        self.ttft = ttft_ms / 1000
+        self.is_complete = False
+        self.context_wrapper = SimpleNamespace(usage=SimpleNamespace(output_tokens=0))
+
+    async def stream_events(self):
+        await asyncio.sleep(self.ttft)
+        for piece in self.pieces:
+            if self.is_complete:
+                break
+            self.context_wrapper.usage.output_tokens += 1
+            yield SimpleNamespace(type="raw_response_event", data=SimpleNamespace(delta=piece))
+            await asyncio.sleep(self.delay)
+        if not self.is_complete:
+            content = [ResponseOutputText(type="output_text", text=self.text, annotations=[])]
+            item = SimpleNamespace(type="message_output_item", raw_item=SimpleNamespace(content=content))
+            yield SimpleNamespace(type="run_item_stream_event", item=item)
+        self.is_complete = True
+
+    def cancel(self, mode: str = "immediate") -> None:
+        self.is_complete = True
+
+
+def install(app_module: Any, tokens_per_second: float, ttft_ms: float) -> None:
+    from src.agents import popup_optimization_agent
+
+    text = "".join(DEFAULT_TEXT)
+
+    def run_streamed(agent, input):
+        return MockRunResult(text, tokens_per_second, ttft_ms)
+
+    def generation_seconds(config: Dict[str, Any]) -> float:
+        tokens = len(TOKEN_PATTERN.findall(json.dumps(config)))
+        return ttft_ms / 1000 + (tokens / tokens_per_second if tokens_per_second > 0 else 0)
+
+    async def amodify_popup_configuration(instructions: str, current_config: Dict[str, Any], ui_schema_content: str):
+        await asyncio.sleep(generation_seconds(current_config))
+        return current_config
+
+    async def astream_popup_modification(
+        instructions: str, current_config: Dict[str, Any], ui_schema_content: str
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        yield {"type": "modification_start"}
+        await asyncio.sleep(generation_seconds(current_config))
+        yield {"type": "config_update", "config": current_config}
+        yield {"type": "modification_complete", "config": current_config, "operations": 1, "fallback": False}
+
+    popup_optimization_agent.Runner.run_streamed = staticmethod(run_streamed)
+    app_module.amodify_popup_configuration = amodify_popup_configuration
+    app_module.astream_popup_modification = astream_popup_modification
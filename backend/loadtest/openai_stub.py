@@ -0,0 +1,314 @@
+"""
+OpenAI Responses API stand-in for offline load testing.
+
+Serves POST /v1/responses like the real API, without a model behind it:
+- streamed requests get Server-Sent Events at a configurable token rate,
+  after a configurable time to first token
+- when the request offers tools the first turn answers with function calls,
+  the follow-up turn (with the tool outputs) streams the text template
+- non-streamed requests get a JSON payload; for popup modification prompts
+  the current configuration is echoed back, or an empty JSON Patch for
+  patch-mode prompts, unless a template overrides it
+- a configurable share of requests fail with a 500 or 429
+
+Run it and point the backend at it:
+
+    python -m loadtest.openai_stub --port 8100 --tokens-per-second 80 --ttft-ms 400
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=stub uvicorn main:app
+
+Every option can also be set with an OPENAI_STUB_* environment variable, or
+changed at runtime with PUT /stub/config.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import re
+import time
+from typing import Any, AsyncGenerator
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+DEFAULT_TEXT = [
+    "🔄 **User Behavior Analysis**\n",
+    "Visitors who see the popup within the first five seconds close it 70% of the time, ",
+    "while exit-intent views convert almost three times better.\n\n",
+    "🎨 **Design Recommendations**\n",
+    "• Use a single bold headline that states the benefit in under eight words\n",
+    "• Raise the contrast of the CTA button and make it full width on mobile\n",
+    "• Replace the two-step form with a single email field\n",
+    "• Add social proof below the form, such as the number of subscribers\n\n",
+    "⚡ **Trigger and Timing**\n",
+    "Switch to exit-intent on desktop and a 15 second delay on mobile, ",
+    "and suppress the popup for returning customers for seven days.\n\n",
+    "✨ **Expected Impact**\n",
+    "These changes target the largest drop-off points and should lift opt-in rates noticeably ",
+    "without hurting the browsing experience.",
+]
+
+# Splits text into word-sized pieces, a close enough stand-in for model tokens
+TOKEN_PATTERN = re.compile(r"\s*\S+\s*|\s+")
+
+
+class StubSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="OPENAI_STUB_")
+
+    TOKENS_PER_SECOND: float = 50.0  # streamed output rate; 0 streams without delay
+    TTFT_MS: float = 300.0  # time to first token (or first tool call)
+    ERROR_RATE: float = 0.0  # share of requests failing with a 500
+    RATE_LIMIT_RATE: float = 0.0  # share of requests failing with a 429
+    TOOL_CALLS: bool = True  # answer the first turn with calls to the offered tools
+    TEMPLATES_PATH: str | None = None  # JSON file: {"text": [...], "json": {...}, "patch": [...]}
+    SEED: int | None = None
+
+
+class ResponsesStub:
+    """Builds Responses API payloads and event streams from the configured templates"""
+
+    def __init__(self, settings: StubSettings):
+        self.configure(settings)
+        self.ids = itertools.count(1)
+        self.stats = {"requests": 0, "streamed": 0, "errors": 0, "output_tokens": 0}
+
+    def configure(self, settings: StubSettings) -> None:
+        self.settings = settings
+        self.random = random.Random(settings.SEED)
+        self.text = DEFAULT_TEXT
+        self.json_payload = None
+        self.patch_payload = None
+        if settings.TEMPLATES_PATH:
+            with open(settings.TEMPLATES_PATH, "r", encoding="utf-8") as f:
+                templates = json.load(f)
+            self.text = templates.get("text", DEFAULT_TEXT)
+            self.json_payload = templates.get("json")
+            self.patch_payload = templates.get("patch")
+
+    def next_id(self, prefix: str) -> str:
+        return f"{prefix}_stub{next(self.ids):08d}"
+
+    def failure(self) -> JSONResponse | None:
+        """An OpenAI-shaped error for the configured share of requests"""
+        roll = self.random.random()
+        if roll < self.settings.ERROR_RATE:
+            status, kind, message = 500, "server_error", "The stub failed this request on purpose"
+        elif roll < self.settings.ERROR_RATE + self.settings.RATE_LIMIT_RATE:
+            status, kind, message = 429, "rate_limit_exceeded", "The stub rate limited this request on purpose"
+        else:
+            return None
+        self.stats["errors"] += 1
+        return JSONResponse(
+            {"error": {"message": message, "type": kind, "param": None, "code": kind}},
+            status_code=status,
+            headers={"retry-after": "1"} if status == 429 else None,
+        )
+
+    def tool_calls_for(self, body: dict[str, Any]) -> list[dict[str, Any]]:
+        """Function calls for the offered tools, unless this turn already carries tool outputs"""
+        tools = [t for t in body.get("tools") or [] if t.get("type") == "function"]
+        items = body.get("input") if isinstance(body.get("input"), list) else []
+        answered = any(isinstance(item, dict) and item.get("type") == "function_call_output" for item in items)
+        if not self.settings.TOOL_CALLS or not tools or answered:
+            return []
+        prompt = input_text(body)
+        calls = []
+        for t in tools:
+            properties = (t.get("parameters") or {}).get("properties") or {}
+            arguments = {name: prompt[:200] for name in properties}
+            calls.append({
+                "type": "function_call",
+                "id": self.next_id("fc"),
+                "call_id": self.next_id("call"),
+                "name": t["name"],
+                "arguments": json.dumps(arguments),
+                "status": "completed",
+            })
+        return calls
+
+    def output_text(self, body: dict[str, Any]) -> str:
+        """JSON for non-streamed requests and patch prompts, the text template for other streamed ones"""
+        prompt = input_text(body)
+        if "Return the JSON Patch operations" in prompt:
+            return json.dumps(self.patch_payload or [])
+        if body.get("stream"):
+            return "".join(self.text)
+        if self.json_payload is not None:
+            return json.dumps(self.json_payload)
+        # Popup modification prompts embed the current configuration; echo it back
+        match = re.search(r"Current Configuration:\s*(\{.*\})\s*Return the modified", prompt, re.DOTALL)
+        return match.group(1) if match else "{}"
+
+    def message(self, text: str, status: str = "completed") -> dict[str, Any]:
+        return {
+            "type": "message",
+            "id": self.next_id("msg"),
+            "role": "assistant",
+            "status": status,
+            "content": [{"type": "output_text", "text": text, "annotations": [], "logprobs": []}],
+        }
+
+    def response(self, body: dict[str, Any], output: list[dict[str, Any]], status: str = "completed") -> dict[str, Any]:
+        input_tokens = count_tokens(input_text(body))
+        output_tokens = sum(
+            count_tokens(item["content"][0]["text"]) if item["type"] == "message" else count_tokens(item["arguments"])
+            for item in output
+        )
+        return {
+            "id": self.next_id("resp"),
+            "object": "response",
+            "created_at": int(time.time()),
+            "status": status,
+            "model": body.get("model", "gpt-4.1"),
+            "output": output,
+            "parallel_tool_calls": True,
+            "tool_choice": body.get("tool_choice", "auto"),
+            "tools": body.get("tools") or [],
+            "usage": {
+                "input_tokens": input_tokens,
+                "input_tokens_details": {"cached_tokens": 0},
+                "output_tokens": output_tokens,
+                "output_tokens_details": {"reasoning_tokens": 0},
+                "total_tokens": input_tokens + output_tokens,
+            },
+        }
+
+    async def create(self, body: dict[str, Any]) -> dict[str, Any]:
+        await asyncio.sleep(self.settings.TTFT_MS / 1000)
+        calls = self.tool_calls_for(body)
+        output = calls or [self.message(self.output_text(body))]
+        response = self.response(body, output)
+        self.stats["output_tokens"] += response["usage"]["output_tokens"]
+        return response
+
+    async def stream(self, body: dict[str, Any]) -> AsyncGenerator[str, None]:
+        """Responses API streaming events as SSE lines"""
+        sequence = itertools.count()
+
+        def event(kind: str, **fields: Any) -> str:
+            return f"event: {kind}\ndata: {json.dumps({'type': kind, 'sequence_number': next(sequence), **fields})}\n\n"
+
+        pending = self.response(body, [], status="in_progress")
+        yield event("response.created", response=pending)
+        yield event("response.in_progress", response=pending)
+        await asyncio.sleep(self.settings.TTFT_MS / 1000)
+
+        delay = 1 / self.settings.TOKENS_PER_SECOND if self.settings.TOKENS_PER_SECOND > 0 else 0
+        output = []
+        calls = self.tool_calls_for(body)
+        if calls:
+            for index, call in enumerate(calls):
+                yield event("response.output_item.added", output_index=index, item={**call, "arguments": "", "status": "in_progress"})
+                for piece in TOKEN_PATTERN.findall(call["arguments"]):
+                    yield event("response.function_call_arguments.delta", item_id=call["id"], output_index=index, delta=piece)
+                    await asyncio.sleep(delay)
+                yield event("response.function_call_arguments.done", item_id=call["id"], output_index=index,
+                            name=call["name"], arguments=call["arguments"])
+                yield event("response.output_item.done", output_index=index, item=call)
+                output.append(call)
+        else:
+            text = self.output_text(body)
+            item = self.message("", status="in_progress")
+            part = {"type": "output_text", "text": "", "annotations": [], "logprobs": []}
+            location = {"item_id": item["id"], "output_index": 0, "content_index": 0}
+            yield event("response.output_item.added", output_index=0, item=item)
+            yield event("response.content_part.added", part=part, **location)
+            for piece in TOKEN_PATTERN.findall(text):
+                yield event("response.output_text.delta", delta=piece, logprobs=[], **location)
+                await asyncio.sleep(delay)
+            yield event("response.output_text.done", text=text, logprobs=[], **location)
+            yield event("response.content_part.done", part={**part, "text": text}, **location)
+            done = self.message(text)
+            done["id"] = item["id"]
+            yield event("response.output_item.done", output_index=0, item=done)
+            output.append(done)
+
+        completed = self.response(body, output)
+        completed["id"] = pending["id"]
+        self.stats["output_tokens"] += completed["usage"]["output_tokens"]
+        yield event("response.completed", response=completed)
+
+
+def input_text(body: dict[str, Any]) -> str:
+    """All text in the request input, whether a plain string or a list of items"""
+    value = body.get("input")
+    if isinstance(value, str):
+        return value
+    texts = []
+    for item in value or []:
+        content = item.get("content") if isinstance(item, dict) else None
+        if isinstance(content, str):
+            texts.append(content)
+        elif isinstance(content, list):
+            texts.extend(part.get("text", "") for part in content if isinstance(part, dict))
+    return "\n".join(texts)
+
+
+def count_tokens(text: str) -> int:
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def create_app(settings: StubSettings | None = None) -> FastAPI:
+    stub = ResponsesStub(settings or StubSettings())
+    app = FastAPI(title="OpenAI Responses API stand-in")
+    app.state.stub = stub
+
+    @app.post("/v1/responses")
+    async def create_response(request: Request):
+        body = await request.json()
+        stub.stats["requests"] += 1
+        failure = stub.failure()
+        if failure is not None:
+            return failure
+        if body.get("stream"):
+            stub.stats["streamed"] += 1
+            return StreamingResponse(stub.stream(body), media_type="text/event-stream")
+        return await stub.create(body)
+
+    @app.get("/stub/stats")
+    async def stats():
+        return stub.stats
+
+    @app.put("/stub/config")
+    async def configure(request: Request):
+        """Change options at runtime, e.g. {"TOKENS_PER_SECOND": 200}"""
+        stub.configure(stub.settings.model_copy(update=await request.json()))
+        return stub.settings.model_dump()
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--tokens-per-second", type=float)
+    parser.add_argument("--ttft-ms", type=float)
+    parser.add_argument("--error-rate", type=float)
+    parser.add_argument("--rate-limit-rate", type=float)
+    parser.add_argument("--no-tool-calls", action="store_true")
+    parser.add_argument("--templates", help="JSON file with text and json response templates")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    overrides = {
+        "TOKENS_PER_SECOND": args.tokens_per_second,
+        "TTFT_MS": args.ttft_ms,
+        "ERROR_RATE": args.error_rate,
+        "RATE_LIMIT_RATE": args.rate_limit_rate,
+        "TEMPLATES_PATH": args.templates,
+        "SEED": args.seed,
+    }
+    if args.no_tool_calls:
+        overrides["TOOL_CALLS"] = False
+    settings = StubSettings(**{k: v for k, v in overrides.items() if v is not None})
+
+    import uvicorn
+
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
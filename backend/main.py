@@ -1,15 +1,56 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
+from contextlib import aclosing, asynccontextmanager
+from agents import set_default_openai_client, set_tracing_disabled
 import uvicorn
 import json
-from src.agents.hypothesis_agent import create_agent_stream
-from src.agents.popup_optimization_agent import create_popup_agent_stream, create_popup_agent_stream_structured
-from src.agents.modification_agent import modify_popup_configuration, load_ui_schema
+from src.config import settings
+from src.metrics import CONTENT_TYPE, MetricsMiddleware, registry
+from src.utils import shopify_pool
+from src.scheduler import QueueFull, client_address, run_scheduler, scheduled
+from src.streaming import until_disconnected
+from src.agents.hypothesis_agent import create_agent_stream, get_hypothesis_agent
+from src.agents.popup_optimization_agent import (
+    create_popup_agent_stream,
+    create_popup_agent_stream_structured,
+    get_popup_agent,
+    run_metrics,
+    shutdown_executors as shutdown_tool_executors,
+    warm_executors as warm_tool_executors,
+)
+from src.agents.modification_agent import (
+    amodify_popup_configuration,
+    astream_popup_modification,
+    close_openai_client,
+    get_openai_client,
+    load_ui_schema,
+)
 import asyncio
 
-app = FastAPI(title="PopupGenius: AI-Powered E-Commerce Optimization API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Own the long-lived clients for the lifetime of the app"""
+    # Agent runs share the modification client, so OPENAI_BASE_URL and its pool limits apply to them too
+    set_default_openai_client(get_openai_client(), use_for_tracing=False)
+    if settings.OPENAI_BASE_URL:
+        # Traces of a stand-in model are not worth exporting
+        set_tracing_disabled(True)
+    # Build the shared agents and the prompt schema digest up front instead of on the first request
+    get_popup_agent()
+    get_hypothesis_agent()
+    load_ui_schema()
+    warm_tool_executors()
+    yield
+    await shopify_pool.aclose()
+    await close_openai_client()
+    shutdown_tool_executors()
+
+
+app = FastAPI(title="PopupGenius: AI-Powered E-Commerce Optimization API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,8 +58,71 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+
+def client_id(connection: Request | WebSocket) -> str:
+    """Key for per-client run limits: the client IP address (see client_address)"""
+    peer = connection.client.host if connection.client else "unknown"
+    return client_address(peer, connection.headers.get("x-forwarded-for"))
+
+
+def admit(connection: Request):
+    """Queue an agent run for the caller, or fail fast with a 429"""
+    try:
+        return run_scheduler.enqueue(client_id(connection))
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+class WebSocketInbox:
+    """
+    Reads client messages in the background, so a client that goes away in the
+    middle of a run is noticed without waiting for the next send
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.messages: asyncio.Queue = asyncio.Queue()
+        self.disconnected = asyncio.Event()
+        self.reader = asyncio.create_task(self._read(websocket))
+
+    async def _read(self, websocket: WebSocket):
+        try:
+            while True:
+                self.messages.put_nowait(await websocket.receive_text())
+        except Exception:
+            # WebSocketDisconnect, or a receive on a socket that is already closed
+            pass
+        finally:
+            self.disconnected.set()
+            self.messages.put_nowait(None)
+
+    async def receive_text(self) -> str:
+        message = await self.messages.get()
+        if message is None:
+            raise WebSocketDisconnect()
+        return message
+
+    async def is_disconnected(self) -> bool:
+        return self.disconnected.is_set()
+
+    def close(self):
+        self.reader.cancel()
+
+
+def rejected_event(error: QueueFull) -> dict:
+    return {
+        "type": "error",
+        "status": 429,
+        "message": str(error),
+        "retry_after": error.retry_after,
+        "timestamp": asyncio.get_event_loop().time()
+    }
+
 
 class ChatMessage(BaseModel):
     message: str
@@ -45,48 +149,75 @@ async def chat(chat_message: ChatMessage):
 
 
 @app.post("/popup-optimization")
-async def popup_optimization(request: PopupOptimizationRequest):
+async def popup_optimization(request: PopupOptimizationRequest, http_request: Request):
     """Main popup optimization endpoint with streaming response"""
     full_description = f"{request.business_description} {request.optimization_goals}".strip()
+    ticket = admit(http_request)
     
     async def generate():
-        async for chunk in create_popup_agent_stream(full_description):
-            yield f"data: {chunk}\n\n"
+        try:
+            # Plain text stream, so wait for the slot without queue events
+            async for _ in until_disconnected(ticket.wait(), http_request.is_disconnected):
+                pass
+            if await http_request.is_disconnected():
+                return
+            chunks = create_popup_agent_stream(full_description, *settings.coalescing("/popup-optimization"))
+            async for chunk in until_disconnected(chunks, http_request.is_disconnected):
+                yield f"data: {chunk}\n\n"
+        finally:
+            ticket.release()
 
-    return StreamingResponse(generate(), media_type="text/plain")
+    return StreamingResponse(generate(), media_type="text/plain", background=BackgroundTask(ticket.release))
 
 
 @app.post("/popup-optimization-structured")
-async def popup_optimization_structured(request: PopupOptimizationRequest):
+async def popup_optimization_structured(request: PopupOptimizationRequest, http_request: Request):
     """Structured popup optimization endpoint with rich JSON streaming for frontend UI"""
     full_description = f"{request.business_description} {request.optimization_goals}".strip()
+    ticket = admit(http_request)
     
     async def generate():
-        async for event in create_popup_agent_stream_structured(full_description):
+        events = create_popup_agent_stream_structured(
+            full_description, *settings.coalescing("/popup-optimization-structured")
+        )
+        # Stops the run as soon as the client goes away
+        async for event in until_disconnected(scheduled(ticket, events), http_request.is_disconnected):
             # Send each event as a JSON line for easy parsing
             yield f"data: {json.dumps(event)}\n\n"
 
-    return StreamingResponse(generate(), media_type="text/plain")
+    # Releases the slot if the stream never started
+    return StreamingResponse(generate(), media_type="text/plain", background=BackgroundTask(ticket.release))
 
 
 @app.websocket("/ws/popup-optimization")
 async def popup_optimization_websocket(websocket: WebSocket):
     """WebSocket endpoint for real-time popup optimization with structured events"""
     await websocket.accept()
+    inbox = WebSocketInbox(websocket)
     
     try:
         while True:
             # Receive message from client
-            data = await websocket.receive_text()
+            data = await inbox.receive_text()
             request_data = json.loads(data)
             
             business_description = request_data.get("business_description", "")
             optimization_goals = request_data.get("optimization_goals", "")
             full_description = f"{business_description} {optimization_goals}".strip()
             
+            try:
+                ticket = run_scheduler.enqueue(client_id(websocket))
+            except QueueFull as e:
+                await websocket.send_text(json.dumps(rejected_event(e)))
+                continue
+
             # Stream structured events for rich UI updates
-            async for event in create_popup_agent_stream_structured(full_description):
-                await websocket.send_text(json.dumps(event))
+            events = create_popup_agent_stream_structured(
+                full_description, *settings.coalescing("/ws/popup-optimization")
+            )
+            async with aclosing(until_disconnected(scheduled(ticket, events), inbox.is_disconnected)) as stream:
+                async for event in stream:
+                    await websocket.send_text(json.dumps(event))
             
     except WebSocketDisconnect:
         print("WebSocket disconnected")
@@ -96,36 +227,59 @@ async def popup_optimization_websocket(websocket: WebSocket):
             "message": f"Error: {str(e)}",
             "timestamp": asyncio.get_event_loop().time()
         }))
+    finally:
+        inbox.close()
 
 
 @app.websocket("/ws/popup-optimization-simple")
 async def popup_optimization_websocket_simple(websocket: WebSocket):
     """WebSocket endpoint for simple text streaming (backward compatibility)"""
     await websocket.accept()
+    inbox = WebSocketInbox(websocket)
     
     try:
         while True:
             # Receive message from client
-            data = await websocket.receive_text()
+            data = await inbox.receive_text()
             request_data = json.loads(data)
             
             business_description = request_data.get("business_description", "")
             optimization_goals = request_data.get("optimization_goals", "")
             full_description = f"{business_description} {optimization_goals}".strip()
-            
-            # Send progress updates and analysis results
-            await websocket.send_text(json.dumps({
-                "type": "analysis_start",
-                "message": "🚀 Starting PopupGenius analysis..."
-            }))
-            
-            # Stream the agent response
-            async for chunk in create_popup_agent_stream(full_description):
-                if chunk.strip():  # Only send non-empty chunks
-                    await websocket.send_text(json.dumps({
-                        "type": "analysis_chunk",
-                        "content": chunk
-                    }))
+
+            try:
+                ticket = run_scheduler.enqueue(client_id(websocket))
+            except QueueFull as e:
+                await websocket.send_text(json.dumps(rejected_event(e)))
+                continue
+
+            try:
+                async for position in until_disconnected(ticket.wait(), inbox.is_disconnected):
+                    await websocket.send_text(json.dumps({"type": "queued", "position": position}))
+                if inbox.disconnected.is_set():
+                    raise WebSocketDisconnect()
+
+                # Send progress updates and analysis results
+                await websocket.send_text(json.dumps({
+                    "type": "analysis_start",
+                    "message": "🚀 Starting PopupGenius analysis..."
+                }))
+
+                # Stream the agent response
+                chunks = create_popup_agent_stream(
+                    full_description, *settings.coalescing("/ws/popup-optimization-simple")
+                )
+                async with aclosing(until_disconnected(chunks, inbox.is_disconnected)) as stream:
+                    async for chunk in stream:
+                        if chunk.strip():  # Only send non-empty chunks
+                            await websocket.send_text(json.dumps({
+                                "type": "analysis_chunk",
+                                "content": chunk
+                            }))
+                if inbox.disconnected.is_set():
+                    raise WebSocketDisconnect()
+            finally:
+                ticket.release()
             
             # Send completion signal
             await websocket.send_text(json.dumps({
@@ -140,6 +294,8 @@ async def popup_optimization_websocket_simple(websocket: WebSocket):
             "type": "error",
             "message": f"Error: {str(e)}"
         }))
+    finally:
+        inbox.close()
 
 
 @app.post("/implement-popup-changes")
@@ -150,7 +306,7 @@ async def implement_popup_changes(request: PopupImplementationRequest):
         ui_schema = load_ui_schema()
         
         # Use modification agent to create new popup configuration
-        modified_config = modify_popup_configuration(
+        modified_config = await amodify_popup_configuration(
             instructions=request.insights,
             current_config=request.current_config,
             ui_schema_content=ui_schema
@@ -162,11 +318,57 @@ async def implement_popup_changes(request: PopupImplementationRequest):
         raise HTTPException(status_code=500, detail=f"Failed to implement changes: {str(e)}")
 
 
+@app.post("/implement-popup-changes/stream")
+async def implement_popup_changes_stream(request: PopupImplementationRequest, http_request: Request):
+    """
+    Streaming variant of /implement-popup-changes: config_update events carry the
+    configuration after each applied change, modification_complete the final one
+    """
+    async def generate():
+        events = astream_popup_modification(
+            instructions=request.insights,
+            current_config=request.current_config,
+            ui_schema_content=load_ui_schema()
+        )
+        # Stops generating as soon as the client goes away
+        async for event in until_disconnected(events, http_request.is_disconnected):
+            yield f"data: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(generate(), media_type="text/plain")
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "service": "PopupGenius API"}
 
 
+@app.get("/runs/stats")
+async def run_stats():
+    """Agent run counters, including runs cancelled on client disconnect and the tokens that saved"""
+    return {
+        **run_metrics.snapshot(),
+        "running": run_scheduler.running,
+        "queued": len(run_scheduler.waiting),
+        "scheduler": dict(run_scheduler.stats),
+    }
+
+
+if settings.METRICS_ENABLED:
+
+    @app.get("/metrics")
+    async def metrics():
+        """Request, stream, agent, tool, Shopify and Supabase metrics in the Prometheus text format"""
+        return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+
+if settings.SHOPIFY_POOL_STATS:
+
+    @app.get("/shopify/pool-stats")
+    async def shopify_pool_stats():
+        """Connection pool stats per Shopify store"""
+        return shopify_pool.stats()
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
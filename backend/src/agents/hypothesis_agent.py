@@ -15,14 +15,23 @@ def generate_random_number():
     return random.randint(1, 3)
 
 
-async def create_agent_stream(user_input: str):
-    agent = Agent(
-        name="Hypothesis Agent",
-        instructions="You are a helpful assistant that specializes in generating and analyzing hypotheses.",
-        tools=[generate_random_number],
-    )
+# Built once and shared by every request
+_hypothesis_agent: Agent | None = None
 
-    result = Runner.run_streamed(agent, input=user_input)
+
+def get_hypothesis_agent() -> Agent:
+    global _hypothesis_agent
+    if _hypothesis_agent is None:
+        _hypothesis_agent = Agent(
+            name="Hypothesis Agent",
+            instructions="You are a helpful assistant that specializes in generating and analyzing hypotheses.",
+            tools=[generate_random_number],
+        )
+    return _hypothesis_agent
+
+
+async def create_agent_stream(user_input: str):
+    result = Runner.run_streamed(get_hypothesis_agent(), input=user_input)
     async for event in result.stream_events():
         if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
             yield event.data.delta
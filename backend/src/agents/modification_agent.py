@@ -1,40 +1,90 @@
-import os
+import asyncio
+import copy
+import functools
 import json
 import re
-from typing import Dict, Any
-from openai import OpenAI
+import time
+from typing import AsyncGenerator, Dict, Any, List
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from pydantic import ValidationError
 
 from src.config import settings
+from src.config_scope import ConfigScope, scope_configuration
+from src.json_patch import JsonPatchError, apply_operation, apply_patch
+from src.metrics import modification_first_update, modification_tokens
+from src.schema_digest import schema_digest
+from src.streaming import JsonArrayParser
+from src.ui import FlexibleContent, SplitLayoutConfig
 
 
-def modify_popup_configuration(
-    instructions: str, current_config: Dict[str, Any], ui_schema_content: str
-) -> Dict[str, Any]:
-    """
-    Uses OpenAI's responses API to modify popup configuration based on instructions.
+_client: AsyncOpenAI | None = None
 
-    Args:
-        instructions: Natural language instructions for modifications
-        current_config: Current popup configuration as a dictionary
-        ui_schema_content: Content of the ui.py file as text
 
-    Returns:
-        Modified popup configuration as a dictionary
+def get_openai_client() -> AsyncOpenAI:
     """
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
+    The shared async client. Its connection pool is reused across requests
+    instead of opening a new client (and TLS connection) per call.
+    """
+    global _client
+    if _client is None:
+        _client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.OPENAI_BASE_URL,
+            timeout=settings.OPENAI_TIMEOUT,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=settings.OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE,
+                )
+            ),
+        )
+    return _client
+
+
+async def close_openai_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
 
-    prompt = f"""You are an expert UI/UX designer and developer specializing in popup optimization. 
+RESPONSE_FORMATS = {
+    "full": """Response format:
+Return ONLY a valid JSON object that represents the modified popup configuration. 
+Do not include any explanations, markdown formatting, or additional text.""",
+    "patch": """Response format:
+Return ONLY a JSON array of RFC 6902 JSON Patch operations ("add", "remove", "replace", "move", "copy")
+that turn the current configuration into the modified one, e.g.
+[{"op": "replace", "path": "/sections/main/components/0/properties/content", "value": "Special Offer!"}]
+- Paths are JSON Pointers into the current configuration; array elements are addressed by index
+- Only include operations for values that change; never repeat unchanged fields
+- Return [] if nothing needs to change
+Do not include any explanations, markdown formatting, or additional text.""",
+}
+
+
+@functools.lru_cache(maxsize=8)
+def modification_instructions(ui_schema_content: str, output: str) -> str:
+    """
+    The static part of the prompt: role, schema, guidelines and response format.
+    It is sent first and is identical for every request of an output mode, so
+    the API's prompt cache can reuse it.
+    """
+    return f"""You are an expert UI/UX designer and developer specializing in popup optimization. 
 Your task is to modify popup configurations based on natural language instructions.
 
 You will be given:
 1. Natural language instructions for modifications
-2. The current popup configuration (JSON)
-3. The UI schema definitions (Python Pydantic models)
+2. The current popup configuration (JSON), possibly only the sections and components the
+   instructions are about, with an outline of the whole popup
+3. A digest of the UI schema (models, fields, defaults and enum values)
 
 Your job is to:
 - Understand the modification request
 - Apply the changes to the popup configuration
-- Return a valid JSON configuration that follows the schema
+- Produce a valid configuration that follows the schema
 - Make intelligent design decisions that improve conversion rates
 - Ensure all modifications are technically feasible
 
@@ -49,56 +99,212 @@ Guidelines:
 - For fonts, use web-safe font families or common system fonts
 - For spacing, use consistent units (px, rem, %, etc.)
 - Keep component IDs stable unless renaming is specifically requested
+- When only part of the configuration is given, edit that part only; everything else stays as it is
 - Ensure visibility is set to true for components that should be shown
 
-Response format:
-Return ONLY a valid JSON object that represents the modified popup configuration. 
-Do not include any explanations, markdown formatting, or additional text.
-
-Please modify the following popup configuration based on these instructions:
+{RESPONSE_FORMATS[output]}"""
+
+
+def modification_input(
+    instructions: str, current_config: Dict[str, Any], output: str, outline: str | None = None
+) -> str:
+    """The per-request part of the prompt; outline describes the whole popup when current_config is a scope"""
+    if output == "patch":
+        # Compact: the model only needs to read it, and every input token counts
+        configuration = json.dumps(current_config, separators=(",", ":"))
+        request = "Return the JSON Patch operations."
+    else:
+        configuration = json.dumps(current_config, indent=2)
+        request = "Return the modified configuration as JSON."
+    context = ""
+    if outline:
+        context = f"""
+Popup outline (* marks the parts included in the configuration below; the rest stays unchanged):
+{outline}
+"""
+    return f"""Please modify the following popup configuration based on these instructions:
 
 Instructions: {instructions}
-
+{context}
 Current Configuration:
-{json.dumps(current_config, indent=2)}
+{configuration}
+
+{request}"""
+
+
+def record_token_usage(response: Any, output: str) -> None:
+    """Report the input, cached input and output tokens of one modification request"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    details = getattr(usage, "input_tokens_details", None)
+    tokens = {
+        "input": usage.input_tokens,
+        "cached_input": getattr(details, "cached_tokens", 0) or 0,
+        "output": usage.output_tokens,
+    }
+    for kind, count in tokens.items():
+        modification_tokens.observe(count, output=output, kind=kind)
+    print(f"Modification tokens ({output}): " + ", ".join(f"{kind}={count}" for kind, count in tokens.items()))
+
 
-Return the modified configuration as JSON."""
+def response_text(response: Any) -> str:
+    """Text of the first output message of a responses API result"""
+    for output_item in response.output:
+        if hasattr(output_item, "content") and output_item.content:
+            return output_item.content[0].text
+    raise ValueError("No content found in response")
 
+
+def parse_json_output(text: str, pattern: str) -> Any:
+    """JSON from model output; falls back to the first match of pattern when there is extra text"""
     try:
-        # Use the responses API
-        response = client.responses.create(
-            model="gpt-4.1",
-            input=prompt,
+        return json.loads(text)
+    except json.JSONDecodeError as e:
+        # Sometimes the model might include extra text
+        json_match = re.search(pattern, text, re.DOTALL)
+        if json_match:
+            return json.loads(json_match.group())
+        raise ValueError(f"Failed to parse JSON response: {e}")
+
+
+def parse_modified_config(response: Any) -> Dict[str, Any]:
+    """The configuration JSON from a responses API result; raises ValueError when there is none"""
+    return parse_json_output(response_text(response), r"\{.*\}")
+
+
+def parse_patch(response: Any) -> List[Dict[str, Any]]:
+    """The JSON Patch operations from a responses API result; raises ValueError when there are none"""
+    operations = parse_json_output(response_text(response), r"\[.*\]")
+    if isinstance(operations, dict) and isinstance(operations.get("patch"), list):
+        operations = operations["patch"]
+    if not isinstance(operations, list):
+        raise ValueError("Expected a JSON array of patch operations")
+    return operations
+
+
+def apply_modification_patch(current_config: Dict[str, Any], operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    The patched configuration. Raises ValueError if the patch does not apply, or
+    turns a configuration that is valid FlexibleContent into an invalid one
+    """
+    modified_config = apply_patch(current_config, operations)
+    if not isinstance(modified_config, dict):
+        raise JsonPatchError("The patch replaced the configuration with a non-object")
+    # A configuration that was not FlexibleContent to begin with has nothing to hold the result to
+    if is_flexible_content(current_config):
+        FlexibleContent.model_validate(modified_config)
+    return modified_config
+
+
+def modification_scope(instructions: str, current_config: Dict[str, Any]) -> ConfigScope | None:
+    """The part of the configuration to send for these instructions, None to send all of it"""
+    if not settings.MODIFICATION_SCOPING:
+        return None
+    scope = scope_configuration(instructions, current_config)
+    if scope is not None:
+        full, scoped = (len(json.dumps(config, separators=(",", ":"))) for config in (current_config, scope.config))
+        print(f"Modification scope: {scoped} of {full} characters of configuration")
+    return scope
+
+
+def merge_scoped_config(scope: ConfigScope, current_config: Dict[str, Any], modified: Dict[str, Any]) -> Dict[str, Any]:
+    """The full configuration with the modified scope merged in; raises ValueError if it does not fit or validate"""
+    merged = scope.merge(modified)
+    if is_flexible_content(current_config):
+        FlexibleContent.model_validate(merged)
+    return merged
+
+
+def is_flexible_content(config: Any) -> bool:
+    try:
+        FlexibleContent.model_validate(config)
+        return True
+    except ValidationError:
+        return False
+
+
+async def create_modification_response(
+    client: AsyncOpenAI,
+    instructions: str,
+    current_config: Dict[str, Any],
+    ui_schema_content: str,
+    output: str,
+    stream: bool = False,
+    outline: str | None = None,
+) -> Any:
+    """Responses API call for a modification; the static instructions form the cacheable prefix"""
+    return await client.responses.create(
+        model="gpt-4.1",
+        instructions=modification_instructions(ui_schema_content, output),
+        input=modification_input(instructions, current_config, output, outline),
+        prompt_cache_key=f"popup-modification-{output}",
+        stream=stream,
+    )
+
+
+async def amodify_popup_configuration(
+    instructions: str,
+    current_config: Dict[str, Any],
+    ui_schema_content: str,
+    client: AsyncOpenAI | None = None,
+    output: str | None = None,
+) -> Dict[str, Any]:
+    """
+    Uses OpenAI's responses API to modify popup configuration based on instructions,
+    without blocking the event loop.
+
+    Args:
+        instructions: Natural language instructions for modifications
+        current_config: Current popup configuration as a dictionary
+        ui_schema_content: Schema description for the prompt, see load_ui_schema
+        client: Client to use instead of the shared one
+        output: "patch" to have the model return JSON Patch operations that are
+            applied and validated here, "full" to have it return the whole
+            configuration; defaults to settings.MODIFICATION_OUTPUT
+
+    With settings.MODIFICATION_SCOPING, only the sections and components the
+    instructions are about are sent (see config_scope) and the result is merged
+    back; if that fails the whole configuration is sent instead.
+
+    Returns:
+        Modified popup configuration as a dictionary
+    """
+    client = client or get_openai_client()
+    output = output or settings.MODIFICATION_OUTPUT
+
+    async def request(config: Dict[str, Any], output: str, outline: str | None) -> Any:
+        response = await create_modification_response(
+            client, instructions, config, ui_schema_content, output, outline=outline
         )
+        record_token_usage(response, output)
+        return response
+
+    async def modify(scope: ConfigScope | None = None) -> Dict[str, Any]:
+        config, outline = (scope.config, scope.summary()) if scope is not None else (current_config, None)
+
+        def full_config(modified: Dict[str, Any]) -> Dict[str, Any]:
+            return merge_scoped_config(scope, current_config, modified) if scope is not None else modified
+
+        if output == "patch":
+            response = await request(config, "patch", outline)
+            try:
+                return full_config(apply_modification_patch(config, parse_patch(response)))
+            except ValueError as e:
+                # Unusable patch (bad JSON, bad pointer, invalid result): regenerate the whole configuration
+                print(f"Patch could not be applied, requesting the full configuration: {e}")
+
+        return full_config(parse_modified_config(await request(config, "full", outline)))
 
-        # Extract the response content
-        print(f"response: {response}")
-
-        # Find the output message in the response
-        output_message = None
-        for output_item in response.output:
-            if hasattr(output_item, "content") and output_item.content:
-                output_message = output_item
-                break
-
-        if output_message and output_message.content:
-            response_content = output_message.content[0].text
-        else:
-            raise ValueError("No content found in response")
-
-        # Parse the JSON response
-        try:
-            modified_config = json.loads(response_content)
-            return modified_config
-        except json.JSONDecodeError as e:
-            # If JSON parsing fails, try to extract JSON from the response
-            # Sometimes the model might include extra text
-            json_match = re.search(r"\{.*\}", response_content, re.DOTALL)
-            if json_match:
-                modified_config = json.loads(json_match.group())
-                return modified_config
-            else:
-                raise ValueError(f"Failed to parse JSON response: {e}")
+    try:
+        scope = modification_scope(instructions, current_config)
+        if scope is not None:
+            try:
+                return await modify(scope)
+            except ValueError as e:
+                print(f"Scoped modification failed, retrying with the whole configuration: {e}")
+
+        return await modify()
 
     except Exception as e:
         print(f"Error calling OpenAI API: {e}")
@@ -106,15 +312,130 @@ Return the modified configuration as JSON."""
         return current_config
 
 
-def load_ui_schema() -> str:
-    """Load the UI schema content from the ui.py file"""
+async def astream_popup_modification(
+    instructions: str,
+    current_config: Dict[str, Any],
+    ui_schema_content: str,
+    client: AsyncOpenAI | None = None,
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Streaming variant of amodify_popup_configuration for live previews.
+
+    In patch mode the model output is parsed while it is generated. Each patch
+    operation is applied as soon as it is complete, and a config_update event
+    carries the resulting configuration whenever it is valid. The closing
+    modification_complete event carries the final configuration. It comes
+    from the full-configuration fallback if the patch turns out to be
+    unusable, or is the original configuration on API errors. A scoped patch
+    (see amodify_popup_configuration) is merged back before every update.
+    """
+    client = client or get_openai_client()
+    started = time.perf_counter()
+
+    def complete(config: Dict[str, Any], operations: int, fallback: bool) -> Dict[str, Any]:
+        return {
+            "type": "modification_complete",
+            "config": config,
+            "operations": operations,
+            "fallback": fallback,
+            "timestamp": asyncio.get_event_loop().time()
+        }
+
+    yield {"type": "modification_start", "timestamp": asyncio.get_event_loop().time()}
+
     try:
-        ui_file_path = os.path.join(os.path.dirname(__file__), "..", "ui.py")
-        with open(ui_file_path, "r", encoding="utf-8") as f:
-            return f.read()
+        if settings.MODIFICATION_OUTPUT == "patch":
+            scope = modification_scope(instructions, current_config)
+            validate = is_flexible_content(current_config)
+
+            def full_config(config: Dict[str, Any]) -> Dict[str, Any]:
+                """The modified configuration to show; raises ValueError while it is invalid"""
+                if scope is not None:
+                    return merge_scoped_config(scope, current_config, config)
+                if validate:
+                    FlexibleContent.model_validate(config)
+                return config
+
+            config = copy.deepcopy(scope.config if scope is not None else current_config)
+            parser = JsonArrayParser()
+            operations = updates = 0
+            try:
+                response = await create_modification_response(
+                    client, instructions, config, ui_schema_content, "patch", stream=True,
+                    outline=scope.summary() if scope is not None else None
+                )
+                async with response as stream:
+                    async for event in stream:
+                        if event.type == "response.output_text.delta":
+                            for operation in parser.feed(event.delta):
+                                config = apply_operation(config, operation)
+                                if not isinstance(config, dict):
+                                    raise JsonPatchError("The patch replaced the configuration with a non-object")
+                                operations += 1
+                                # Intermediate states can be invalid (e.g. a component added before its type is set)
+                                try:
+                                    modified = full_config(config)
+                                except ValueError:
+                                    continue
+                                if not updates:
+                                    modification_first_update.observe(time.perf_counter() - started)
+                                updates += 1
+                                yield {
+                                    "type": "config_update",
+                                    "operation": operation,
+                                    "config": copy.deepcopy(modified),
+                                    "timestamp": asyncio.get_event_loop().time()
+                                }
+                        elif event.type == "response.completed":
+                            record_token_usage(event.response, "patch")
+
+                if not parser.done:
+                    raise ValueError("The patch ended before its closing bracket")
+                yield complete(full_config(config), operations, fallback=False)
+                return
+            except ValueError as e:
+                # Unusable patch (bad JSON, bad pointer, invalid result): regenerate the whole configuration
+                print(f"Patch could not be applied, requesting the full configuration: {e}")
+
+        response = await create_modification_response(client, instructions, current_config, ui_schema_content, "full")
+        record_token_usage(response, "full")
+        yield complete(parse_modified_config(response), 0, fallback=settings.MODIFICATION_OUTPUT == "patch")
+
     except Exception as e:
-        print(f"Error loading UI schema: {e}")
-        return ""
+        print(f"Error calling OpenAI API: {e}")
+        yield {"type": "error", "message": f"Failed to implement changes: {e}", "timestamp": asyncio.get_event_loop().time()}
+        # The original config, like the non-streaming path
+        yield complete(current_config, 0, fallback=False)
+
+
+def modify_popup_configuration(
+    instructions: str, current_config: Dict[str, Any], ui_schema_content: str
+) -> Dict[str, Any]:
+    """
+    Blocking version of amodify_popup_configuration for scripts. Uses its own
+    client, since the shared one belongs to the server's event loop.
+    """
+    async def run():
+        async with AsyncOpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL) as client:
+            return await amodify_popup_configuration(instructions, current_config, ui_schema_content, client)
+
+    return asyncio.run(run())
+
+
+@functools.cache
+def load_ui_schema() -> str:
+    """
+    Compact digest of the FlexibleContent models for the prompt, built once.
+    Lists fields, defaults, enum values and breakpoints instead of shipping the ui.py source
+    """
+    return schema_digest(
+        FlexibleContent,
+        SplitLayoutConfig,
+        notes=(
+            "layout.custom_properties holds the SplitLayoutConfig fields (split_ratio, popup_config, ...)",
+            "styles map each Breakpoint to CSS properties in camelCase, e.g. {\"max-sm\": {\"fontSize\": \"14px\"}}",
+        ),
+    )
 
 
 # Example usage
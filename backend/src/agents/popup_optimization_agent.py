@@ -1,10 +1,13 @@
 import os
 import asyncio
+import copy
 import json
+import time
+from contextlib import aclosing
 from typing import AsyncGenerator, Dict, Any
 from openai.types.responses import ResponseTextDeltaEvent
 
-from agents import Agent, Runner, function_tool
+from agents import Agent, RunContextWrapper, Runner, function_tool
 try:
     from agents import ItemHelpers
 except ImportError:
@@ -20,24 +23,21 @@ except ImportError:
             else:
                 return "Message content"
 
-import sys
-import os
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
-from config import settings
-from tools.popup import analyze_popup_history
-from tools.transaction import analyze_transaction_data
-from tools.competitor import analyze_competitors
+from src.config import settings
+from src.tools.popup import analyze_popup_history
+from src.tools.transaction import analyze_transaction_data
+from src.tools.competitor import analyze_competitors
+from src.metrics import estimate_tokens, events_per_run, run_metrics, time_to_first_token
+from src.run_cache import run_cache
+from src.streaming import coalesce_text_chunks
+from src.tools.runtime import (
+    format_tool_output, run_tool, shutdown_executors, tool_data_version, tool_name, warm_executors
+)
 
 os.environ["OPENAI_API_KEY"] = settings.OPENAI_API_KEY
 
 
-class PopupOptimizationAgent:
-    def __init__(self):
-        self.agent = Agent(
-            name="PopupGenius",
-            model="gpt-4.1",
-            instructions="""You are PopupGenius, an AI popup design expert specializing in e-commerce conversion optimization.
+POPUP_AGENT_INSTRUCTIONS = """You are PopupGenius, an AI popup design expert specializing in e-commerce conversion optimization.
 
                 Your mission is to analyze user behavior and competitive landscape to provide specific, actionable popup design recommendations.
 
@@ -60,76 +60,185 @@ class PopupOptimizationAgent:
                 - Form elements and user experience
                 - Mobile vs desktop considerations
 
-                Avoid discussing revenue projections, sales numbers, or complex ROI calculations. Focus on actionable design changes.""",
-            tools=[analyze_popup_history, analyze_transaction_data, analyze_competitors],
+                Avoid discussing revenue projections, sales numbers, or complex ROI calculations. Focus on actionable design changes."""
+
+
+# Analysis tools run up front for every request, with their progress descriptions
+TOOL_DESCRIPTIONS = {
+    "analyze_popup_history": "🎨 Analyzing Current Popup Design Performance",
+    "analyze_transaction_data": "👥 Understanding User Behavior Patterns",
+    "analyze_competitors": "🌐 Researching Competitor Design Strategies",
+}
+
+
+class PopupRunContext:
+    """State that belongs to a single optimization run; the agent itself is shared between runs"""
+
+    def __init__(self, user_input: str):
+        self.user_input = user_input
+        self.tool_outputs: Dict[str, str] = {}
+        # Set when a tool or the model run failed; such runs are not cached
+        self.failed = False
+        # The streamed model run, once started
+        self.result = None
+        self.output_chars = 0
+        self.cancelled = False
+        self.started = time.perf_counter()
+        self.events = 0
+
+    def cancel(self) -> None:
+        """Stop the model run; used when nobody is reading the stream any more"""
+        self.cancelled = True
+        self.failed = True
+        if self.result is not None and not self.result.is_complete:
+            self.result.cancel()
+
+    def output_tokens(self) -> int:
+        """Output tokens reported by the model, or an estimate from the streamed text"""
+        usage = getattr(getattr(self.result, "context_wrapper", None), "usage", None)
+        tokens = getattr(usage, "output_tokens", 0)
+        if isinstance(tokens, int) and tokens > 0:
+            return tokens
+        return estimate_tokens(self.output_chars)
+
+    def agent_input(self) -> str:
+        """User input with the prefetched tool results appended"""
+        if not self.tool_outputs:
+            return self.user_input
+        results = "\n\n".join(f"### {name}\n{output}" for name, output in self.tool_outputs.items())
+        return (
+            f"{self.user_input}\n\n"
+            "The following analyses have already been run for this business. "
+            f"Use their results instead of calling those tools again.\n\n{results}"
         )
 
-    async def create_stream(self, user_input: str) -> AsyncGenerator[Dict[str, Any], None]:
-        """Create streaming response for popup optimization analysis with structured events"""
-        result = Runner.run_streamed(self.agent, input=user_input)
-        
+
+def unless_prefetched(agent_tool: Any) -> Any:
+    """Copy of an agent tool that is disabled in runs whose PopupRunContext already holds its result"""
+    if not hasattr(agent_tool, "is_enabled"):
+        return agent_tool
+    name = tool_name(agent_tool)
+
+    def is_enabled(context: RunContextWrapper[Any], agent: Agent) -> bool:
+        run = context.context
+        return not isinstance(run, PopupRunContext) or name not in run.tool_outputs
+
+    enabled = copy.copy(agent_tool)
+    enabled.is_enabled = is_enabled
+    return enabled
+
+
+class PopupOptimizationAgent:
+    def __init__(self):
+        # One agent for every run; each run passes its PopupRunContext as the run context,
+        # which hides the tools it already prefetched
+        self.agent = Agent(
+            name="PopupGenius",
+            model="gpt-4.1",
+            instructions=POPUP_AGENT_INSTRUCTIONS,
+            tools=[
+                unless_prefetched(agent_tool)
+                for agent_tool in (analyze_popup_history, analyze_transaction_data, analyze_competitors)
+            ],
+        )
+
+    async def prefetch_tools(self, run: PopupRunContext) -> AsyncGenerator[Dict[str, Any], None]:
+        """Run the analysis tools concurrently; tool_complete events arrive in completion order"""
+        async def call(name):
+            try:
+                return name, format_tool_output(await run_tool(name, business_description=run.user_input)), None
+            except Exception as e:
+                return name, None, e
+
+        tasks = [asyncio.create_task(call(name)) for name in TOOL_DESCRIPTIONS]
+        try:
+            for name, description in TOOL_DESCRIPTIONS.items():
+                yield {
+                    "type": "tool_start",
+                    "tool_name": name,
+                    "tool_description": description,
+                    "arguments": {"business_description": (run.user_input or "")[:100]},
+                    "timestamp": asyncio.get_event_loop().time()
+                }
+
+            for next_done in asyncio.as_completed(tasks):
+                name, output, error = await next_done
+                if error is None:
+                    run.tool_outputs[name] = output
+                else:
+                    run.failed = True
+                yield {
+                    "type": "tool_complete",
+                    "tool_name": name,
+                    "tool_output": output if error is None else f"{name} failed: {error}",
+                    "error": error is not None,
+                    "timestamp": asyncio.get_event_loop().time()
+                }
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def create_stream(self, user_input: str, run: PopupRunContext | None = None
+                            ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Create streaming response for popup optimization analysis with structured events.
+        Closing the stream early (client disconnect) cancels the model run and pending tools.
+        """
+        run = run or PopupRunContext(user_input)
+        events = self._run_events(user_input, run)
+        try:
+            async for event in events:
+                run.events += 1
+                yield event
+        except (GeneratorExit, asyncio.CancelledError):
+            # Nobody is reading any more: stop paying for the run
+            run.cancel()
+            run_metrics.run_cancelled(run.output_tokens())
+            events_per_run.observe(run.events, outcome="cancelled", cache="miss")
+            raise
+        else:
+            run_metrics.run_completed(run.output_tokens())
+            events_per_run.observe(run.events, outcome="failed" if run.failed else "completed", cache="miss")
+        finally:
+            await events.aclose()
+
+    async def _run_events(self, user_input: str, run: PopupRunContext) -> AsyncGenerator[Dict[str, Any], None]:
         # Send initial start event
         yield {
             "type": "analysis_start",
             "message": "🚀 Starting PopupGenius analysis...",
             "timestamp": asyncio.get_event_loop().time()
         }
-        
-        # Simulate tool execution for demo purposes
-        tools = [
-            ("analyze_popup_history", "🎨 Analyzing Current Popup Design Performance"),
-            ("analyze_transaction_data", "👥 Understanding User Behavior Patterns"),
-            ("analyze_competitors", "🌐 Researching Competitor Design Strategies")
-        ]
-        
-        for tool_name, tool_description in tools:
-            # Send tool start event
-            yield {
-                "type": "tool_start",
-                "tool_name": tool_name,
-                "tool_description": tool_description,
-                "arguments": {"business_description": user_input[:100]},
-                "timestamp": asyncio.get_event_loop().time()
-            }
-            
-            # Simulate processing time
-            await asyncio.sleep(0.5)
-            
-            # Send tool complete event with realistic insights
-            tool_insights = {
-                "analyze_popup_history": "Current design lacks visual hierarchy and urgency elements",
-                "analyze_transaction_data": "Users prefer single-step forms and exit-intent triggers",
-                "analyze_competitors": "Top performers use bold CTAs with contrasting colors"
-            }
-            
-            yield {
-                "type": "tool_complete",
-                "tool_name": tool_name,
-                "tool_output": tool_insights.get(tool_name, f"Analysis complete for {tool_name}"),
-                "timestamp": asyncio.get_event_loop().time()
-            }
-        
-        # Buffer for accumulating text
-        text_buffer = ""
-        
+
+        async with aclosing(self.prefetch_tools(run)) as prefetch:
+            async for event in prefetch:
+                yield event
+
+        # Tools that failed to prefetch stay available for the model to call itself
+        result = run.result = Runner.run_streamed(self.agent, input=run.agent_input(), context=run)
+
         # Stream the actual agent response
         try:
             async for event in result.stream_events():
-                # Handle raw response text streaming
+                # Handle raw response text streaming; one event per delta, callers
+                # batch them with coalesce_text_chunks
                 if event.type == "raw_response_event" and hasattr(event, 'data'):
                     if isinstance(event.data, ResponseTextDeltaEvent):
-                        text_buffer += event.data.delta
+                        delta = event.data.delta
                     elif hasattr(event.data, 'delta'):
-                        text_buffer += str(event.data.delta)
-                    
-                    # Send chunks when we have enough text or hit natural breaks
-                    if len(text_buffer) > 50 or any(punct in text_buffer for punct in ['.', '!', '?', '\n']):
+                        delta = str(event.data.delta)
+                    else:
+                        delta = ""
+
+                    if delta:
+                        if not run.output_chars:
+                            time_to_first_token.observe(time.perf_counter() - run.started)
+                        run.output_chars += len(delta)
                         yield {
                             "type": "text_chunk",
-                            "content": text_buffer,
+                            "content": delta,
                             "timestamp": asyncio.get_event_loop().time()
                         }
-                        text_buffer = ""
                 
                 # Handle tool execution events (when real agents are available)
                 elif event.type == "run_item_stream_event" and hasattr(event, 'item'):
@@ -137,23 +246,16 @@ class PopupOptimizationAgent:
                         if hasattr(event.item, 'type'):
                             if event.item.type == "tool_call_item" and hasattr(event.item, 'tool_call'):
                                 # Tool is being called
-                                tool_name = event.item.tool_call.function.name
+                                called_tool = event.item.tool_call.function.name
                                 try:
                                     tool_args = json.loads(event.item.tool_call.function.arguments)
                                 except:
                                     tool_args = {}
                                 
-                                # Map tool names to user-friendly descriptions
-                                tool_descriptions_map = {
-                                    "analyze_popup_history": "🎨 Analyzing Current Popup Design Performance",
-                                    "analyze_transaction_data": "👥 Understanding User Behavior Patterns", 
-                                    "analyze_competitors": "🌐 Researching Competitor Design Strategies"
-                                }
-                                
                                 yield {
                                     "type": "tool_start",
-                                    "tool_name": tool_name,
-                                    "tool_description": tool_descriptions_map.get(tool_name, f"🔧 Running {tool_name}"),
+                                    "tool_name": called_tool,
+                                    "tool_description": TOOL_DESCRIPTIONS.get(called_tool, f"🔧 Running {called_tool}"),
                                     "arguments": tool_args,
                                     "timestamp": asyncio.get_event_loop().time()
                                 }
@@ -189,16 +291,9 @@ class PopupOptimizationAgent:
                         "agent_name": event.new_agent.name,
                         "timestamp": asyncio.get_event_loop().time()
                     }
-            
-            # Send any remaining buffered text
-            if text_buffer.strip():
-                yield {
-                    "type": "text_chunk",
-                    "content": text_buffer,
-                    "timestamp": asyncio.get_event_loop().time()
-                }
         
         except Exception as e:
+            run.failed = True
             # If streaming fails, provide fallback response with readable chunks
             fallback_chunks = [
                 f"🚀 **PopupGenius Design Analysis for:** {user_input[:100]}...\n\n",
@@ -231,26 +326,76 @@ class PopupOptimizationAgent:
                 }
                 await asyncio.sleep(0.3)  # Simulate realistic streaming pace
 
-    async def create_simple_stream(self, user_input: str) -> AsyncGenerator[str, None]:
+    async def create_simple_stream(self, user_input: str, max_bytes: int = 512, max_delay: float = 0.05
+                                   ) -> AsyncGenerator[str, None]:
         """Create simple text streaming for backward compatibility"""
-        async for event in self.create_stream(user_input):
+        async for event in coalesce_text_chunks(self.create_stream(user_input), max_bytes, max_delay):
             if event["type"] == "text_chunk":
                 yield event["content"]
 
 
-async def create_popup_agent_stream(user_input: str) -> AsyncGenerator[str, None]:
+# Built once and shared by every request; runs keep their own state in PopupRunContext
+_popup_agent: PopupOptimizationAgent | None = None
+
+
+def get_popup_agent() -> PopupOptimizationAgent:
+    """Shared PopupOptimizationAgent, built on first use (or at startup by the app lifespan)"""
+    global _popup_agent
+    if _popup_agent is None:
+        _popup_agent = PopupOptimizationAgent()
+    return _popup_agent
+
+
+async def create_popup_agent_stream(user_input: str, max_bytes: int = 512, max_delay: float = 0.05
+                                    ) -> AsyncGenerator[str, None]:
     """Factory function to create popup optimization agent stream (backward compatible)"""
-    agent = PopupOptimizationAgent()
-    async for chunk in agent.create_simple_stream(user_input):
+    agent = get_popup_agent()
+    async for chunk in agent.create_simple_stream(user_input, max_bytes, max_delay):
         yield chunk
 
 
-async def create_popup_agent_stream_structured(user_input: str) -> AsyncGenerator[Dict[str, Any], None]:
-    """Factory function to create structured popup optimization agent stream"""
-    agent = PopupOptimizationAgent()
-    async for event in agent.create_stream(user_input):
+async def create_popup_agent_stream_structured(user_input: str, max_bytes: int = 512, max_delay: float = 0.05
+                                               ) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Factory function to create structured popup optimization agent stream.
+    Text is coalesced into chunks of up to max_bytes or max_delay seconds of output.
+    """
+    async for event in coalesce_text_chunks(_structured_events(user_input), max_bytes, max_delay):
+        yield event
+
+
+async def _structured_events(user_input: str) -> AsyncGenerator[Dict[str, Any], None]:
+    """Structured events of a run, replayed from the run cache when possible"""
+    # Runs are only replayed while the tool data they were computed from is unchanged
+    version = tool_data_version()
+    if settings.RUN_CACHE_ENABLED:
+        cached = run_cache.lookup(user_input, version)
+        if cached is not None:
+            events = 0
+            try:
+                async for event in run_cache.replay(cached):
+                    events += 1
+                    yield event
+            except (GeneratorExit, asyncio.CancelledError):
+                run_metrics.run_cancelled(0, cached=True)
+                events_per_run.observe(events, outcome="cancelled", cache="hit")
+                raise
+            run_metrics.run_completed(0, cached=True)
+            events_per_run.observe(events, outcome="completed", cache="hit")
+            return
+
+    run = PopupRunContext(user_input)
+    loop = asyncio.get_event_loop()
+    started = loop.time()
+    recorded = []
+    async for event in get_popup_agent().create_stream(user_input, run):
+        recorded.append((loop.time() - started, event))
         yield event
 
+    # Only complete, successful runs are replayed for later requests
+    if settings.RUN_CACHE_ENABLED and not run.failed:
+        run_cache.store(user_input, recorded, version)
+
 
 if __name__ == "__main__":
     async def test_agent():
@@ -0,0 +1,94 @@
+"""
+In-process caches:
+AnalyticsCache, a stale-while-revalidate, single-flight cache around
+ShopifyService analytics, built on TTLCache (LRU + TTL)
+"""
+
+import asyncio
+import collections
+import time
+from typing import Any, Awaitable, Callable, Hashable
+
+from src.config import settings
+from src.ttl_cache import TTLCache
+from src.utils import LOOKBACK_DAYS, ROLLUP_WINDOWS, ShopifyService
+
+
+class AnalyticsCache:
+    """
+    Stale-while-revalidate cache for store analytics, keyed by (store, metric, lookback window).
+
+    - fresh hit: returned as is
+    - stale hit: returned as is while a background refresh runs
+    - miss: the caller waits for the load
+
+    Loads are single-flight: concurrent callers of the same key share one
+    in-flight scan. Cached values are shared between callers, treat them as read-only.
+    """
+
+    def __init__(self, ttl: float = settings.ANALYTICS_CACHE_TTL, stale_ttl: float = settings.ANALYTICS_CACHE_STALE_TTL,
+                 maxsize: int = settings.ANALYTICS_CACHE_SIZE, clock: Callable[[], float] = time.monotonic):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl, stale_ttl=stale_ttl, clock=clock)
+        self.in_flight: dict[Hashable, asyncio.Task] = {}
+        self.stats = collections.Counter()
+
+    async def get(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> Any:
+        hit = self.entries.lookup(key)
+        if hit is not None:
+            value, fresh = hit
+            if fresh:
+                self.stats["hits"] += 1
+            else:
+                self.stats["stale_hits"] += 1
+                self.refresh(key, load)
+            return value
+
+        self.stats["misses"] += 1
+        # Shielded so one cancelled caller does not cancel the load for everyone else
+        return await asyncio.shield(self.refresh(key, load))
+
+    def refresh(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """Start loading key unless a load is already in flight; returns the shared task."""
+        task = self.in_flight.get(key)
+        if task is None:
+            self.stats["loads"] += 1
+            task = asyncio.create_task(self._load(key, load))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return task
+
+    async def _load(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> Any:
+        value = await load()
+        self.entries.set(key, value)
+        return value
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        if not task.cancelled() and task.exception() is not None:
+            # Callers waiting on a miss see the exception; a failed background
+            # refresh leaves the stale value in place
+            self.stats["errors"] += 1
+            print(f"Analytics refresh failed for {key}: {task.exception()}")
+
+    def invalidate(self, store_url: str | None = None) -> None:
+        """Drop cached analytics for one store, or for every store."""
+        for key in list(self.entries.entries):
+            if store_url is None or key[0] == store_url:
+                self.entries.pop(key)
+
+    async def fetch_30d_sales(self, service: ShopifyService) -> dict[str, Any]:
+        return await self.get((service.store_url, "sales", LOOKBACK_DAYS), service.fetch_30d_sales)
+
+    async def calculate_aov(self, service: ShopifyService) -> float:
+        return await self.get((service.store_url, "aov", LOOKBACK_DAYS), service.calculate_aov)
+
+    async def fetch_store_analytics(self, service: ShopifyService,
+                                    windows: tuple[int, ...] = ROLLUP_WINDOWS) -> dict[str, Any]:
+        windows = tuple(sorted(windows))
+        return await self.get(
+            (service.store_url, "analytics", windows), lambda: service.fetch_store_analytics(windows)
+        )
+
+
+analytics_cache = AnalyticsCache()
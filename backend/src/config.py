@@ -3,6 +3,8 @@ API Config:
 Automatically loads environment variables
 """
 
+from typing import Literal
+
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings
 
@@ -27,6 +29,15 @@ class APISettings(BaseSettings):
 
     # OpenAI config
     OPENAI_API_KEY: str | None = None
+    OPENAI_BASE_URL: str | None = None  # OpenAI-compatible endpoint, e.g. loadtest/openai_stub.py
+    # Shared async client for direct API calls (popup modification); the agents SDK manages its own
+    OPENAI_MAX_CONNECTIONS: int = 100
+    OPENAI_MAX_KEEPALIVE: int = 20
+    OPENAI_TIMEOUT: float = 120.0
+    # Popup modification output: "patch" (JSON Patch applied and validated server side) or "full" (whole config)
+    MODIFICATION_OUTPUT: Literal["patch", "full"] = "patch"
+    # Send only the sections and components an instruction is about (plus an outline), merged back afterwards
+    MODIFICATION_SCOPING: bool = True
 
     # Shopify
     # SHOPIFY_CLIENT_SECRET: str | None = None
@@ -34,11 +45,85 @@ class APISettings(BaseSettings):
     # SHOPIFY_API_VERSION: str | None = None
     # SHOPIFY_STOREFRONT_API_VERSION: str | None = None
 
+    # Shopify connection pool (one pool per store, shared for the app lifetime)
+    SHOPIFY_HTTP2: bool = True
+    SHOPIFY_POOL_MAX_CONNECTIONS: int = 10
+    SHOPIFY_POOL_MAX_KEEPALIVE: int = 5
+    SHOPIFY_POOL_KEEPALIVE_EXPIRY: float = 30.0
+    SHOPIFY_POOL_STATS: bool = False  # expose GET /shopify/pool-stats
+
+    # Shopify order scans: paginated, bulk, or auto (an ordersCount request per scan picks one;
+    # worth it for stores that can reach the bulk threshold)
+    SHOPIFY_SCAN_MODE: str = "paginated"
+    SHOPIFY_BULK_MIN_ORDERS: int = 10000  # auto mode switches to bulk operations at this volume
+    SHOPIFY_BULK_POLL_INTERVAL: float = 2.0
+    SHOPIFY_SCAN_SHARDS: int = 1  # >1 pages that many processed_at ranges concurrently
+    SHOPIFY_SCAN_MAX_IN_FLIGHT: int = 4
+    SHOPIFY_SCAN_LINE_ITEMS: int = 100  # line items fetched with each order in the main scan
+    SHOPIFY_LINE_ITEM_PAGE_SIZE: int = 50  # follow-up page size for orders with more line items
+    SHOPIFY_LINE_ITEM_BATCH: int = 4  # orders continued per follow-up request
+
+    # Shopify GraphQL cost-based throttling
+    SHOPIFY_PAGE_SIZE: int = 250  # upper bound for the adaptive orders page size
+    SHOPIFY_MAX_QUERY_COST: int = 1000  # single query cost limit
+    SHOPIFY_DEFAULT_QUERY_COST: float = 10.0  # estimate for queries we have not seen yet
+    SHOPIFY_THROTTLE_MAX_RETRIES: int = 5
+
+    # Incremental 30d sales rollups (per-day buckets + processed_at watermark); runtime state, gitignored
+    SALES_ROLLUP_STORE_PATH: str = "data/sales_rollups.json"
+
+    # Store analytics cache (stale-while-revalidate, single-flight refreshes)
+    ANALYTICS_CACHE_TTL: float = 300.0  # seconds a cached result is fresh
+    ANALYTICS_CACHE_STALE_TTL: float = 3600.0  # seconds a stale result may be served while refreshing
+    ANALYTICS_CACHE_SIZE: int = 256
+
+    # Agent tool execution (kept off the event loop)
+    TOOL_THREAD_WORKERS: int = 8
+    TOOL_PROCESS_WORKERS: int = 2  # for cpu_bound tools; 0 runs them in the thread pool
+    TOOL_TIMEOUT: float = 30.0  # seconds per tool call
+    TOOL_TIMEOUTS: dict[str, float] = {}  # per-tool overrides, e.g. {"analyze_competitors": 10}
+    TOOL_MEMO_TTL: float = 600.0  # seconds memoized tool results stay valid
+    TOOL_MEMO_SIZE: int = 256
+
+    # Agent run cache (replays recorded event streams for repeat and near-duplicate inputs)
+    RUN_CACHE_ENABLED: bool = True
+    RUN_CACHE_TTL: float = 3600.0
+    RUN_CACHE_SIZE: int = 512
+    # Replay near duplicates too (same numbers and negations, shingle Jaccard similarity >= RUN_CACHE_SIMILARITY);
+    # off by default, exact normalized inputs only
+    RUN_CACHE_NEAR_DUPLICATES: bool = False
+    RUN_CACHE_SIMILARITY: float = 0.85  # minimum shingle Jaccard similarity for a near-duplicate hit
+    RUN_CACHE_REPLAY_SPEED: float = 4.0  # replay at this multiple of the recorded pace; 0 = no delay
+
+    # Admission control for agent runs
+    RUN_MAX_CONCURRENT: int = 32  # agent runs in progress across all clients
+    RUN_MAX_PER_CLIENT: int = 2  # agent runs in progress per client IP address
+    # Proxies (addresses or CIDR networks) whose X-Forwarded-For is trusted for the client address;
+    # without them, clients behind one proxy or NAT share RUN_MAX_PER_CLIENT
+    RUN_TRUSTED_PROXIES: list[str] = []
+    RUN_QUEUE_SIZE: int = 64  # runs allowed to wait; beyond this requests get a 429
+    RUN_EXPECTED_SECONDS: float = 30.0  # initial run duration estimate for Retry-After
+
+    # Text chunk coalescing for streamed agent output (first chunk is always sent immediately)
+    STREAM_COALESCE_BYTES: int = 512  # flush once this much text is buffered
+    STREAM_COALESCE_MS: float = 50.0  # or once the oldest buffered text is this old
+    STREAM_COALESCE_OVERRIDES: dict[str, dict[str, float]] = {}  # per endpoint, e.g. {"/ws/popup-optimization": {"ms": 20}}
+
+    # Prometheus text-format metrics at GET /metrics
+    METRICS_ENABLED: bool = True
+
     # Langchain
     LANGSMITH_TRACING: bool | None = None
     LANGSMITH_ENDPOINT: str | None = None
     LANGSMITH_API_KEY: str | None = None
     LANGSMITH_PROJECT: str | None = None
 
+    def coalescing(self, endpoint: str) -> tuple[int, float]:
+        """(max_bytes, max_delay in seconds) for text coalescing on an endpoint"""
+        override = self.STREAM_COALESCE_OVERRIDES.get(endpoint, {})
+        max_bytes = int(override.get("bytes", self.STREAM_COALESCE_BYTES))
+        max_delay = override.get("ms", self.STREAM_COALESCE_MS) / 1000
+        return max_bytes, max_delay
+
 
 settings = APISettings()
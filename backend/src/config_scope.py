@@ -0,0 +1,221 @@
+"""
+Configuration scope:
+Picks the sections and components of a popup configuration that a modification
+instruction is about (by component id, type and text), so only those are sent
+to the model together with a short outline of the rest of the popup, and merges
+the edited parts back into the full configuration
+"""
+
+import copy
+import re
+from typing import Any, Dict, List
+
+_WORD = re.compile(r"[a-z0-9]+")
+_QUOTED = re.compile(r"[\"'‘’“”]([^\"'‘’“”]{2,})[\"'‘’“”]")
+
+# Instructions about the popup as a whole are not scoped
+GLOBAL_TERMS = {"everything", "entire", "whole", "overall", "theme", "redesign", "rearrange", "reorder", "restructure"}
+# Terms that need layout (popup size, overlay, close button, gradient, split) in the scope
+LAYOUT_TERMS = {
+    "layout", "popup", "overlay", "backdrop", "background", "gradient", "close", "split", "ratio",
+    "mobile", "stack", "stacked", "viewport", "size", "width", "height", "shadow", "border", "radius",
+}
+# Words that name a component type without being its value
+TYPE_ALIASES = {
+    "heading": "text", "headline": "text", "title": "text", "subtitle": "text", "copy": "text", "label": "text",
+    "cta": "button", "logo": "image", "picture": "image", "photo": "image", "field": "input", "email": "input",
+    "quiz": "quiz_option", "option": "quiz_option", "product": "product_card", "discount": "discount_display",
+}
+# Too generic to select anything when they appear in an id or name
+GENERIC_WORDS = {"section", "component", "container", "wrapper"}
+
+
+def words(text: str) -> set[str]:
+    """Lowercase words of text, with a plural s dropped"""
+    found = set()
+    for word in _WORD.findall(text.lower()):
+        found.add(word)
+        if len(word) > 3 and word.endswith("s"):
+            found.add(word[:-1])
+    return found
+
+
+def name_words(name: str) -> set[str]:
+    """Words of an id or name that can identify it (no numbers, short or generic words)"""
+    return {word for word in _WORD.findall(name.lower()) if len(word) > 2 and not word.isdigit()} - GENERIC_WORDS
+
+
+def component_text(component: Dict[str, Any]) -> str:
+    properties = component.get("properties") or {}
+    return " ".join(str(properties[key]) for key in ("content", "placeholder", "alt") if properties.get(key))
+
+
+def component_matches(component: Dict[str, Any], terms: set[str], instructions: str, quoted: List[str]) -> bool:
+    component_type = str(component.get("type", ""))
+    if name_words(str(component.get("id", ""))) & terms:
+        return True
+    if component_type in terms or component_type in {TYPE_ALIASES.get(term) for term in terms}:
+        return True
+    text = component_text(component).lower()
+    if not text:
+        return False
+    # The component's text is quoted in the instruction, or the instruction quotes part of it
+    return (len(text) > 3 and text in instructions) or any(phrase in text for phrase in quoted)
+
+
+def _excerpt(text: str, length: int = 30) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= length else text[:length - 3] + "..."
+
+
+class ConfigScope:
+    """
+    The part of a configuration sent to the model and how to put it back.
+
+    config holds the layout if it is in scope and, for every section in scope,
+    the section with only the components in scope. merge() takes the edited
+    version of config and returns the full configuration.
+    """
+
+    def __init__(self, original: Dict[str, Any], components: Dict[str, List[int] | None], layout: bool):
+        self.original = original
+        # Section id -> indices of the components in scope, None for the whole section
+        self.components = components
+        self.layout = layout
+        self.config: Dict[str, Any] = {"sections": {}}
+        if layout:
+            self.config = {"layout": copy.deepcopy(original["layout"]), "sections": {}}
+        for section_id, indices in components.items():
+            section = copy.deepcopy(original["sections"][section_id])
+            if indices is not None:
+                section["components"] = [section["components"][index] for index in indices]
+            self.config["sections"][section_id] = section
+
+    def summary(self) -> str:
+        """Outline of the whole popup; * marks the parts included in config"""
+        layout = self.original.get("layout") or {}
+        lines = [f"{'* ' if self.layout else ''}layout: {layout.get('type', 'unknown')}"]
+        for section_id, section in self.original["sections"].items():
+            indices = self.components.get(section_id, [])
+            marker = "* " if section_id in self.components and indices is None else ""
+            lines.append(f"{marker}section {section_id} \"{section.get('name', '')}\" ({section.get('layout', 'vertical')}):")
+            for index, component in enumerate(section.get("components", [])):
+                marker = "* " if indices is None or index in indices else ""
+                text = component_text(component)
+                lines.append(
+                    f"  {marker}{component.get('id')}: {component.get('type')}" + (f" \"{_excerpt(text)}\"" if text else "")
+                )
+        return "\n".join(lines)
+
+    def merge(self, edited: Any) -> Dict[str, Any]:
+        """
+        The full configuration with the edited parts in place. Raises ValueError
+        if edited does not fit the scope.
+        """
+        if not isinstance(edited, dict) or not isinstance(edited.get("sections"), dict):
+            raise ValueError("The scoped configuration lost its sections")
+        merged = copy.deepcopy(self.original)
+        if self.layout:
+            if not isinstance(edited.get("layout"), dict):
+                raise ValueError("The scoped configuration lost its layout")
+            merged["layout"] = edited["layout"]
+
+        sections = merged["sections"]
+        for section_id in self.components:
+            if section_id not in edited["sections"]:
+                del sections[section_id]
+        for section_id, section in edited["sections"].items():
+            if section_id not in self.components:
+                if section_id in sections:
+                    raise ValueError(f"Section {section_id!r} is not in scope")
+                sections[section_id] = section
+            elif self.components[section_id] is None:
+                sections[section_id] = section
+            else:
+                sections[section_id] = self.merge_section(sections[section_id], section, self.components[section_id])
+        return merged
+
+    def merge_section(self, original: Dict[str, Any], edited: Dict[str, Any], indices: List[int]) -> Dict[str, Any]:
+        """
+        Edited components replace the originals with the same id and stay in their
+        original positions; removed ones are dropped and new ones are inserted after
+        the component they follow in the edited list
+        """
+        if not isinstance(edited, dict) or not isinstance(edited.get("components"), list):
+            raise ValueError(f"Section {original.get('id')!r} lost its components")
+        components = original["components"]
+        scoped_ids = {components[index]["id"] for index in indices}
+        other_ids = {component["id"] for component in components} - scoped_ids
+
+        edited_by_id: Dict[str, Dict[str, Any]] = {}
+        following: Dict[str | None, List[Dict[str, Any]]] = {None: []}
+        anchor = None
+        for component in edited["components"]:
+            component_id = component.get("id") if isinstance(component, dict) else None
+            if not component_id:
+                raise ValueError(f"A component of section {original.get('id')!r} has no id")
+            if component_id in other_ids:
+                raise ValueError(f"Component {component_id!r} is not in scope")
+            if component_id in scoped_ids:
+                edited_by_id[component_id] = component
+                anchor = component_id
+                following.setdefault(anchor, [])
+            else:
+                following[anchor].append(component)
+
+        merged_components = []
+        for index, component in enumerate(components):
+            if index not in indices:
+                merged_components.append(component)
+                continue
+            if index == indices[0]:
+                merged_components.extend(following[None])
+            if component["id"] in edited_by_id:
+                merged_components.append(edited_by_id[component["id"]])
+                merged_components.extend(following[component["id"]])
+        return {**edited, "components": merged_components}
+
+
+def scope_configuration(instructions: str, config: Any) -> ConfigScope | None:
+    """
+    The scope of a modification, or None when the whole configuration should be
+    sent: the instruction is about the popup as a whole, nothing matches, or
+    everything does
+    """
+    if not isinstance(config, dict) or not isinstance(config.get("sections"), dict):
+        return None
+    sections = config["sections"]
+    if not all(isinstance(section, dict) and isinstance(section.get("components"), list) for section in sections.values()):
+        return None
+    if not all(isinstance(component, dict) and component.get("id")
+               for section in sections.values() for component in section["components"]):
+        return None
+
+    terms = words(instructions)
+    if terms & GLOBAL_TERMS:
+        return None
+    text = " ".join(instructions.lower().split())
+    quoted = [phrase.strip().lower() for phrase in _QUOTED.findall(instructions) if phrase.strip()]
+
+    components: Dict[str, List[int] | None] = {}
+    for section_id, section in sections.items():
+        if name_words(f"{section_id} {section.get('name', '')}") & terms:
+            components[section_id] = None
+            continue
+        indices = [
+            index for index, component in enumerate(section["components"])
+            if component_matches(component, terms, text, quoted)
+        ]
+        if indices:
+            components[section_id] = indices
+    layout = bool(terms & LAYOUT_TERMS) and isinstance(config.get("layout"), dict)
+
+    if not components and not layout:
+        return None
+    everything = all(
+        components.get(section_id, []) is None or len(components.get(section_id, [])) == len(section["components"])
+        for section_id, section in sections.items()
+    )
+    if everything and (layout or "layout" not in config):
+        return None
+    return ConfigScope(config, components, layout)
@@ -3,6 +3,8 @@ from datetime import datetime
 from typing import Any, Callable
 
 from dotenv import load_dotenv
+import functools
+import inspect
 import os
 
 load_dotenv()
@@ -12,6 +14,27 @@ from supabase._async.client import create_client as create_client_async
 from supabase._async.client import AsyncClient
 from uuid import UUID
 
+from src.metrics import supabase_request_duration
+
+
+def timed(func: Callable) -> Callable:
+    """Record the latency of a Supabase call, by method name and outcome"""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any):
+            with supabase_request_duration.time(operation=func.__name__, outcome="error") as labels:
+                result = await func(*args, **kwargs)
+                labels["outcome"] = "ok"
+            return result
+    else:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any):
+            with supabase_request_duration.time(operation=func.__name__, outcome="error") as labels:
+                result = func(*args, **kwargs)
+                labels["outcome"] = "ok"
+            return result
+    return wrapper
+
 
 class BackgroundTaskManager:
     def __init__(self):
@@ -36,6 +59,7 @@ class SupabaseClient:
         self.client: Client = create_client(os.getenv("SUPABASE_PROJECT_URL"), os.getenv("SUPABASE_API_KEY"))
         self.background_task_manager = BackgroundTaskManager()
 
+    @timed
     def insert(self, table: str, data: dict | list[dict]):
         try:
             response = self.client.table(table).insert(data).execute()
@@ -44,6 +68,7 @@ class SupabaseClient:
             print("Error Inserting: ", e)
             raise e
 
+    @timed
     def select(
         self,
         table: str,
@@ -80,6 +105,7 @@ class SupabaseClient:
             print("Error Selecting: ", e)
             raise e
 
+    @timed
     def update(self, table: str, conditions: dict, data: dict):
         try:
             # Convert UUID fields in data to strings
@@ -98,6 +124,7 @@ class SupabaseClient:
             print("Error Updating: ", e)
             raise e
 
+    @timed
     def delete(self, table: str, conditions: dict):
         try:
             query = self.client.table(table).delete()
@@ -121,6 +148,7 @@ class SupabaseClient:
             print("Error Deleting: ", e)
             raise e
 
+    @timed
     def upsert(
         self, table: str, data: dict | list[dict], on_conflict: str | None = None, ignore_on_update: list[str] = None
     ):
@@ -133,6 +161,7 @@ class SupabaseClient:
             print("Error Upserting: ", e)
             raise e
 
+    @timed
     def call_function(self, function_name: str, params: dict = None):
         """
         This is used to call supabase functions.
@@ -203,6 +232,7 @@ class AsyncSupabaseClient:
         if self.client is None:
             self.client = await create_client_async(os.getenv("SUPABASE_PROJECT_URL"), os.getenv("SUPABASE_API_KEY"))
 
+    @timed
     async def aselect(
         self,
         table: str,
@@ -239,6 +269,7 @@ class AsyncSupabaseClient:
             print("Error Selecting: ", e)
             raise e
 
+    @timed
     async def acall_function(self, function_name: str, params: dict = None):
         try:
             response = await self.client.rpc(function_name, params).execute()
@@ -247,6 +278,7 @@ class AsyncSupabaseClient:
             print(f"Error calling function {function_name}: ", e)
             raise e
 
+    @timed
     async def ainsert(self, table: str, data: dict | list[dict]):
         try:
             response = await self.client.table(table).insert(data).execute()
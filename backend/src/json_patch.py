@@ -0,0 +1,131 @@
+"""
+JSON Patch:
+Applies RFC 6902 operations (add, remove, replace, move, copy, test) addressed
+with RFC 6901 JSON Pointers. The input document is never modified; the patched
+copy is returned. Any invalid operation fails the whole patch
+"""
+
+import copy
+from typing import Any
+
+_MISSING = object()
+
+
+class JsonPatchError(ValueError):
+    pass
+
+
+def parse_pointer(pointer: str) -> list[str]:
+    """Reference tokens of a JSON Pointer, with ~1 and ~0 unescaped"""
+    if not isinstance(pointer, str) or (pointer and not pointer.startswith("/")):
+        raise JsonPatchError(f"Invalid JSON pointer: {pointer!r}")
+    if not pointer:
+        return []
+    return [token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")]
+
+
+def _index(container: list, token: str, allow_end: bool = False) -> int:
+    if token == "-" and allow_end:
+        return len(container)
+    if not token.isdigit() or (len(token) > 1 and token.startswith("0")):
+        raise JsonPatchError(f"Invalid array index: {token!r}")
+    index = int(token)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise JsonPatchError(f"Array index out of range: {index}")
+    return index
+
+
+def _child(node: Any, token: str) -> Any:
+    if isinstance(node, dict):
+        if token not in node:
+            raise JsonPatchError(f"Member not found: {token!r}")
+        return node[token]
+    if isinstance(node, list):
+        return node[_index(node, token)]
+    raise JsonPatchError(f"Cannot descend into {type(node).__name__} at {token!r}")
+
+
+def resolve(document: Any, pointer: str) -> Any:
+    node = document
+    for token in parse_pointer(pointer):
+        node = _child(node, token)
+    return node
+
+
+def _parent(document: Any, pointer: str) -> tuple[Any, str]:
+    tokens = parse_pointer(pointer)
+    if not tokens:
+        raise JsonPatchError("The operation needs a location inside the document")
+    node = document
+    for token in tokens[:-1]:
+        node = _child(node, token)
+    return node, tokens[-1]
+
+
+def _add(document: Any, pointer: str, value: Any) -> Any:
+    if pointer == "":
+        return value
+    parent, token = _parent(document, pointer)
+    if isinstance(parent, dict):
+        parent[token] = value
+    elif isinstance(parent, list):
+        parent.insert(_index(parent, token, allow_end=True), value)
+    else:
+        raise JsonPatchError(f"Cannot add to {type(parent).__name__} at {pointer!r}")
+    return document
+
+
+def _remove(document: Any, pointer: str) -> tuple[Any, Any]:
+    """The document without the value at pointer, and that value"""
+    parent, token = _parent(document, pointer)
+    if isinstance(parent, dict):
+        if token not in parent:
+            raise JsonPatchError(f"Member not found: {pointer!r}")
+        return document, parent.pop(token)
+    if isinstance(parent, list):
+        return document, parent.pop(_index(parent, token))
+    raise JsonPatchError(f"Cannot remove from {type(parent).__name__} at {pointer!r}")
+
+
+def apply_operation(document: Any, operation: dict[str, Any]) -> Any:
+    """Apply one operation in place and return the (possibly replaced) document"""
+    if not isinstance(operation, dict):
+        raise JsonPatchError(f"Operation must be an object, got {type(operation).__name__}")
+    op, path = operation.get("op"), operation.get("path")
+    value = operation.get("value", _MISSING)
+    if op in ("add", "replace", "test") and value is _MISSING:
+        raise JsonPatchError(f"{op} operation at {path!r} has no value")
+
+    if op == "add":
+        return _add(document, path, copy.deepcopy(value))
+    if op == "remove":
+        return _remove(document, path)[0]
+    if op == "replace":
+        if path == "":
+            return copy.deepcopy(value)
+        resolve(document, path)
+        document, _ = _remove(document, path)
+        return _add(document, path, copy.deepcopy(value))
+    if op == "move":
+        source = operation.get("from")
+        if path != source and (path or "").startswith(f"{source}/"):
+            raise JsonPatchError(f"Cannot move {source!r} into its own child {path!r}")
+        document, moved = _remove(document, source)
+        return _add(document, path, moved)
+    if op == "copy":
+        return _add(document, path, copy.deepcopy(resolve(document, operation.get("from"))))
+    if op == "test":
+        if resolve(document, path) != value:
+            raise JsonPatchError(f"Test failed at {path!r}")
+        return document
+    raise JsonPatchError(f"Unknown operation: {op!r}")
+
+
+def apply_patch(document: Any, operations: list[dict[str, Any]]) -> Any:
+    """The patched copy of document; raises JsonPatchError if any operation fails"""
+    if not isinstance(operations, list):
+        raise JsonPatchError("A patch must be an array of operations")
+    patched = copy.deepcopy(document)
+    for operation in operations:
+        patched = apply_operation(patched, operation)
+    return patched
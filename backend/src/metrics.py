@@ -0,0 +1,372 @@
+"""
+Metrics:
+Counters, gauges and histograms rendered in the Prometheus text format by
+GET /metrics, plus RunMetrics, the counters for completed and cancelled
+agent runs (including an estimate of the output tokens cancellations saved).
+
+Import this module as `src.metrics` everywhere so there is a single registry.
+Recording is a dict lookup and a few additions under a lock, cheap enough for
+every event of every stream.
+"""
+
+import abc
+import bisect
+import collections
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+# Rough characters per token for English text, used when the model reports no usage
+CHARS_PER_TOKEN = 4
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+TOKEN_BUCKETS = (0, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def estimate_tokens(text_chars: int) -> int:
+    return -(-text_chars // CHARS_PER_TOKEN)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.lock = threading.Lock()
+
+    def key(self, labels: dict[str, Any]) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+    @abc.abstractmethod
+    def samples(self) -> list[str]:
+        """Sample lines in the Prometheus text format"""
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: dict[tuple[str, ...], float] = collections.defaultdict(float)
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] += amount
+
+    def samples(self) -> list[str]:
+        with self.lock:
+            items = list(self.values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Metric):
+    """A value that goes up and down; or, with `function`, read at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (),
+                 function: Callable[[], float] | None = None):
+        super().__init__(name, documentation, labels)
+        self.values: dict[tuple[str, ...], float] = collections.defaultdict(float)
+        self.function = function
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] += amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    @contextmanager
+    def track(self, **labels: Any) -> Iterator[None]:
+        """Count the block as in progress while it runs"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self) -> list[str]:
+        if self.function is not None:
+            return [f"{self.name} {_format_value(self.function())}"]
+        with self.lock:
+            items = list(self.values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # Per label set: [count per bucket (non-cumulative, last is +Inf), sum]
+        self.series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[dict[str, Any]]:
+        """
+        Observe the duration of the block. The yielded dict can be updated
+        inside the block to set labels only known at the end (e.g. a status).
+        """
+        started = time.perf_counter()
+        final_labels = dict(labels)
+        try:
+            yield final_labels
+        finally:
+            self.observe(time.perf_counter() - started, **final_labels)
+
+    def samples(self) -> list[str]:
+        with self.lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self.series.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: tuple[str, ...] = (),
+              function: Callable[[], float] | None = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labels, function))
+
+    def histogram(self, name: str, documentation: str, labels: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_duration = registry.histogram(
+    "popupgenius_http_request_duration_seconds",
+    "HTTP request latency until the last byte of the response, streams included",
+    ("method", "endpoint", "status"),
+)
+time_to_first_token = registry.histogram(
+    "popupgenius_agent_time_to_first_token_seconds",
+    "Time from the start of an agent run to its first streamed text",
+)
+tool_duration = registry.histogram(
+    "popupgenius_tool_duration_seconds", "Duration of agent tool calls", ("tool", "outcome")
+)
+shopify_request_duration = registry.histogram(
+    "popupgenius_shopify_request_duration_seconds", "Latency of Shopify GraphQL requests", ("api", "status")
+)
+shopify_bulk_orphans = registry.counter(
+    "popupgenius_shopify_bulk_orphans_total",
+    "Line items in Shopify bulk operation results whose parent order was not in the batch being read",
+)
+supabase_request_duration = registry.histogram(
+    "popupgenius_supabase_request_duration_seconds", "Latency of Supabase calls", ("operation", "outcome")
+)
+events_per_run = registry.histogram(
+    "popupgenius_agent_events_per_run", "Structured events emitted per agent run", ("outcome", "cache"), COUNT_BUCKETS
+)
+modification_tokens = registry.histogram(
+    "popupgenius_modification_tokens",
+    "Tokens per popup modification request, by output mode and kind (input, cached_input, output)",
+    ("output", "kind"),
+    TOKEN_BUCKETS,
+)
+modification_first_update = registry.histogram(
+    "popupgenius_modification_first_update_seconds",
+    "Time from a streamed popup modification request to its first configuration update",
+)
+active_streams = registry.gauge("popupgenius_active_streams", "HTTP streaming responses in progress", ("endpoint",))
+active_websockets = registry.gauge("popupgenius_active_websockets", "Open WebSocket connections", ("endpoint",))
+runs_total = registry.counter(
+    "popupgenius_agent_runs_total", "Agent runs by outcome; cache is hit for runs replayed from the run cache",
+    ("outcome", "cache"),
+)
+output_tokens_total = registry.counter("popupgenius_agent_output_tokens_total", "Output tokens of agent runs")
+tokens_saved_total = registry.counter(
+    "popupgenius_agent_tokens_saved_total", "Estimated output tokens not generated because a run was cancelled"
+)
+
+
+def route_path(scope: dict[str, Any]) -> str:
+    """The matched route template (bounded label values), not the raw path"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing HTTP requests until the last body chunk is sent, so
+    streamed responses count their full duration. Responses without a
+    Content-Length are streams and are tracked in active_streams while open;
+    WebSocket connections are tracked in active_websockets.
+    """
+
+    def __init__(self, app: Callable):
+        self.app = app
+
+    async def __call__(self, scope: dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] == "websocket":
+            await self._websocket(scope, receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    async def _websocket(self, scope: dict[str, Any], receive: Callable, send: Callable) -> None:
+        endpoint = None
+
+        async def send_tracked(message: dict[str, Any]) -> None:
+            nonlocal endpoint
+            if message["type"] == "websocket.accept":
+                endpoint = route_path(scope)
+                active_websockets.inc(endpoint=endpoint)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_tracked)
+        finally:
+            if endpoint is not None:
+                active_websockets.dec(endpoint=endpoint)
+
+    async def _http(self, scope: dict[str, Any], receive: Callable, send: Callable) -> None:
+        started = time.perf_counter()
+        status = 500
+        stream_endpoint = None
+
+        async def send_tracked(message: dict[str, Any]) -> None:
+            nonlocal status, stream_endpoint
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if not any(name.lower() == b"content-length" for name, _ in message.get("headers", ())):
+                    stream_endpoint = route_path(scope)
+                    active_streams.inc(endpoint=stream_endpoint)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_tracked)
+        finally:
+            if stream_endpoint is not None:
+                active_streams.dec(endpoint=stream_endpoint)
+            request_duration.observe(
+                time.perf_counter() - started, method=scope["method"], endpoint=route_path(scope), status=status
+            )
+
+
+class RunMetrics:
+    """
+    Counters for completed and cancelled runs.
+
+    Tokens saved by a cancelled run are estimated as the moving average output
+    of completed runs minus what the cancelled run had already produced. Runs
+    replayed from the run cache are counted, but generate no output tokens and
+    leave the average alone.
+    """
+
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.average_output_tokens: float | None = None
+
+    def run_completed(self, output_tokens: int, cached: bool = False) -> None:
+        self.counters["runs_completed"] += 1
+        runs_total.inc(outcome="completed", cache="hit" if cached else "miss")
+        if cached:
+            self.counters["runs_cached"] += 1
+            return
+        self.counters["output_tokens"] += output_tokens
+        output_tokens_total.inc(output_tokens)
+        if self.average_output_tokens is None:
+            self.average_output_tokens = float(output_tokens)
+        else:
+            self.average_output_tokens += 0.2 * (output_tokens - self.average_output_tokens)
+
+    def run_cancelled(self, output_tokens: int, cached: bool = False) -> None:
+        self.counters["runs_cancelled"] += 1
+        runs_total.inc(outcome="cancelled", cache="hit" if cached else "miss")
+        if cached:
+            self.counters["runs_cached"] += 1
+            return
+        self.counters["output_tokens"] += output_tokens
+        output_tokens_total.inc(output_tokens)
+        if self.average_output_tokens is not None:
+            saved = max(0, round(self.average_output_tokens - output_tokens))
+            self.counters["tokens_saved"] += saved
+            tokens_saved_total.inc(saved)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "runs_completed": self.counters["runs_completed"],
+            "runs_cancelled": self.counters["runs_cancelled"],
+            "runs_cached": self.counters["runs_cached"],
+            "output_tokens": self.counters["output_tokens"],
+            "tokens_saved": self.counters["tokens_saved"],
+            "average_output_tokens": round(self.average_output_tokens or 0.0, 1),
+        }
+
+    def reset(self) -> None:
+        self.counters.clear()
+        self.average_output_tokens = None
+
+
+run_metrics = RunMetrics()
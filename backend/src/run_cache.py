@@ -0,0 +1,199 @@
+"""
+Run cache:
+Records the structured event stream of completed agent runs and replays it for
+the same normalized input computed from the same tool data. Near-duplicate
+replay is opt-in: candidates come from a local MinHash LSH index over character
+shingles and must also carry exactly the same numbers and negations; no
+embedding service is involved
+"""
+
+import asyncio
+import collections
+import hashlib
+import re
+from typing import Any, AsyncGenerator, Hashable
+
+import numpy as np
+
+from src.config import settings
+from src.ttl_cache import TTLCache
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+
+# "don't" normalizes to "don t", hence the lone t
+NEGATIONS = {"no", "not", "never", "without", "none", "nor", "neither", "cannot", "t"}
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def normalize_text(text: str) -> str:
+    """Casefold, drop punctuation and collapse whitespace"""
+    return " ".join(re.sub(r"[^\w\s$%.]", " ", (text or "").casefold()).split())
+
+
+def shingles(text: str, size: int = 5) -> set[str]:
+    """Character shingles of normalized text; short texts are a single shingle"""
+    text = normalize_text(text)
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def guard_tokens(text: str) -> collections.Counter:
+    """
+    Numbers and negations of the input. Inputs that differ in these ("10% off"
+    vs "15% off", "show" vs "do not show") mean different things however similar
+    the rest of the text is.
+    """
+    text = normalize_text(text)
+    tokens = [word for word in text.split() if word in NEGATIONS]
+    return collections.Counter(tokens + _NUMBER.findall(text))
+
+
+def jaccard(a: set[str], b: set[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class MinHashIndex:
+    """
+    MinHash signatures with LSH banding.
+
+    Signatures of `bands * rows` permutations are split into bands; inputs that
+    agree on every row of any band become candidates. With the defaults (16 x 4)
+    pairs above ~0.5 Jaccard similarity are very likely to collide.
+    """
+
+    def __init__(self, bands: int = 16, rows: int = 4, seed: int = 1):
+        self.bands = bands
+        self.rows = rows
+        generator = np.random.default_rng(seed)
+        permutations = bands * rows
+        self.a = generator.integers(1, (1 << 32) - 1, size=permutations, dtype=np.uint64)
+        self.b = generator.integers(0, (1 << 32) - 1, size=permutations, dtype=np.uint64)
+        self.buckets: dict[tuple[int, bytes], set[Hashable]] = collections.defaultdict(set)
+        self.keys: dict[Hashable, list[tuple[int, bytes]]] = {}
+
+    def signature(self, shingle_set: set[str]) -> np.ndarray:
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little") for s in shingle_set],
+            dtype=np.uint64,
+        )
+        # (a * h + b) mod p stays below 2**64 because a and h are 32-bit
+        permuted = (np.outer(hashes, self.a) + self.b) % MERSENNE_PRIME
+        return permuted.min(axis=0)
+
+    def band_keys(self, signature: np.ndarray) -> list[tuple[int, bytes]]:
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def add(self, key: Hashable, shingle_set: set[str]) -> None:
+        self.remove(key)
+        bands = self.band_keys(self.signature(shingle_set))
+        for band in bands:
+            self.buckets[band].add(key)
+        self.keys[key] = bands
+
+    def remove(self, key: Hashable) -> None:
+        for band in self.keys.pop(key, ()):
+            self.buckets[band].discard(key)
+            if not self.buckets[band]:
+                del self.buckets[band]
+
+    def candidates(self, shingle_set: set[str]) -> set[Hashable]:
+        found = set()
+        for band in self.band_keys(self.signature(shingle_set)):
+            found |= self.buckets.get(band, set())
+        return found
+
+
+class RunCache:
+    """
+    Cache of recorded agent event streams keyed by normalized input.
+
+    lookup() returns the entry for the same normalized input and, with
+    near_duplicates, otherwise the most similar indexed input whose shingle
+    Jaccard similarity reaches `similarity` and whose numbers and negations
+    match exactly. Entries recorded under a different data `version` (e.g. the
+    tool data files they were computed from) are never returned.
+    """
+
+    def __init__(self, ttl: float = settings.RUN_CACHE_TTL, maxsize: int = settings.RUN_CACHE_SIZE,
+                 similarity: float = settings.RUN_CACHE_SIMILARITY,
+                 near_duplicates: bool = settings.RUN_CACHE_NEAR_DUPLICATES):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.index = MinHashIndex()
+        self.similarity = similarity
+        self.near_duplicates = near_duplicates
+        self.stats = collections.Counter()
+
+    def lookup(self, user_input: str, version: Hashable = None) -> dict[str, Any] | None:
+        key = normalize_text(user_input)
+        entry = self.entries.get(key)
+        if entry is not None and entry["version"] != version:
+            # Computed from data that has changed since
+            self.stats["stale"] += 1
+            self.entries.pop(key)
+            self.index.remove(key)
+            entry = None
+        if entry is not None:
+            self.stats["exact_hits"] += 1
+            return {**entry, "similarity": 1.0}
+        if not self.near_duplicates:
+            self.stats["misses"] += 1
+            return None
+
+        shingle_set = shingles(user_input)
+        guards = guard_tokens(user_input)
+        best, best_similarity = None, 0.0
+        for candidate in self.index.candidates(shingle_set):
+            candidate_entry = self.entries.get(candidate)
+            if candidate_entry is None:
+                # Expired or evicted since it was indexed
+                self.index.remove(candidate)
+                continue
+            if candidate_entry["version"] != version or candidate_entry["guards"] != guards:
+                continue
+            similarity = jaccard(shingle_set, candidate_entry["shingles"])
+            if similarity >= self.similarity and similarity > best_similarity:
+                best, best_similarity = candidate_entry, similarity
+
+        if best is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["near_hits"] += 1
+        return {**best, "similarity": best_similarity}
+
+    def store(self, user_input: str, events: list[tuple[float, dict[str, Any]]], version: Hashable = None) -> None:
+        """Record a completed run as (seconds since start, event) pairs"""
+        key = normalize_text(user_input)
+        shingle_set = shingles(user_input)
+        self.entries.set(key, {
+            "input": user_input,
+            "shingles": shingle_set,
+            "guards": guard_tokens(user_input),
+            "version": version,
+            "events": events,
+        })
+        self.index.add(key, shingle_set)
+
+    async def replay(self, entry: dict[str, Any], speed: float = settings.RUN_CACHE_REPLAY_SPEED
+                     ) -> AsyncGenerator[dict[str, Any], None]:
+        """
+        Yield a recorded run with fresh timestamps, `speed` times faster than it
+        was recorded (0 replays without delay)
+        """
+        loop = asyncio.get_event_loop()
+        previous = 0.0
+        for position, (offset, event) in enumerate(entry["events"]):
+            if speed > 0 and offset > previous:
+                await asyncio.sleep((offset - previous) / speed)
+            previous = offset
+            replayed = {**event, "timestamp": loop.time()}
+            if position == 0:
+                replayed.update({"cached": True, "cache_similarity": round(entry["similarity"], 3)})
+            yield replayed
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.index = MinHashIndex()
+
+
+run_cache = RunCache()
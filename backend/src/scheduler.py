@@ -0,0 +1,179 @@
+"""
+Run scheduler:
+Admission control for agent runs. A global and a per-client concurrency limit,
+with a bounded FIFO wait queue; callers beyond the queue are rejected at once
+with a Retry-After estimate
+"""
+
+import asyncio
+import collections
+import ipaddress
+import math
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Dict
+
+from src.config import settings
+from src.metrics import registry
+
+
+class QueueFull(Exception):
+    """Raised when a run can neither start nor wait; retry_after is in seconds"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Run queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def is_trusted_proxy(address: str, trusted_proxies: list[str]) -> bool:
+    try:
+        ip = ipaddress.ip_address(address.strip())
+    except ValueError:
+        return False
+    return any(ip in ipaddress.ip_network(proxy, strict=False) for proxy in trusted_proxies)
+
+
+def client_address(peer: str, forwarded_for: str | None, trusted_proxies: list[str] | None = None) -> str:
+    """
+    The address per-client limits are keyed on: the peer address, or behind
+    trusted proxies (RUN_TRUSTED_PROXIES) the last X-Forwarded-For entry that
+    no trusted proxy added. Clients behind one NAT or untrusted proxy share it.
+    """
+    trusted_proxies = settings.RUN_TRUSTED_PROXIES if trusted_proxies is None else trusted_proxies
+    address = peer
+    if forwarded_for and is_trusted_proxy(peer, trusted_proxies):
+        for hop in reversed(forwarded_for.split(",")):
+            address = hop.strip()
+            if not is_trusted_proxy(address, trusted_proxies):
+                break
+    return address
+
+
+class RunTicket:
+    """A client's place in the scheduler, either running or waiting"""
+
+    def __init__(self, scheduler: "RunScheduler", client_id: str):
+        self.scheduler = scheduler
+        self.client_id = client_id
+        self.granted = False
+        self.released = False
+        self.started_at = 0.0
+        self.changed = asyncio.Event()
+
+    @property
+    def position(self) -> int:
+        """1-based position in the wait queue, 0 once running"""
+        if self.granted:
+            return 0
+        return self.scheduler.waiting.index(self) + 1
+
+    async def wait(self) -> AsyncGenerator[int, None]:
+        """Yield the queue position whenever it changes until the run may start"""
+        last = None
+        while not self.granted:
+            if self.position != last:
+                last = self.position
+                yield last
+            self.changed.clear()
+            await self.changed.wait()
+
+    def release(self) -> None:
+        """Give up the slot or the place in the queue; safe to call more than once"""
+        if not self.released:
+            self.released = True
+            self.scheduler._release(self)
+
+
+class RunScheduler:
+    """
+    Admits at most `max_concurrent` runs, at most `max_per_client` per client.
+
+    Waiting tickets are granted in arrival order, skipping clients that are at
+    their own limit. At most `max_queue` tickets wait; beyond that enqueue()
+    raises QueueFull.
+    """
+
+    def __init__(self, max_concurrent: int = settings.RUN_MAX_CONCURRENT,
+                 max_per_client: int = settings.RUN_MAX_PER_CLIENT,
+                 max_queue: int = settings.RUN_QUEUE_SIZE,
+                 expected_run_seconds: float = settings.RUN_EXPECTED_SECONDS):
+        self.max_concurrent = max_concurrent
+        self.max_per_client = max_per_client
+        self.max_queue = max_queue
+        # Moving average of run durations, used for Retry-After and queue estimates
+        self.average_run_seconds = expected_run_seconds
+        self.running = 0
+        self.per_client: collections.Counter = collections.Counter()
+        self.waiting: list[RunTicket] = []
+        self.stats = collections.Counter()
+
+    def enqueue(self, client_id: str) -> RunTicket:
+        """Start a run now or queue it; raises QueueFull when the queue is full"""
+        ticket = RunTicket(self, client_id)
+        self.waiting.append(ticket)
+        self._dispatch()
+        if not ticket.granted and len(self.waiting) > self.max_queue:
+            self.waiting.remove(ticket)
+            ticket.released = True
+            self.stats["rejected"] += 1
+            raise QueueFull(self.retry_after())
+        self.stats["admitted" if ticket.granted else "queued"] += 1
+        return ticket
+
+    def retry_after(self) -> int:
+        """Seconds until the queue is expected to have drained by one full turn"""
+        turns = (len(self.waiting) + 1) / max(1, self.max_concurrent)
+        return max(1, math.ceil(turns * self.average_run_seconds))
+
+    def _dispatch(self) -> None:
+        for ticket in list(self.waiting):
+            if self.running >= self.max_concurrent:
+                break
+            if self.per_client[ticket.client_id] >= self.max_per_client:
+                continue
+            self.waiting.remove(ticket)
+            ticket.granted = True
+            ticket.started_at = time.monotonic()
+            self.running += 1
+            self.per_client[ticket.client_id] += 1
+            ticket.changed.set()
+        # Positions may have moved
+        for ticket in self.waiting:
+            ticket.changed.set()
+
+    def _release(self, ticket: RunTicket) -> None:
+        if ticket.granted:
+            self.running -= 1
+            self.per_client[ticket.client_id] -= 1
+            if not self.per_client[ticket.client_id]:
+                del self.per_client[ticket.client_id]
+            duration = time.monotonic() - ticket.started_at
+            self.average_run_seconds += 0.2 * (duration - self.average_run_seconds)
+        else:
+            self.waiting.remove(ticket)
+        ticket.changed.set()
+        self._dispatch()
+
+
+async def scheduled(ticket: RunTicket, events: AsyncIterator[Dict[str, Any]]) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Emit `queued` events while the ticket waits, then the run's events.
+    The ticket is released when the stream ends or is closed early.
+    """
+    try:
+        async for position in ticket.wait():
+            yield {
+                "type": "queued",
+                "position": position,
+                "message": f"Waiting for an available analysis slot (position {position})",
+                "timestamp": asyncio.get_event_loop().time()
+            }
+        async for event in events:
+            yield event
+    finally:
+        ticket.release()
+
+
+run_scheduler = RunScheduler()
+
+registry.gauge("popupgenius_run_queue_depth", "Agent runs waiting for a slot", function=lambda: len(run_scheduler.waiting))
+registry.gauge("popupgenius_runs_in_progress", "Agent runs holding a slot", function=lambda: run_scheduler.running)
@@ -0,0 +1,105 @@
+"""
+Schema digest:
+Compact text description of pydantic models for prompts. Lists every model
+reachable from the roots with its fields, types, simple defaults and the
+inline comments of the source, plus the values of the enums involved; no
+code, imports or helper methods
+"""
+
+import enum
+import inspect
+import json
+import re
+import tokenize
+import types
+from typing import Any, Literal, Union, get_args, get_origin
+
+from pydantic import BaseModel
+
+_ASSIGNMENT = re.compile(r"^ {4}(\w+)\s*[:=]")
+
+
+def source_comments(cls: type) -> dict[str, str]:
+    """Trailing comments of the class-level assignments in cls, by name"""
+    try:
+        lines = inspect.getsource(cls).splitlines(keepends=True)
+    except (OSError, TypeError):
+        return {}
+    comments = {}
+    for token in tokenize.generate_tokens(iter(lines).__next__):
+        if token.type == tokenize.COMMENT:
+            match = _ASSIGNMENT.match(token.line)
+            if match:
+                comments[match.group(1)] = token.string.lstrip("#").strip()
+    return comments
+
+
+def type_name(annotation: Any, referenced: list[type]) -> str:
+    """Short type expression; models and enums it mentions are appended to referenced"""
+    if annotation is None or annotation is type(None):
+        return "null"
+    if annotation is Any:
+        return "any"
+    origin = get_origin(annotation)
+    if origin is Literal:
+        return " | ".join(json.dumps(value) for value in get_args(annotation))
+    if origin in (Union, types.UnionType):
+        return " | ".join(type_name(arg, referenced) for arg in get_args(annotation))
+    if origin is not None:
+        args = ", ".join(type_name(arg, referenced) for arg in get_args(annotation))
+        return f"{getattr(origin, '__name__', str(origin))}[{args}]"
+    if inspect.isclass(annotation) and issubclass(annotation, (BaseModel, enum.Enum)):
+        if annotation not in referenced:
+            referenced.append(annotation)
+    return getattr(annotation, "__name__", str(annotation))
+
+
+def _default(field: Any) -> str:
+    """ = default for JSON-like defaults; nested models and factories are left out"""
+    if field.is_required() or field.default_factory is not None:
+        return ""
+    value = field.default
+    if isinstance(value, enum.Enum):
+        value = value.value
+    if value is None or isinstance(value, (str, int, float, bool)) or value in ([], {}):
+        return f" = {json.dumps(value)}"
+    return ""
+
+
+def describe_model(model: type[BaseModel], referenced: list[type]) -> list[str]:
+    doc = (model.__doc__ or "").strip().splitlines()
+    lines = [f"{model.__name__}:" + (f"  # {doc[0]}" if doc else "")]
+    comments = source_comments(model)
+    for name, field in model.model_fields.items():
+        line = f"  {name}: {type_name(field.annotation, referenced)}{_default(field)}"
+        if name in comments:
+            line += f"  # {comments[name]}"
+        lines.append(line)
+    return lines
+
+
+def describe_enum(enum_class: type[enum.Enum]) -> list[str]:
+    comments = source_comments(enum_class)
+    values = []
+    for member in enum_class:
+        comment = comments.get(member.name)
+        values.append(f"{member.value} ({comment})" if comment else str(member.value))
+    return [f"{enum_class.__name__}: " + " | ".join(values)]
+
+
+def schema_digest(*roots: type[BaseModel], notes: tuple[str, ...] = ()) -> str:
+    """Models first (breadth first from the roots), then enums, then free-form notes"""
+    referenced: list[type] = list(roots)
+    models, enums = [], []
+    index = 0
+    while index < len(referenced):
+        cls = referenced[index]
+        index += 1
+        if issubclass(cls, BaseModel):
+            models.extend(describe_model(cls, referenced))
+        else:
+            enums.extend(describe_enum(cls))
+    sections = ["Models:", *models, "", "Enums:", *enums]
+    if notes:
+        sections += ["", "Notes:", *(f"- {note}" for note in notes)]
+    return "\n".join(sections)
@@ -0,0 +1,180 @@
+"""
+Streaming helpers:
+Coalesces text_chunk events of a structured event stream into fewer, larger
+events, flushed by size or by age, whichever comes first, stops streams
+whose client has disconnected, and parses streamed JSON arrays element by element
+"""
+
+import asyncio
+import contextlib
+import json
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict
+
+_DONE = object()
+
+
+async def coalesce_text_chunks(
+    events: AsyncIterator[Dict[str, Any]], max_bytes: int = 512, max_delay: float = 0.05
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """
+    Merge consecutive text_chunk events.
+
+    - the first text chunk is passed through immediately (time to first byte)
+    - later text is buffered until it reaches max_bytes (UTF-8) or the oldest
+      buffered text is max_delay seconds old
+    - any other event flushes the buffer first and is passed through in order
+
+    The source is pumped into a queue by a separate task so the age threshold
+    fires even while the source is waiting for its next event.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for event in events:
+                await queue.put(event)
+            await queue.put(_DONE)
+        except Exception as e:
+            await queue.put(e)
+
+    pumping = asyncio.create_task(pump())
+    buffer: list[str] = []
+    buffered_bytes = 0
+    deadline = 0.0
+    sent_text = False
+
+    def flush() -> Dict[str, Any]:
+        nonlocal buffered_bytes
+        event = {"type": "text_chunk", "content": "".join(buffer), "timestamp": loop.time()}
+        buffer.clear()
+        buffered_bytes = 0
+        return event
+
+    try:
+        while True:
+            if buffer:
+                try:
+                    item = await asyncio.wait_for(queue.get(), max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    yield flush()
+                    continue
+            else:
+                item = await queue.get()
+
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            if item.get("type") != "text_chunk":
+                if buffer:
+                    yield flush()
+                yield item
+            elif not sent_text:
+                sent_text = True
+                yield item
+            elif item["content"]:
+                if not buffer:
+                    deadline = loop.time() + max_delay
+                buffer.append(item["content"])
+                buffered_bytes += len(item["content"].encode())
+                if buffered_bytes >= max_bytes:
+                    yield flush()
+
+        if buffer:
+            yield flush()
+    finally:
+        pumping.cancel()
+
+
+async def until_disconnected(
+    events: AsyncIterator[Any], is_disconnected: Callable[[], Awaitable[bool]], interval: float = 0.5
+) -> AsyncGenerator[Any, None]:
+    """
+    Pass events through until the client goes away.
+
+    is_disconnected() is checked every `interval` seconds while waiting for the
+    next event, so quiet stretches (queueing, tool prefetch) are covered as
+    well. On disconnect the pending step of `events` is cancelled, which stops
+    the agent run underneath, and the stream ends.
+    """
+    stream = aiter(events)
+    step = None
+    try:
+        while True:
+            step = asyncio.ensure_future(anext(stream))
+            while not step.done():
+                await asyncio.wait({step}, timeout=interval)
+                if not step.done() and await is_disconnected():
+                    return
+            try:
+                event = step.result()
+            except StopAsyncIteration:
+                return
+            yield event
+    finally:
+        if step is not None and not step.done():
+            step.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await step
+        if hasattr(stream, "aclose"):
+            await stream.aclose()
+
+
+class JsonArrayParser:
+    """
+    Incremental parser for a JSON array arriving in arbitrary text pieces, such
+    as model output. feed() returns the elements completed by each piece, so
+    callers can act on the first element long before the array is closed.
+    Text before the opening bracket (e.g. a markdown fence) is ignored.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.done = False
+        self.depth = 0  # nesting inside the current element
+        self.in_string = False
+        self.escaped = False
+        self.element: list[str] = []
+
+    def feed(self, text: str) -> list[Any]:
+        completed = []
+        for char in text:
+            if self.done:
+                break
+            if not self.started:
+                self.started = char == "["
+                continue
+            if self.in_string:
+                self.element.append(char)
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+            if self.depth == 0 and char in ",]":
+                # End of a scalar element, or the separator after a container element
+                self._complete(completed)
+                self.done = char == "]"
+                continue
+            if char.isspace() and self.depth == 0 and not self.element:
+                continue
+            self.element.append(char)
+            if char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self._complete(completed)
+        return completed
+
+    def _complete(self, completed: list[Any]) -> None:
+        text = "".join(self.element).strip()
+        self.element = []
+        if text:
+            completed.append(json.loads(text))
@@ -1,8 +1,8 @@
 import random
-from agents import function_tool
+from .runtime import tool
 
 
-@function_tool
+@tool(memoize=True, casefold=("business_description",))
 def analyze_competitors(business_description: str = "", industry: str = ""):
     """
     Analyze competitor popup strategies and identify market opportunities.
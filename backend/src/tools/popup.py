@@ -1,8 +1,8 @@
 import json
-from agents import function_tool
+from .runtime import tool
 
 
-@function_tool
+@tool(memoize=True, data_files=("data/mock_popup_data.json",), casefold=("business_description",))
 def analyze_popup_history(business_description: str = ""):
     """
     Analyze historical popup performance data with streaming insights.
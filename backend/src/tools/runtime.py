@@ -0,0 +1,225 @@
+"""
+Tool runtime:
+Registers the plain analysis functions behind each agent tool and runs them off
+the event loop, in a bounded thread pool or, for CPU-bound tools, a process
+pool, with per-tool timeouts. Deterministic tools are memoized on their
+normalized arguments and the version of the data files they read
+"""
+
+import asyncio
+import copy
+import functools
+import importlib
+import inspect
+import json
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable
+
+from agents import function_tool
+
+from src.config import settings
+from src.metrics import tool_duration
+from src.ttl_cache import TTLCache
+
+# Plain tool functions by tool name
+TOOL_FUNCTIONS: dict[str, Callable[..., Any]] = {}
+# Execution options by tool name: cpu_bound, timeout, memoize, data_files, casefold
+TOOL_OPTIONS: dict[str, dict[str, Any]] = {}
+
+_thread_pool: ThreadPoolExecutor | None = None
+_process_pool: ProcessPoolExecutor | None = None
+_memo: TTLCache | None = None
+_MISS = object()
+
+
+class ToolTimeout(TimeoutError):
+    pass
+
+
+def tool(
+    func: Callable[..., Any] | None = None,
+    *,
+    cpu_bound: bool = False,
+    timeout: float | None = None,
+    memoize: bool = False,
+    data_files: tuple[str, ...] = (),
+    casefold: tuple[str, ...] = (),
+):
+    """
+    function_tool that runs the function through run_tool and registers it in TOOL_FUNCTIONS.
+
+    The agent sees an async tool with the original signature and docstring, so
+    parallel tool calls from the model run in parallel without blocking the loop.
+
+    memoize: cache results by normalized arguments plus the mtime and size of
+        data_files, so editing a data file invalidates its entries
+    casefold: arguments the tool only reads case-insensitively, folded in the memo key
+    """
+
+    def register(func: Callable[..., Any]):
+        TOOL_FUNCTIONS[func.__name__] = func
+        TOOL_OPTIONS[func.__name__] = {
+            "cpu_bound": cpu_bound,
+            "timeout": timeout,
+            "memoize": memoize,
+            "data_files": data_files,
+            "casefold": casefold,
+            "signature": inspect.signature(func),
+        }
+
+        @functools.wraps(func)
+        async def invoke(*args: Any, **kwargs: Any) -> Any:
+            return await run_tool(func.__name__, *args, **kwargs)
+
+        decorated = function_tool(invoke)
+        # The stand-in agents module returns functions unchanged; keep tools directly callable there
+        return func if decorated is invoke else decorated
+
+    return register(func) if func is not None else register
+
+
+def tool_name(agent_tool: Any) -> str:
+    """Name of an agent tool, whether a FunctionTool or a plain function"""
+    return getattr(agent_tool, "name", None) or agent_tool.__name__
+
+
+def format_tool_output(output: Any) -> str:
+    return output if isinstance(output, str) else json.dumps(output, default=str)
+
+
+def tool_timeout(name: str) -> float | None:
+    """Timeout for a tool: settings.TOOL_TIMEOUTS, then the decorator, then settings.TOOL_TIMEOUT"""
+    if name in settings.TOOL_TIMEOUTS:
+        return settings.TOOL_TIMEOUTS[name]
+    option = TOOL_OPTIONS.get(name, {}).get("timeout")
+    return option if option is not None else settings.TOOL_TIMEOUT
+
+
+def executor_for(name: str) -> Executor:
+    global _thread_pool, _process_pool
+    if TOOL_OPTIONS.get(name, {}).get("cpu_bound") and settings.TOOL_PROCESS_WORKERS > 0:
+        if _process_pool is None:
+            # spawn: forking a process that already runs threads (uvicorn, httpx) is unsafe
+            _process_pool = ProcessPoolExecutor(
+                max_workers=settings.TOOL_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=settings.TOOL_THREAD_WORKERS, thread_name_prefix="tool")
+    return _thread_pool
+
+
+def data_version(paths: tuple[str, ...]) -> tuple:
+    """(path, mtime_ns, size) for each data file, None for files that do not exist"""
+    version = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            version.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            version.append((path, None))
+    return tuple(version)
+
+
+def tool_data_version() -> tuple:
+    """data_version of every data file any registered tool declares"""
+    return data_version(tuple(sorted({path for options in TOOL_OPTIONS.values() for path in options["data_files"]})))
+
+
+def memo_key(name: str, args: tuple, kwargs: dict) -> tuple | None:
+    """Memo key for a call, or None when the tool is not memoized"""
+    options = TOOL_OPTIONS.get(name, {})
+    if not options.get("memoize"):
+        return None
+    bound = options["signature"].bind(*args, **kwargs)
+    bound.apply_defaults()
+    arguments = []
+    for argument, value in sorted(bound.arguments.items()):
+        if isinstance(value, str):
+            value = " ".join(value.split())
+            if argument in options["casefold"]:
+                value = value.casefold()
+        else:
+            value = json.dumps(value, sort_keys=True, default=str)
+        arguments.append((argument, value))
+    return name, tuple(arguments), data_version(options["data_files"])
+
+
+def memo() -> TTLCache:
+    global _memo
+    if _memo is None:
+        _memo = TTLCache(maxsize=settings.TOOL_MEMO_SIZE, ttl=settings.TOOL_MEMO_TTL)
+    return _memo
+
+
+def clear_memo() -> None:
+    if _memo is not None:
+        _memo.clear()
+
+
+def _call_registered(module: str, name: str, args: tuple, kwargs: dict) -> Any:
+    """
+    Process pool entry point. The module-level names of tools are FunctionTools,
+    which cannot be pickled, so workers import the tool module and look the
+    plain function up in the registry instead.
+    """
+    importlib.import_module(module)
+    return TOOL_FUNCTIONS[name](*args, **kwargs)
+
+
+async def run_tool(name: str, *args: Any, **kwargs: Any) -> Any:
+    """Run a registered tool on its executor; raises ToolTimeout when it exceeds its timeout"""
+    func = TOOL_FUNCTIONS[name]
+    key = memo_key(name, args, kwargs)
+    if key is not None:
+        cached = memo().get(key, _MISS)
+        if cached is not _MISS:
+            # Copies, so callers can never modify the cached result
+            return copy.deepcopy(cached)
+
+    executor = executor_for(name)
+    loop = asyncio.get_running_loop()
+    if isinstance(executor, ProcessPoolExecutor):
+        future = loop.run_in_executor(executor, _call_registered, func.__module__, name, args, kwargs)
+    else:
+        future = loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+    timeout = tool_timeout(name)
+    with tool_duration.time(tool=name, outcome="error") as labels:
+        try:
+            result = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            labels["outcome"] = "timeout"
+            # The worker cannot be interrupted; it finishes in the background and its result is dropped
+            raise ToolTimeout(f"{name} timed out after {timeout}s") from None
+        labels["outcome"] = "ok"
+
+    if key is not None:
+        memo().set(key, copy.deepcopy(result))
+    return result
+
+
+def _import_modules(modules: list[str]) -> None:
+    for module in modules:
+        importlib.import_module(module)
+
+
+def warm_executors() -> None:
+    """Start the process pool and import the CPU-bound tool modules before the first call needs them"""
+    cpu_bound = [name for name, options in TOOL_OPTIONS.items() if options["cpu_bound"]]
+    if not cpu_bound or settings.TOOL_PROCESS_WORKERS <= 0:
+        return
+    modules = sorted({TOOL_FUNCTIONS[name].__module__ for name in cpu_bound})
+    executor = executor_for(cpu_bound[0])
+    for _ in range(settings.TOOL_PROCESS_WORKERS):
+        executor.submit(_import_modules, modules)
+
+
+def shutdown_executors() -> None:
+    global _thread_pool, _process_pool
+    for executor in (_thread_pool, _process_pool):
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+    _thread_pool = _process_pool = None
@@ -2,10 +2,15 @@ try:
     import pandas as pd
 except ImportError:
     pd = None
-from agents import function_tool
+from .runtime import tool
 
 
-@function_tool
+@tool(
+    cpu_bound=True,
+    memoize=True,
+    data_files=("data/mock_transaction_data.csv",),
+    casefold=("business_description",),
+)
 def analyze_transaction_data(business_description: str = ""):
     """
     Analyze customer transaction patterns to optimize popup strategies.
@@ -0,0 +1,62 @@
+"""
+LRU cache with per-entry TTL and a stale grace period.
+Dependency free, so it can be imported from the tools as well as from src
+"""
+
+import collections
+import time
+from typing import Any, Callable, Hashable
+
+
+class TTLCache:
+    """
+    LRU cache whose entries are fresh for `ttl` seconds.
+
+    Expired entries are kept for another `stale_ttl` seconds so callers can
+    still serve them while a refresh runs; after that they are dropped.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: float = 60.0, stale_ttl: float = 0.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+        self.entries: collections.OrderedDict[Hashable, tuple[float, Any]] = collections.OrderedDict()
+
+    def lookup(self, key: Hashable) -> tuple[Any, bool] | None:
+        """(value, fresh) for a cached key, stale or not, or None on a miss."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        age = self.clock() - stored_at
+        if age >= self.ttl + self.stale_ttl:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value, age < self.ttl
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Fresh value for key, or default."""
+        hit = self.lookup(key)
+        return hit[0] if hit is not None and hit[1] else default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self.entries[key] = (self.clock(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self.entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, self) is not self
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -1,26 +1,716 @@
 # Utility functions
 
+import abc
+import asyncio
 import collections
-from datetime import datetime, timedelta
-from decimal import Decimal
+import copy
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from decimal import ROUND_HALF_EVEN, Decimal
 from dotenv import load_dotenv
+import importlib.util
 import os
-from typing import Any
+import threading
+from typing import Any, AsyncIterator
+from urllib.parse import urlparse
 import httpx
 import json
+import numpy as np
+import time
 
 from fastapi import HTTPException
 
+from src.config import settings
+from src.metrics import shopify_bulk_orphans, shopify_request_duration
+
 load_dotenv()
 LOOKBACK_DAYS = 30
+ROLLUP_WINDOWS = (7, 30, 90)
+# Amounts are aggregated as integer thousandths: the finest minor unit of any
+# currency a shop can use (KWD, BHD, JOD, OMR, TND have three decimals)
+MINOR_UNIT_DIGITS = 3
+
+# Combined field set for every order aggregator, so one walk of the orders
+# connection can feed all of them.
+ORDER_SCAN_QUERY = """
+query($first: Int!, $after: String) {{
+orders(first: $first, query: "{search}", after: $after) {{
+    pageInfo {{ hasNextPage }}
+    edges {{
+    cursor
+    node {{
+        id
+        processedAt
+        totalPriceSet {{ shopMoney {{ amount }} }}
+        lineItems(first: {line_items}) {{
+        pageInfo {{ hasNextPage endCursor }}
+        edges {{
+            node {{
+            quantity
+            originalTotalSet {{ shopMoney {{ amount }} }}
+            product {{ id }}
+            }}
+        }}
+        }}
+    }}
+    }}
+}}
+}}"""
+
+
+# Follow-up page of line items for one order that the scan truncated; aliased
+# once per order so a single request can continue several orders.
+ORDER_LINE_ITEMS_FIELD = """
+o{index}: order(id: $id{index}) {{
+    lineItems(first: {first}, after: $after{index}) {{
+    pageInfo {{ hasNextPage endCursor }}
+    edges {{
+        node {{
+        quantity
+        originalTotalSet {{ shopMoney {{ amount }} }}
+        product {{ id }}
+        }}
+    }}
+    }}
+}}"""
+
+# Bulk operations ignore pagination arguments and flatten nested connections into
+# JSONL, one object per line, with children pointing at their order via __parentId.
+BULK_ORDER_QUERY = """
+{{
+orders(query: "{search}") {{
+    edges {{
+    node {{
+        id
+        processedAt
+        totalPriceSet {{ shopMoney {{ amount }} }}
+        lineItems {{
+        edges {{
+            node {{
+            quantity
+            originalTotalSet {{ shopMoney {{ amount }} }}
+            product {{ id }}
+            }}
+        }}
+        }}
+    }}
+    }}
+}}
+}}"""
+
+BULK_RUN_MUTATION = """
+mutation($query: String!) {
+bulkOperationRunQuery(query: $query) {
+    bulkOperation { id status }
+    userErrors { field message }
+}
+}"""
+
+BULK_STATUS_QUERY = """
+query($id: ID!) {
+node(id: $id) {
+    ... on BulkOperation { id status errorCode objectCount url }
+}
+}"""
+
+ORDERS_COUNT_QUERY = """
+query {{
+ordersCount(query: "{search}") {{ count }}
+}}"""
+
+
+def order_line_items_query(count: int, first: int) -> str:
+    params = ", ".join(f"$id{i}: ID!, $after{i}: String" for i in range(count))
+    fields = "".join(ORDER_LINE_ITEMS_FIELD.format(index=i, first=first) for i in range(count))
+    return f"query({params}) {{{fields}\n}}"
+
+
+def query_cost_key(query: str, first: Any = None) -> str:
+    """Key for remembering query costs; the cost of a connection query scales with `first`."""
+    return f"{query}:{first}"
+
+
+def shopify_timestamp(dt: datetime) -> str:
+    """Format a datetime the way Shopify search queries expect (UTC, second precision)."""
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def parse_shopify_timestamp(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def parse_minor_units(amount: str, digits: int = MINOR_UNIT_DIGITS) -> int:
+    """Parse a decimal amount string such as "12.5" into integer minor units (12500) without floats."""
+    text = str(amount).strip()
+    negative = text.startswith("-")
+    whole, _, fraction = text.lstrip("+-").partition(".")
+    if len(fraction) > digits:
+        if fraction[digits:].strip("0"):
+            # Finer than any currency's minor unit: round like Decimal would instead of failing the scan
+            return int(Decimal(text).scaleb(digits).quantize(Decimal(1), rounding=ROUND_HALF_EVEN))
+        fraction = fraction[:digits]
+    units = int(whole or "0") * 10**digits + int(fraction.ljust(digits, "0") or "0")
+    return -units if negative else units
+
+
+def minor_to_decimal(units: int, digits: int = MINOR_UNIT_DIGITS) -> Decimal:
+    return Decimal(int(units)).scaleb(-digits)
+
+
+def parse_minor_units_array(amounts: list[str], digits: int = MINOR_UNIT_DIGITS) -> np.ndarray:
+    """
+    Vectorized parse_minor_units returning int64.
+
+    Strings are parsed to float64 in C and rounded to minor units; that is exact
+    for amounts with at most `digits` decimals well below 2**53. Anything that
+    does not land on a whole minor unit, or is too large, is re-parsed exactly.
+    """
+    scaled = np.array(amounts, dtype=np.float64) * 10**digits
+    units = np.rint(scaled)
+    suspect = (np.abs(scaled - units) > 1e-6) | (np.abs(units) >= 2**50)
+    units = units.astype(np.int64)
+    for i in np.flatnonzero(suspect):
+        units[i] = parse_minor_units(amounts[i], digits)
+    return units
+
+
+def parse_timestamp_array(values: list[str]) -> np.ndarray:
+    """Epoch seconds (int64) for a list of Shopify timestamps."""
+    if all(value.endswith("Z") for value in values):
+        return np.array([value[:-1] for value in values], dtype="datetime64[s]").astype(np.int64)
+    return np.array([int(parse_shopify_timestamp(value).timestamp()) for value in values], dtype=np.int64)
+
+
+class OrderBatch:
+    """
+    A page of order nodes flattened into NumPy arrays for vectorized aggregation.
+
+    Amounts are int64 minor units, so sums are exact. Line items point at their
+    order by row (`line_order`) and at their product by index into `products`,
+    with -1 for line items that have no product.
+    """
+
+    def __init__(self, orders: list[dict[str, Any]]):
+        self.orders = orders
+        self.ids = [order["id"] for order in orders]
+        self.processed_at = parse_timestamp_array([order["processedAt"] for order in orders])
+        self.totals = parse_minor_units_array([order["totalPriceSet"]["shopMoney"]["amount"] for order in orders])
+
+        lines = [(row, li["node"]) for row, order in enumerate(orders) for li in order["lineItems"]["edges"]]
+        codes: dict[str, int] = {}
+        self.line_product = np.array(
+            [
+                -1 if node["product"] is None else codes.setdefault(node["product"]["id"], len(codes))
+                for _, node in lines
+            ],
+            dtype=np.int64,
+        )
+        self.products = list(codes)
+        self.line_order = np.array([row for row, _ in lines], dtype=np.int64)
+        self.quantities = np.array([node["quantity"] for _, node in lines], dtype=np.int64)
+        self.amounts = parse_minor_units_array([node["originalTotalSet"]["shopMoney"]["amount"] for _, node in lines])
+        # Units over all line items of each order, including those without a product
+        self.units = np.zeros(len(orders), dtype=np.int64)
+        np.add.at(self.units, self.line_order, self.quantities)
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    def product_totals(self, orders: np.ndarray) -> dict[str, tuple[int, int]]:
+        """Group line items of the selected orders (boolean mask) by product: {gid: (units, sales)}."""
+        lines = orders[self.line_order] & (self.line_product >= 0)
+        products = self.line_product[lines]
+        units = np.zeros(len(self.products), dtype=np.int64)
+        sales = np.zeros(len(self.products), dtype=np.int64)
+        np.add.at(units, products, self.quantities[lines])
+        np.add.at(sales, products, self.amounts[lines])
+        return {self.products[code]: (int(units[code]), int(sales[code])) for code in np.unique(products)}
+
+
+class OrderAggregator(abc.ABC):
+    """
+    Base class for anything fed by ShopifyService.scan_orders.
+
+    Each aggregator declares its own lookback window and ignores orders outside
+    of it, so aggregators with different windows can share a single scan.
+    """
+
+    def __init__(self, lookback_days: int = LOOKBACK_DAYS, now: datetime | None = None):
+        self.now = now or datetime.now(timezone.utc)
+        self.since = (self.now - timedelta(days=lookback_days)).replace(microsecond=0)
+
+    def in_window(self, order: dict[str, Any]) -> bool:
+        return parse_shopify_timestamp(order["processedAt"]) >= self.since
+
+    def batch_in_window(self, batch: OrderBatch) -> np.ndarray:
+        return batch.processed_at >= int(self.since.timestamp())
+
+    @abc.abstractmethod
+    def reset(self) -> None:
+        """Clear the accumulated state."""
+
+    @abc.abstractmethod
+    def consume(self, order: dict[str, Any]) -> None:
+        """Add one order (in the orders connection shape) to the state."""
+
+    def consume_batch(self, batch: OrderBatch) -> None:
+        """Consume a page of orders; subclasses override this with a vectorized version."""
+        for order in batch.orders:
+            self.consume(order)
+
+    @abc.abstractmethod
+    def merge(self, other: "OrderAggregator") -> None:
+        """Fold in the state of a partial aggregator spawned from this one."""
+
+    @abc.abstractmethod
+    def result(self) -> Any:
+        """The aggregate in the shape the matching fetch_* method returns."""
+
+    def spawn(self) -> "OrderAggregator":
+        """Empty aggregator with the same configuration, e.g. to scan one time shard."""
+        partial = copy.copy(self)
+        partial.reset()
+        return partial
+
+
+class ProductSalesAggregator(OrderAggregator):
+    """Per-product units and gross sales: {product_gid: {'unitsSold30d': int, 'grossSales30d': float}}."""
+
+    def __init__(self, lookback_days: int = LOOKBACK_DAYS, now: datetime | None = None):
+        super().__init__(lookback_days, now)
+        self.reset()
+
+    def reset(self) -> None:
+        # sales in integer minor units
+        self.totals = collections.defaultdict(lambda: {"units": 0, "sales": 0})
+
+    def consume(self, order: dict[str, Any]) -> None:
+        if not self.in_window(order):
+            return
+        for li in order["lineItems"]["edges"]:
+            node = li["node"]
+            if node["product"] is None:
+                continue
+            gid = node["product"]["id"]
+            self.totals[gid]["units"] += int(node["quantity"])
+            self.totals[gid]["sales"] += parse_minor_units(node["originalTotalSet"]["shopMoney"]["amount"])
+
+    def consume_batch(self, batch: OrderBatch) -> None:
+        for gid, (units, sales) in batch.product_totals(self.batch_in_window(batch)).items():
+            self.totals[gid]["units"] += units
+            self.totals[gid]["sales"] += sales
+
+    def merge(self, other: "ProductSalesAggregator") -> None:
+        for gid, v in other.totals.items():
+            self.totals[gid]["units"] += v["units"]
+            self.totals[gid]["sales"] += v["sales"]
+
+    def result(self) -> dict[str, Any]:
+        return {
+            gid: {"unitsSold30d": v["units"], "grossSales30d": float(minor_to_decimal(v["sales"]))}
+            for gid, v in self.totals.items()
+        }
+
+
+class AOVAggregator(OrderAggregator):
+    """Average order value over the lookback window."""
+
+    def __init__(self, lookback_days: int = LOOKBACK_DAYS, now: datetime | None = None):
+        super().__init__(lookback_days, now)
+        self.reset()
+
+    def reset(self) -> None:
+        self.total_revenue = 0  # minor units
+        self.total_orders = 0
+
+    def consume(self, order: dict[str, Any]) -> None:
+        if not self.in_window(order):
+            return
+        self.total_revenue += parse_minor_units(order["totalPriceSet"]["shopMoney"]["amount"])
+        self.total_orders += 1
+
+    def consume_batch(self, batch: OrderBatch) -> None:
+        selected = self.batch_in_window(batch)
+        self.total_revenue += int(batch.totals[selected].sum())
+        self.total_orders += int(selected.sum())
+
+    def merge(self, other: "AOVAggregator") -> None:
+        self.total_revenue += other.total_revenue
+        self.total_orders += other.total_orders
+
+    def result(self) -> float:
+        if self.total_orders == 0:
+            return 0.0
+        return float(minor_to_decimal(self.total_revenue) / self.total_orders)
+
+
+class WindowRollupAggregator(OrderAggregator):
+    """Order count, revenue, units and AOV for several lookback windows, e.g. 7/30/90 days."""
+
+    def __init__(self, windows: tuple[int, ...] = ROLLUP_WINDOWS, now: datetime | None = None):
+        super().__init__(max(windows), now)
+        self.cutoffs = {days: (self.now - timedelta(days=days)).replace(microsecond=0) for days in windows}
+        self.reset()
+
+    def reset(self) -> None:
+        # revenue in integer minor units
+        self.rollups = {days: {"orders": 0, "units": 0, "revenue": 0} for days in self.cutoffs}
+
+    def consume(self, order: dict[str, Any]) -> None:
+        processed_at = parse_shopify_timestamp(order["processedAt"])
+        revenue = parse_minor_units(order["totalPriceSet"]["shopMoney"]["amount"])
+        units = sum(int(li["node"]["quantity"]) for li in order["lineItems"]["edges"])
+        for days, cutoff in self.cutoffs.items():
+            if processed_at < cutoff:
+                continue
+            rollup = self.rollups[days]
+            rollup["orders"] += 1
+            rollup["units"] += units
+            rollup["revenue"] += revenue
+
+    def consume_batch(self, batch: OrderBatch) -> None:
+        for days, cutoff in self.cutoffs.items():
+            selected = batch.processed_at >= int(cutoff.timestamp())
+            rollup = self.rollups[days]
+            rollup["orders"] += int(selected.sum())
+            rollup["units"] += int(batch.units[selected].sum())
+            rollup["revenue"] += int(batch.totals[selected].sum())
+
+    def merge(self, other: "WindowRollupAggregator") -> None:
+        for days, rollup in other.rollups.items():
+            for key, value in rollup.items():
+                self.rollups[days][key] += value
+
+    def result(self) -> dict[str, Any]:
+        return {
+            f"{days}d": {
+                "orders": r["orders"],
+                "units": r["units"],
+                "revenue": float(minor_to_decimal(r["revenue"])),
+                "aov": float(minor_to_decimal(r["revenue"]) / r["orders"]) if r["orders"] else 0.0,
+            }
+            for days, r in self.rollups.items()
+        }
+
+
+class DailySalesAggregator(OrderAggregator):
+    """
+    Per-day, per-product units and sales for orders newer than a watermark.
+
+    Orders exactly at the watermark second are deduplicated against the ids
+    already counted there, so scans can safely use processed_at:>=watermark.
+    """
+
+    def __init__(self, since: datetime, seen_ids: set[str] | None = None, now: datetime | None = None):
+        super().__init__(LOOKBACK_DAYS, now)
+        self.since = since
+        self.seen_ids = set(seen_ids or ())
+        self.reset()
+
+    def reset(self) -> None:
+        self.watermark = self.since
+        self.watermark_ids = set(self.seen_ids)
+        self.days = collections.defaultdict(
+            # sales in integer minor units
+            lambda: collections.defaultdict(lambda: {"units": 0, "sales": 0})
+        )
+
+    def consume(self, order: dict[str, Any]) -> None:
+        processed_at = parse_shopify_timestamp(order["processedAt"])
+        if processed_at < self.since or (processed_at == self.since and order["id"] in self.seen_ids):
+            return
+
+        day = self.days[processed_at.date().isoformat()]
+        for li in order["lineItems"]["edges"]:
+            node = li["node"]
+            if node["product"] is None:
+                continue
+            bucket = day[node["product"]["id"]]
+            bucket["units"] += int(node["quantity"])
+            bucket["sales"] += parse_minor_units(node["originalTotalSet"]["shopMoney"]["amount"])
+
+        self.advance_watermark(processed_at, {order["id"]})
+
+    def consume_batch(self, batch: OrderBatch) -> None:
+        since = int(self.since.timestamp())
+        unseen = np.array([order_id not in self.seen_ids for order_id in batch.ids], dtype=bool)
+        selected = (batch.processed_at > since) | ((batch.processed_at == since) & unseen)
+        if not selected.any():
+            return
+
+        order_days = batch.processed_at // 86400
+        for day_number in np.unique(order_days[selected]):
+            day = self.days[datetime.fromtimestamp(int(day_number) * 86400, timezone.utc).date().isoformat()]
+            for gid, (units, sales) in batch.product_totals(selected & (order_days == day_number)).items():
+                day[gid]["units"] += units
+                day[gid]["sales"] += sales
+
+        latest = batch.processed_at[selected].max()
+        ids = {batch.ids[row] for row in np.flatnonzero(selected & (batch.processed_at == latest))}
+        self.advance_watermark(datetime.fromtimestamp(int(latest), timezone.utc), ids)
+
+    def advance_watermark(self, processed_at: datetime, ids: set[str]) -> None:
+        if processed_at > self.watermark:
+            self.watermark = processed_at
+            self.watermark_ids = set(ids)
+        elif processed_at == self.watermark:
+            self.watermark_ids |= ids
+
+    def merge(self, other: "DailySalesAggregator") -> None:
+        for day, products in other.days.items():
+            for gid, bucket in products.items():
+                self.days[day][gid]["units"] += bucket["units"]
+                self.days[day][gid]["sales"] += bucket["sales"]
+        self.advance_watermark(other.watermark, other.watermark_ids)
+
+    def result(self) -> dict[str, dict[str, dict[str, Any]]]:
+        return self.days
+
+
+class SalesRollupStore:
+    """
+    JSON-file persistence for incremental sales rollups, keyed by store.
+
+    Each store keeps {"watermark", "watermark_ids", "days": {date: {gid: {"units", "sales"}}}},
+    with sales stored as decimal strings. load and save do blocking file I/O;
+    call them off the event loop.
+    """
+
+    def __init__(self, path: str = settings.SALES_ROLLUP_STORE_PATH):
+        self.path = path
+        self.locks: dict[str, asyncio.Lock] = collections.defaultdict(asyncio.Lock)
+        # The file holds every store; saves for different stores must not interleave
+        self.file_lock = threading.Lock()
+
+    def _read(self) -> dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def load(self, store_url: str) -> dict[str, Any]:
+        return self._read().get("sales_rollups", {}).get(store_url, {})
+
+    def save(self, store_url: str, state: dict[str, Any]) -> None:
+        with self.file_lock:
+            data = self._read()
+            data.setdefault("sales_rollups", {})[store_url] = state
+            tmp_path = f"{self.path}.tmp"
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+
+
+sales_rollup_store = SalesRollupStore()
+
+
+class QueryCostExceeded(HTTPException):
+    """A single query asked for more than Shopify's max query cost."""
+
+    def __init__(self, cost: float, max_cost: float, errors: Any):
+        super().__init__(status_code=400, detail=f"GraphQL query failed: {errors}")
+        self.cost = cost
+        self.max_cost = max_cost
+
+
+class CostThrottle:
+    """
+    Client-side mirror of Shopify's GraphQL leaky bucket for one store.
+
+    Requests wait until the bucket holds their estimated cost, and waiters are
+    served in arrival order (asyncio.Lock is FIFO). The bucket is re-synced from
+    extensions.cost.throttleStatus on every response, and the requested cost of
+    each query is remembered to estimate the next call and size orders pages.
+    """
+
+    def __init__(self, maximum_available: float = 1000.0, restore_rate: float = 50.0):
+        self.maximum_available = maximum_available
+        self.restore_rate = restore_rate
+        self.available = maximum_available
+        self.updated_at = time.monotonic()
+        self.requested_costs: dict[str, float] = {}
+        self.item_costs: dict[str, float] = {}
+        self._lock = asyncio.Lock()
+        self._synced = asyncio.Event()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.maximum_available, self.available + (now - self.updated_at) * self.restore_rate)
+        self.updated_at = now
+
+    async def acquire(self, cost: float) -> None:
+        cost = min(cost, self.maximum_available)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.available >= cost:
+                    break
+                # Wake up early if a response re-syncs the bucket (and possibly the restore rate)
+                synced = self._synced
+                try:
+                    await asyncio.wait_for(synced.wait(), (cost - self.available) / self.restore_rate)
+                except asyncio.TimeoutError:
+                    pass
+            self.available -= cost
+
+    def estimate(self, cost_key: str) -> float:
+        return self.requested_costs.get(cost_key, settings.SHOPIFY_DEFAULT_QUERY_COST)
+
+    def record(self, cost_key: str, cost: dict[str, Any]) -> None:
+        if cost.get("requestedQueryCost") is not None:
+            self.requested_costs[cost_key] = float(cost["requestedQueryCost"])
+        status = cost.get("throttleStatus")
+        if status:
+            self.maximum_available = float(status["maximumAvailable"])
+            self.restore_rate = float(status["restoreRate"])
+            self.available = float(status["currentlyAvailable"])
+            self.updated_at = time.monotonic()
+            self._synced.set()
+            self._synced = asyncio.Event()
+
+    def page_size(self, family: str, cost_per_item: float | None = None, max_cost: float | None = None) -> int:
+        """
+        Largest page whose requested cost fits both the single query limit and the bucket.
+
+        Costs per item are shared by a query family (e.g. ORDER_SCAN_QUERY), so
+        scans with different search filters learn from each other.
+        """
+        if cost_per_item is not None and cost_per_item > 0:
+            self.item_costs[family] = cost_per_item
+        if family not in self.item_costs:
+            return settings.SHOPIFY_PAGE_SIZE
+        budget = min(max_cost or settings.SHOPIFY_MAX_QUERY_COST, self.maximum_available)
+        return max(1, min(settings.SHOPIFY_PAGE_SIZE, int(budget // max(self.item_costs[family], 1e-9))))
+
+    def expect(self, query: str, family: str, first: int) -> None:
+        """Pre-seed the cost estimate so the first request at a new page size is already paced correctly."""
+        if family in self.item_costs:
+            self.requested_costs.setdefault(query_cost_key(query, first), first * self.item_costs[family])
+
+
+shopify_throttles: dict[str, CostThrottle] = collections.defaultdict(CostThrottle)
+
+
+class ShopifyClientPool:
+    """
+    Long-lived HTTP clients for Shopify, one per store.
+
+    Each store gets its own httpx.AsyncClient (and therefore its own connection
+    limits), kept alive for the whole app so paginated scans reuse one warm
+    connection instead of paying a TCP+TLS handshake per page. Closed by the
+    FastAPI lifespan in main.py.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = settings.SHOPIFY_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections: int = settings.SHOPIFY_POOL_MAX_KEEPALIVE,
+        keepalive_expiry: float = settings.SHOPIFY_POOL_KEEPALIVE_EXPIRY,
+        http2: bool = settings.SHOPIFY_HTTP2,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.default_limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        # HTTP/2 needs the optional h2 package (httpx[http2])
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        self.transport = transport
+        self.store_limits: dict[str, httpx.Limits] = {}
+        self._clients: dict[str, httpx.AsyncClient] = {}
+        self._stats: dict[str, dict[str, int]] = {}
+
+    def set_store_limits(self, store_url: str, max_connections: int, max_keepalive_connections: int | None = None):
+        """Override the connection limits for one store. Applies the next time its client is created."""
+        self.store_limits[store_url] = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=self.default_limits.keepalive_expiry,
+        )
+
+    def get_client(self, store_url: str) -> httpx.AsyncClient:
+        client = self._clients.get(store_url)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=self.store_limits.get(store_url, self.default_limits),
+                timeout=httpx.Timeout(30.0, connect=10.0),
+                transport=self.transport,
+            )
+            self._clients[store_url] = client
+            self._stats.setdefault(store_url, {"requests": 0, "errors": 0, "in_flight": 0, "clients_created": 0})
+            self._stats[store_url]["clients_created"] += 1
+        return client
+
+    async def post(self, store_url: str, url: str, **kwargs: Any) -> httpx.Response:
+        client = self.get_client(store_url)
+        stats = self._stats[store_url]
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        try:
+            return await client.post(url, **kwargs)
+        except httpx.HTTPError:
+            stats["errors"] += 1
+            raise
+        finally:
+            stats["in_flight"] -= 1
+
+    @asynccontextmanager
+    async def stream(self, url: str) -> AsyncIterator[httpx.Response]:
+        """Stream a GET download (e.g. a bulk operation result file), pooled by the file host."""
+        host = urlparse(url).netloc
+        client = self.get_client(host)
+        stats = self._stats[host]
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        try:
+            async with client.stream("GET", url) as response:
+                yield response
+        except httpx.HTTPError:
+            stats["errors"] += 1
+            raise
+        finally:
+            stats["in_flight"] -= 1
+
+    def stats(self) -> dict[str, Any]:
+        """Per-store request counters plus the state of the underlying connections."""
+        result = {}
+        for store_url, client in self._clients.items():
+            # httpcore keeps its pool on the transport; not every transport has one (e.g. test transports)
+            connections = getattr(getattr(client._transport, "_pool", None), "connections", [])
+            limits = self.store_limits.get(store_url, self.default_limits)
+            result[store_url] = {
+                **self._stats[store_url],
+                "closed": client.is_closed,
+                "http2": self.http2,
+                "max_connections": limits.max_connections,
+                "max_keepalive_connections": limits.max_keepalive_connections,
+                "connections": len(connections),
+                "idle_connections": sum(1 for c in connections if c.is_idle()),
+            }
+        return result
+
+    async def aclose(self) -> None:
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+
+shopify_pool = ShopifyClientPool()
 
 
 class ShopifyService:
-    def __init__(self):
+    def __init__(self, pool: ShopifyClientPool | None = None, throttle: CostThrottle | None = None):
         self.api_version = os.getenv("SHOPIFY_API_VERSION")
         # self.store_url = "just-us-skin-care.myshopify.com"
         self.store_url = "extra-base-sports.myshopify.com"
         self.access_token = os.getenv("SHOPIFY_ACCESS_TOKEN")
+        self.pool = pool or shopify_pool
+        self.scan_mode = settings.SHOPIFY_SCAN_MODE
+        self.throttle = throttle or shopify_throttles[self.store_url]
 
     async def make_graphql_request(
         self,
@@ -58,127 +748,364 @@ class ShopifyService:
             headers = {"Content-Type": "application/json", "Shopify-Storefront-Private-Token": access_token}
 
         payload = {"query": query, "variables": variables or {}}
+        cost_key = query_cost_key(query, payload["variables"].get("first"))
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, content=json.dumps(payload))
+        for _ in range(settings.SHOPIFY_THROTTLE_MAX_RETRIES + 1):
+            await self.throttle.acquire(self.throttle.estimate(cost_key))
+            with shopify_request_duration.time(api=api_type, status="error") as labels:
+                response = await self.pool.post(shop, url, headers=headers, content=json.dumps(payload))
+                labels["status"] = response.status_code
 
+            if response.status_code == 429:
+                await asyncio.sleep(float(response.headers.get("Retry-After", 1.0)))
+                continue
             if response.status_code != 200:
                 raise HTTPException(
                     status_code=response.status_code, detail=f"Shopify API request failed: {response.text}"
                 )
 
             data = response.json()
+            cost = data.get("extensions", {}).get("cost")
+            if cost:
+                self.throttle.record(cost_key, cost)
 
             if "errors" in data:
-                raise HTTPException(status_code=400, detail=f"GraphQL query failed: {data['errors']}")
+                errors = data["errors"]
+                codes = {(error.get("extensions") or {}).get("code") for error in errors}
+                if "THROTTLED" in codes:
+                    # The bucket now reflects Shopify's view; the next acquire waits for it to refill
+                    continue
+                if "MAX_COST_EXCEEDED" in codes:
+                    limit = next(
+                        e.get("extensions") or {}
+                        for e in errors
+                        if (e.get("extensions") or {}).get("code") == "MAX_COST_EXCEEDED"
+                    )
+                    raise QueryCostExceeded(limit.get("cost", 0), limit.get("maxCost", 0), errors)
+                raise HTTPException(status_code=400, detail=f"GraphQL query failed: {errors}")
 
             return data
 
-    async def fetch_30d_sales(self) -> dict[str, Any]:
-        """Return {product_gid: {'units': int, 'sales': Decimal}}."""
-        since = (datetime.utcnow() - timedelta(days=LOOKBACK_DAYS)).replace(microsecond=0).isoformat() + "Z"
-
-        base_query = """
-        query($after: String) {{
-        orders(first: 250, query: "processed_at:>={since}", after: $after) {{
-            pageInfo {{ hasNextPage }}
-            edges {{
-            cursor
-            node {{
-                lineItems(first: 100) {{
-                edges {{
-                    node {{
-                    quantity
-                    originalTotalSet {{ shopMoney {{ amount }} }}
-                    product {{ id }}
-                    }}
-                }}
-                }}
-            }}
-            }}
-        }}
-        }}"""
-        query = base_query.format(since=since)
-        variables = {}
+        raise HTTPException(status_code=429, detail="Shopify API request throttled: retries exhausted")
 
-        # YOUR existing async helper
-        first_page = await ShopifyService().make_graphql_request(query=query, variables=variables, api_type="admin")
+    async def scan_orders(
+        self, aggregators: list[OrderAggregator], mode: str | None = None, shards: int | None = None
+    ) -> None:
+        """
+        Walk the orders connection once and feed every order to each aggregator.
 
-        # Simple aggregator
-        totals = collections.defaultdict(lambda: {"units": 0, "sales": Decimal("0")})
+        The scan starts at the earliest `since` of the given aggregators; each
+        aggregator filters down to its own window.
 
-        def consume(page):
-            for edge in page["data"]["orders"]["edges"]:
-                for li in edge["node"]["lineItems"]["edges"]:
-                    node = li["node"]
-                    if node["product"] is None:
-                        continue
-                    gid = node["product"]["id"]
-                    totals[gid]["units"] += int(node["quantity"])
-                    totals[gid]["sales"] += Decimal(node["originalTotalSet"]["shopMoney"]["amount"])
-
-        consume(first_page)
-
-        # follow pagination if needed
-        while first_page["data"]["orders"]["pageInfo"]["hasNextPage"]:
-            cursor = first_page["data"]["orders"]["edges"][-1]["cursor"]
-            next_page = await ShopifyService().make_graphql_request(
-                query=query,
-                variables={"after": cursor},
-                api_type="admin",
-            )
-            consume(next_page)
-            first_page = next_page
+        Args:
+            aggregators: Aggregators to feed
+            mode: "paginated", "bulk" or "auto" (bulk operation for large order volumes).
+                Defaults to self.scan_mode.
+            shards: Split a paginated scan into this many processed_at ranges paged
+                concurrently. Defaults to SHOPIFY_SCAN_SHARDS.
+        """
+        since = min(aggregator.since for aggregator in aggregators)
+        search = f"processed_at:>={shopify_timestamp(since)}"
 
-        # cast Decimals to float for JSON
-        return {gid: {"unitsSold30d": v["units"], "grossSales30d": float(v["sales"])} for gid, v in totals.items()}
+        mode = mode or self.scan_mode
+        if mode == "auto":
+            order_count = await self.estimate_order_count(search)
+            mode = "bulk" if order_count >= settings.SHOPIFY_BULK_MIN_ORDERS else "paginated"
 
-    async def calculate_aov(self) -> float:
-        """Calculate Average Order Value over the last 30 days."""
-        since = (datetime.utcnow() - timedelta(days=LOOKBACK_DAYS)).replace(microsecond=0).isoformat() + "Z"
-
-        query = (
-            """
-        query($after: String) {
-        orders(first: 250, query: "processed_at:>=%s", after: $after) {
-            pageInfo { hasNextPage }
-            edges {
-            cursor
-            node {
-                totalPriceSet { shopMoney { amount } }
-            }
-            }
-        }
-        }"""
-            % since
+        if mode == "bulk":
+            await self.scan_orders_bulk(aggregators, search)
+        elif mode == "paginated":
+            shards = shards or settings.SHOPIFY_SCAN_SHARDS
+            if shards > 1:
+                await self.scan_orders_sharded(aggregators, since, shards)
+            else:
+                await self.scan_orders_paginated(aggregators, search)
+        else:
+            raise ValueError('mode must be one of "auto", "paginated" or "bulk"')
+
+    async def estimate_order_count(self, search: str) -> int:
+        page = await self.make_graphql_request(query=ORDERS_COUNT_QUERY.format(search=search), api_type="admin")
+        return int(page["data"]["ordersCount"]["count"])
+
+    async def scan_orders_paginated(
+        self, aggregators: list[OrderAggregator], search: str, in_flight: asyncio.Semaphore | None = None
+    ) -> None:
+        """
+        Page through the orders matching `search`. `in_flight` bounds the concurrent
+        requests of the whole scan, including line item follow-ups; sharded scans
+        share one between their shards.
+        """
+        in_flight = in_flight or asyncio.Semaphore(settings.SHOPIFY_SCAN_MAX_IN_FLIGHT)
+        query = ORDER_SCAN_QUERY.format(search=search, line_items=settings.SHOPIFY_SCAN_LINE_ITEMS)
+        first = self.throttle.page_size(ORDER_SCAN_QUERY)
+
+        cursor = None
+        while True:
+            self.throttle.expect(query, ORDER_SCAN_QUERY, first)
+            try:
+                async with in_flight:
+                    page = await self.make_graphql_request(
+                        query=query, variables={"first": first, "after": cursor}, api_type="admin"
+                    )
+            except QueryCostExceeded as e:
+                if first == 1:
+                    raise
+                # Always shrink, even when the error carries no usable cost
+                new_size = self.throttle.page_size(ORDER_SCAN_QUERY, e.cost / first, e.max_cost)
+                first = max(1, min(new_size, first // 2))
+                continue
+
+            # Size the next page from the cost Shopify charged for this one
+            cost = page.get("extensions", {}).get("cost")
+            if cost and cost.get("requestedQueryCost"):
+                first = self.throttle.page_size(ORDER_SCAN_QUERY, float(cost["requestedQueryCost"]) / first)
+
+            orders = page["data"]["orders"]
+            truncated = [
+                edge["node"]
+                for edge in orders["edges"]
+                if edge["node"]["lineItems"].get("pageInfo", {}).get("hasNextPage")
+            ]
+            if truncated:
+                await self.fetch_remaining_line_items(truncated, in_flight)
+
+            batch = OrderBatch([edge["node"] for edge in orders["edges"]])
+            for aggregator in aggregators:
+                aggregator.consume_batch(batch)
+
+            if not orders["pageInfo"]["hasNextPage"] or not orders["edges"]:
+                break
+            cursor = orders["edges"][-1]["cursor"]
+
+    async def fetch_remaining_line_items(
+        self, orders: list[dict[str, Any]], in_flight: asyncio.Semaphore | None = None
+    ) -> None:
+        """
+        Complete, in place, the line items of orders whose first page was truncated.
+
+        Orders are continued in batches of aliased order(id:) fields, each with its
+        own cursor, and batches run concurrently within the scan's `in_flight`
+        limit. This keeps the per-page cost of the main scan small instead of
+        raising lineItems(first:) for every order.
+        """
+        first = settings.SHOPIFY_LINE_ITEM_PAGE_SIZE
+        batch_size = settings.SHOPIFY_LINE_ITEM_BATCH
+        in_flight = in_flight or asyncio.Semaphore(settings.SHOPIFY_SCAN_MAX_IN_FLIGHT)
+
+        async def continue_batch(batch: list[dict[str, Any]]) -> None:
+            while batch:
+                variables = {}
+                for i, order in enumerate(batch):
+                    variables[f"id{i}"] = order["id"]
+                    variables[f"after{i}"] = order["lineItems"]["pageInfo"]["endCursor"]
+                async with in_flight:
+                    page = await self.make_graphql_request(
+                        query=order_line_items_query(len(batch), first), variables=variables, api_type="admin"
+                    )
+
+                remaining = []
+                for i, order in enumerate(batch):
+                    line_items = page["data"][f"o{i}"]["lineItems"]
+                    order["lineItems"]["edges"].extend(line_items["edges"])
+                    order["lineItems"]["pageInfo"] = line_items["pageInfo"]
+                    if line_items["pageInfo"]["hasNextPage"]:
+                        remaining.append(order)
+                batch = remaining
+
+        await asyncio.gather(
+            *(continue_batch(orders[i : i + batch_size]) for i in range(0, len(orders), batch_size))
+        )
+
+    async def scan_orders_sharded(self, aggregators: list[OrderAggregator], since: datetime, shards: int) -> None:
+        """
+        Page through `shards` processed_at ranges concurrently and merge the results.
+
+        Each shard feeds its own spawned aggregators, which are merged back in
+        shard order once every shard is done. The last range is open-ended so
+        orders processed during the scan are not lost. All shards share one
+        in-flight limit, so pages and line item follow-ups together never exceed
+        SHOPIFY_SCAN_MAX_IN_FLIGHT requests.
+        """
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        step = (now - since) / shards
+        bounds = [since + step * i for i in range(shards)] + [None]
+        in_flight = asyncio.Semaphore(settings.SHOPIFY_SCAN_MAX_IN_FLIGHT)
+
+        async def scan_shard(start: datetime, end: datetime | None) -> list[OrderAggregator]:
+            partials = [aggregator.spawn() for aggregator in aggregators]
+            search = f"processed_at:>={shopify_timestamp(start)}"
+            if end is not None:
+                search += f" processed_at:<{shopify_timestamp(end)}"
+            await self.scan_orders_paginated(partials, search, in_flight)
+            return partials
+
+        results = await asyncio.gather(*(scan_shard(start, end) for start, end in zip(bounds, bounds[1:])))
+        for partials in results:
+            for aggregator, partial in zip(aggregators, partials):
+                aggregator.merge(partial)
+
+    async def scan_orders_bulk(self, aggregators: list[OrderAggregator], search: str) -> None:
+        """
+        Run the scan as a Shopify bulk operation and stream its JSONL result.
+
+        Line items come after their parent order in the file and are attached
+        to it by __parentId, so only one batch of orders is held in memory while
+        streaming. Line items whose order is not in the current batch cannot be
+        counted; they are logged and counted in shopify_bulk_orphans.
+        """
+        url = await self.run_bulk_query(BULK_ORDER_QUERY.format(search=search))
+        if url is None:
+            # Completed without any matching objects
+            return
+
+        # Order id -> order, for the batch not yet handed to the aggregators
+        pending: dict[str, dict[str, Any]] = {}
+        orphans = 0
+
+        def flush():
+            if pending:
+                batch = OrderBatch(list(pending.values()))
+                for aggregator in aggregators:
+                    aggregator.consume_batch(batch)
+                pending.clear()
+
+        async with self.pool.stream(url) as response:
+            if response.status_code != 200:
+                raise HTTPException(status_code=502, detail=f"Bulk result download failed: {response.status_code}")
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if "__parentId" not in record:
+                    if len(pending) >= settings.SHOPIFY_PAGE_SIZE:
+                        flush()
+                    pending[record["id"]] = {**record, "lineItems": {"edges": []}}
+                elif record["__parentId"] in pending:
+                    pending[record["__parentId"]]["lineItems"]["edges"].append({"node": record})
+                else:
+                    orphans += 1
+        flush()
+
+        if orphans:
+            shopify_bulk_orphans.inc(orphans)
+            print(f"Bulk operation result for {self.store_url}: {orphans} line items without a pending parent order")
+
+    async def run_bulk_query(self, query: str) -> str | None:
+        """Submit a bulkOperationRunQuery, wait for it to finish and return the result URL."""
+        submitted = await self.make_graphql_request(
+            query=BULK_RUN_MUTATION, variables={"query": query}, api_type="admin"
         )
+        payload = submitted["data"]["bulkOperationRunQuery"]
+        if payload["userErrors"]:
+            raise HTTPException(status_code=400, detail=f"Bulk operation rejected: {payload['userErrors']}")
 
-        variables = {}
-        first_page = await ShopifyService().make_graphql_request(query=query, variables=variables, api_type="admin")
+        operation_id = payload["bulkOperation"]["id"]
+        while True:
+            status = await self.make_graphql_request(
+                query=BULK_STATUS_QUERY, variables={"id": operation_id}, api_type="admin"
+            )
+            operation = status["data"]["node"]
+            if operation["status"] == "COMPLETED":
+                return operation["url"]
+            if operation["status"] in ("FAILED", "CANCELED", "EXPIRED"):
+                raise HTTPException(
+                    status_code=502,
+                    detail=f"Bulk operation {operation_id} {operation['status'].lower()}: {operation.get('errorCode')}",
+                )
+            await asyncio.sleep(settings.SHOPIFY_BULK_POLL_INTERVAL)
+
+    async def fetch_30d_sales(self) -> dict[str, Any]:
+        """Return {product_gid: {'unitsSold30d': int, 'grossSales30d': float}}."""
+        sales = ProductSalesAggregator()
+        await self.scan_orders([sales])
+        return sales.result()
+
+    async def refresh_30d_sales(self, rollups: SalesRollupStore | None = None) -> dict[str, Any]:
+        """
+        Incremental version of fetch_30d_sales.
 
-        total_revenue = Decimal("0")
-        total_orders = 0
+        Only orders processed since the persisted watermark are fetched; they are
+        added to per-day buckets, days that left the window are dropped, and the
+        remaining days are summed into the fetch_30d_sales shape. The day the
+        window starts in is re-scanned from the exact window start on every
+        refresh, so the totals match fetch_30d_sales.
+        """
+        rollups = rollups or sales_rollup_store
+        async with rollups.locks[self.store_url]:
+            now = datetime.now(timezone.utc)
+            window_start = (now - timedelta(days=LOOKBACK_DAYS)).replace(microsecond=0)
+            first_day = window_start.date().isoformat()
 
-        def consume(page):
-            nonlocal total_revenue, total_orders
-            for edge in page["data"]["orders"]["edges"]:
-                total_revenue += Decimal(edge["node"]["totalPriceSet"]["shopMoney"]["amount"])
-                total_orders += 1
+            state = await asyncio.to_thread(rollups.load, self.store_url)
+            watermark = parse_shopify_timestamp(state["watermark"]) if state.get("watermark") else None
+            if watermark is None or watermark < window_start:
+                # Nothing usable persisted: rebuild the whole window
+                daily = DailySalesAggregator(window_start, now=now)
+                days = {}
+                await self.scan_orders([daily])
+            else:
+                daily = DailySalesAggregator(watermark, set(state.get("watermark_ids", [])), now=now)
+                days = {day: products for day, products in state.get("days", {}).items() if day > first_day}
+                # The stored bucket of the first day may hold orders from before window_start
+                boundary = DailySalesAggregator(window_start, now=now)
+                next_day = datetime.combine(window_start.date() + timedelta(days=1), datetime.min.time(), timezone.utc)
+                boundary_search = (
+                    f"processed_at:>={shopify_timestamp(window_start)} processed_at:<{shopify_timestamp(next_day)}"
+                )
+                await asyncio.gather(
+                    self.scan_orders([daily]),
+                    self.scan_orders_paginated([boundary], boundary_search),
+                )
+                # daily only saw the first day from the watermark on; boundary saw all of it
+                if first_day in boundary.days:
+                    daily.days[first_day] = boundary.days[first_day]
+                else:
+                    daily.days.pop(first_day, None)
 
-        consume(first_page)
+            for day, products in daily.result().items():
+                if day < first_day:
+                    continue
+                stored = days.setdefault(day, {})
+                for gid, bucket in products.items():
+                    previous = stored.get(gid, {"units": 0, "sales": "0"})
+                    stored[gid] = {
+                        "units": previous["units"] + bucket["units"],
+                        "sales": str(Decimal(previous["sales"]) + minor_to_decimal(bucket["sales"])),
+                    }
 
-        # follow pagination if needed
-        while first_page["data"]["orders"]["pageInfo"]["hasNextPage"]:
-            cursor = first_page["data"]["orders"]["edges"][-1]["cursor"]
-            next_page = await ShopifyService().make_graphql_request(
-                query=query,
-                variables={"after": cursor},
-                api_type="admin",
+            await asyncio.to_thread(
+                rollups.save,
+                self.store_url,
+                {
+                    "watermark": shopify_timestamp(daily.watermark),
+                    "watermark_ids": sorted(daily.watermark_ids),
+                    "days": days,
+                },
             )
-            consume(next_page)
-            first_page = next_page
 
-        if total_orders == 0:
-            return 0.0
+        totals = collections.defaultdict(lambda: {"units": 0, "sales": Decimal("0")})
+        for products in days.values():
+            for gid, bucket in products.items():
+                totals[gid]["units"] += bucket["units"]
+                totals[gid]["sales"] += Decimal(bucket["sales"])
+        return {gid: {"unitsSold30d": v["units"], "grossSales30d": float(v["sales"])} for gid, v in totals.items()}
 
-        return float(total_revenue / total_orders)
+    async def calculate_aov(self) -> float:
+        """Calculate Average Order Value over the last 30 days."""
+        aov = AOVAggregator()
+        await self.scan_orders([aov])
+        return aov.result()
+
+    async def fetch_store_analytics(self, windows: tuple[int, ...] = ROLLUP_WINDOWS) -> dict[str, Any]:
+        """
+        Per-product sales, AOV and multi-window rollups from a single order scan.
+
+        Returns:
+            {"products": <fetch_30d_sales shape>, "aov": float, "windows": {"7d": {...}, ...}}
+        """
+        now = datetime.now(timezone.utc)
+        sales = ProductSalesAggregator(now=now)
+        aov = AOVAggregator(now=now)
+        rollups = WindowRollupAggregator(windows, now=now)
+        await self.scan_orders([sales, aov, rollups])
+        return {"products": sales.result(), "aov": aov.result(), "windows": rollups.result()}
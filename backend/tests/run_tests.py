@@ -43,6 +43,55 @@ except ImportError:
     API_TESTS_AVAILABLE = False
     print("Warning: API tests not available")
 
+try:
+    from tests.test_shopify import *
+    SHOPIFY_TESTS_AVAILABLE = True
+except ImportError:
+    SHOPIFY_TESTS_AVAILABLE = False
+    print("Warning: Shopify tests not available")
+
+try:
+    from tests.test_cache import *
+    CACHE_TESTS_AVAILABLE = True
+except ImportError:
+    CACHE_TESTS_AVAILABLE = False
+    print("Warning: Cache tests not available")
+
+try:
+    from tests.test_scheduler import *
+    SCHEDULER_TESTS_AVAILABLE = True
+except ImportError:
+    SCHEDULER_TESTS_AVAILABLE = False
+    print("Warning: Scheduler tests not available")
+
+try:
+    from tests.test_json_patch import *
+    JSON_PATCH_TESTS_AVAILABLE = True
+except ImportError:
+    JSON_PATCH_TESTS_AVAILABLE = False
+    print("Warning: JSON Patch tests not available")
+
+try:
+    from tests.test_config_scope import *
+    CONFIG_SCOPE_TESTS_AVAILABLE = True
+except ImportError:
+    CONFIG_SCOPE_TESTS_AVAILABLE = False
+    print("Warning: Configuration scope tests not available")
+
+try:
+    from tests.test_metrics import *
+    METRICS_TESTS_AVAILABLE = True
+except ImportError:
+    METRICS_TESTS_AVAILABLE = False
+    print("Warning: Metrics tests not available")
+
+try:
+    from tests.test_openai_stub import *
+    LOADTEST_TESTS_AVAILABLE = True
+except ImportError:
+    LOADTEST_TESTS_AVAILABLE = False
+    print("Warning: Load test tooling tests not available")
+
 
 class ColoredTextTestResult(unittest.TextTestResult):
     """Enhanced test result with colors and better formatting"""
@@ -88,7 +137,14 @@ class PopupGeniusTestRunner:
             'core_tools': 'Core Analysis Tools',
             'data_integrity': 'Data Integrity', 
             'agent_functionality': 'Agent Functionality',
-            'api_endpoints': 'API Endpoints'
+            'api_endpoints': 'API Endpoints',
+            'shopify_analytics': 'Shopify Analytics',
+            'caching': 'Caching',
+            'scheduling': 'Run Scheduling',
+            'json_patch': 'JSON Patch',
+            'config_scope': 'Modification Scoping',
+            'metrics': 'Metrics',
+            'load_testing': 'Load Test Tooling'
         }
     
     def run_category(self, category_name, test_classes):
@@ -168,7 +224,8 @@ class PopupGeniusTestRunner:
         if TOOLS_TESTS_AVAILABLE:
             result = self.run_category(
                 self.test_categories['core_tools'],
-                [TestPopupAnalysis, TestTransactionAnalysis, TestCompetitorAnalysis, TestToolsIntegration]
+                [TestPopupAnalysis, TestTransactionAnalysis, TestCompetitorAnalysis, TestToolsIntegration, TestToolRuntime,
+                 TestToolMemoization]
             )
             all_results.append(result)
         
@@ -184,7 +241,10 @@ class PopupGeniusTestRunner:
         if AGENT_TESTS_AVAILABLE:
             result = self.run_category(
                 self.test_categories['agent_functionality'],
-                [TestPopupOptimizationAgent, TestAgentStreamFactory, TestAgentMockIntegration]
+                [TestPopupOptimizationAgent, TestAgentStreamFactory, TestTextCoalescing, TestDisconnectCancellation,
+                 TestToolPrefetch, TestRunCacheIntegration, TestModificationAgent, TestSchemaDigest,
+                 TestModificationPatchOutput, TestModificationStreaming, TestModificationScoping,
+                 TestJsonArrayParser, TestAgentMockIntegration]
             )
             all_results.append(result)
         
@@ -195,6 +255,63 @@ class PopupGeniusTestRunner:
                 [TestPopupGeniusAPI, TestWebSocketEndpoint, TestAPIModels, TestAPIIntegration]
             )
             all_results.append(result)
+
+        # Shopify analytics tests (if available)
+        if SHOPIFY_TESTS_AVAILABLE:
+            result = self.run_category(
+                self.test_categories['shopify_analytics'],
+                [TestOrderScan, TestShopifyClientPool, TestBulkOperations, TestIncrementalSales, TestCostThrottling, TestShardedScan,
+                 TestLineItemPagination, TestBatchAggregation]
+            )
+            all_results.append(result)
+
+        # Cache tests (if available)
+        if CACHE_TESTS_AVAILABLE:
+            result = self.run_category(
+                self.test_categories['caching'],
+                [TestTTLCache, TestAnalyticsCache, TestRunCache]
+            )
+            all_results.append(result)
+
+        # Scheduler tests (if available)
+        if SCHEDULER_TESTS_AVAILABLE:
+            result = self.run_category(
+                self.test_categories['scheduling'],
+                [TestRunScheduler, TestClientAddress]
+            )
+            all_results.append(result)
+
+        # JSON Patch tests (if available)
+        if JSON_PATCH_TESTS_AVAILABLE:
+            result = self.run_category(
+                self.test_categories['json_patch'],
+                [TestJsonPatch]
+            )
+            all_results.append(result)
+
+        # Configuration scope tests (if available)
+        if CONFIG_SCOPE_TESTS_AVAILABLE:
+            result = self.run_category(
+                self.test_categories['config_scope'],
+                [TestConfigScope]
+            )
+            all_results.append(result)
+
+        # Metrics tests (if available)
+        if METRICS_TESTS_AVAILABLE:
+            result = self.run_category(
+                self.test_categories['metrics'],
+                [TestMetricsRegistry, TestMetricsMiddleware]
+            )
+            all_results.append(result)
+
+        # Load test tooling (if available)
+        if LOADTEST_TESTS_AVAILABLE:
+            result = self.run_category(
+                self.test_categories['load_testing'],
+                [TestOpenAIStub, TestBenchmarkReport]
+            )
+            all_results.append(result)
         
         # Print final summary
         success = self.print_summary(all_results)
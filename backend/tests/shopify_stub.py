@@ -0,0 +1,245 @@
+"""
+Local stand-in for the Shopify Admin GraphQL API and the bulk operation file host.
+
+Runs in-process behind httpx.ASGITransport, so ShopifyService can be exercised
+end to end without network access:
+
+    stub = ShopifyStub(orders)
+    service = ShopifyService(pool=ShopifyClientPool(transport=stub.transport()))
+"""
+
+import asyncio
+import collections
+import json
+import re
+import time
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+FILE_HOST = "https://storage.stand-in.local"
+
+SEARCH_TERM = re.compile(r"processed_at:(>=|<=|>|<)(\S+)")
+LINE_ITEMS_FIRST = re.compile(r"lineItems\(first:\s*(\d+)")
+ORDER_ALIAS = re.compile(r"(\w+):\s*order\(id:\s*\$(\w+)\)")
+
+
+def matches_search(order, search):
+    """Apply the processed_at filters of a Shopify search string"""
+    processed_at = order["processedAt"]
+    for op, value in SEARCH_TERM.findall(search or ""):
+        value = value.strip("'\"")
+        if op == ">=" and not processed_at >= value:
+            return False
+        if op == ">" and not processed_at > value:
+            return False
+        if op == "<=" and not processed_at <= value:
+            return False
+        if op == "<" and not processed_at < value:
+            return False
+    return True
+
+
+class ShopifyStub:
+    """
+    Serves orders from memory through paginated queries and bulk operations.
+
+    With order_cost set, orders pages are charged like Shopify's leaky bucket:
+    requested cost is 2 + first * order_cost, pages over max_cost fail with
+    MAX_COST_EXCEEDED and pages over the bucket fail with THROTTLED.
+    Bulk results write bulk_group orders before their line items, so children
+    need not follow their parent directly.
+    """
+
+    def __init__(self, orders, page_size=2, bulk_polls=1, order_cost=None, maximum_available=1000.0,
+                 restore_rate=50.0, max_cost=1000, throttle_first=0, latency=0.0, bulk_group=1):
+        self.orders = sorted(orders, key=lambda order: order["processedAt"])
+        self.page_size = page_size
+        self.bulk_polls = bulk_polls
+        self.bulk_group = bulk_group
+        self.order_cost = order_cost
+        self.maximum_available = maximum_available
+        self.restore_rate = restore_rate
+        self.max_cost = max_cost
+        self.throttle_first = throttle_first
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.available = maximum_available
+        self.updated_at = time.monotonic()
+        self.page_sizes = []
+        self.calls = collections.Counter()
+        self.bulk_operations = {}
+        self.app = FastAPI()
+        self.app.post("/admin/api/{version}/graphql.json")(self.graphql)
+        self.app.get("/bulk/{operation}.jsonl")(self.bulk_file)
+
+    def transport(self):
+        return httpx.ASGITransport(app=self.app)
+
+    def search_of(self, query):
+        match = re.search(r'query:\s*\\?"(.*?)\\?"', query)
+        return match.group(1) if match else ""
+
+    async def graphql(self, request: Request):
+        body = json.loads(await request.body())
+        query, variables = body["query"], body.get("variables") or {}
+
+        if "bulkOperationRunQuery" in query:
+            return self.run_bulk(variables["query"])
+        if "BulkOperation" in query:
+            return self.bulk_status(variables["id"])
+        if "ordersCount" in query:
+            self.calls["count"] += 1
+            count = sum(1 for order in self.orders if matches_search(order, self.search_of(query)))
+            return JSONResponse({"data": {"ordersCount": {"count": count}}})
+        if "order(id:" in query or "orders(" in query:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                # Simulated round trip to Shopify
+                await asyncio.sleep(self.latency)
+                if "order(id:" in query:
+                    return self.order_line_items(query, variables)
+                return self.orders_page(query, variables)
+            finally:
+                self.in_flight -= 1
+        return JSONResponse({"errors": [{"message": "unsupported query"}]})
+
+    def line_items_page(self, order, query, after=None):
+        """Slice an order's line items as the lineItems connection would"""
+        match = LINE_ITEMS_FIRST.search(query)
+        edges = order["lineItems"]["edges"]
+        start = int(after) + 1 if after is not None else 0
+        first = int(match.group(1)) if match else len(edges)
+        chunk = edges[start:start + first]
+        return {
+            "pageInfo": {
+                "hasNextPage": start + len(chunk) < len(edges),
+                "endCursor": str(start + len(chunk) - 1) if chunk else after,
+            },
+            "edges": [{"cursor": str(start + i), "node": edge["node"]} for i, edge in enumerate(chunk)],
+        }
+
+    def order_line_items(self, query, variables):
+        """Serve aliased order(id:) fields continuing each order's line items"""
+        self.calls["line_items_page"] += 1
+        by_id = {order["id"]: order for order in self.orders}
+        data = {}
+        for alias, id_var in ORDER_ALIAS.findall(query):
+            order = by_id[variables[id_var]]
+            after = variables.get(id_var.replace("id", "after", 1))
+            data[alias] = {"lineItems": self.line_items_page(order, query, after)}
+        return JSONResponse({"data": data})
+
+    def charge(self, requested, actual):
+        """Apply the leaky bucket; returns an error code or None"""
+        now = time.monotonic()
+        self.available = min(self.maximum_available, self.available + (now - self.updated_at) * self.restore_rate)
+        self.updated_at = now
+        if requested > self.max_cost:
+            return "MAX_COST_EXCEEDED"
+        if self.throttle_first > 0 or requested > self.available:
+            self.throttle_first = max(0, self.throttle_first - 1)
+            return "THROTTLED"
+        self.available -= actual
+        return None
+
+    def cost_extensions(self, requested, actual):
+        return {
+            "cost": {
+                "requestedQueryCost": requested,
+                "actualQueryCost": actual,
+                "throttleStatus": {
+                    "maximumAvailable": self.maximum_available,
+                    "currentlyAvailable": self.available,
+                    "restoreRate": self.restore_rate,
+                },
+            }
+        }
+
+    def orders_page(self, query, variables):
+        self.calls["orders_page"] += 1
+        matching = [order for order in self.orders if matches_search(order, self.search_of(query))]
+        start = int(variables["after"]) + 1 if variables.get("after") is not None else 0
+        first = int(variables.get("first") or self.page_size)
+        if self.order_cost is None:
+            # Without a cost model the stub decides the page size itself
+            first = self.page_size
+        chunk = matching[start:start + first]
+
+        extensions = {}
+        if self.order_cost is not None:
+            requested = 2 + first * self.order_cost
+            actual = 2 + len(chunk) * self.order_cost
+            error = self.charge(requested, actual)
+            extensions = self.cost_extensions(requested, None if error else actual)
+            if error == "MAX_COST_EXCEEDED":
+                self.calls["max_cost_exceeded"] += 1
+                return JSONResponse({"errors": [{
+                    "message": f"Query cost is {requested}, which exceeds the single query max cost limit",
+                    "extensions": {"code": error, "cost": requested, "maxCost": self.max_cost},
+                }]})
+            if error == "THROTTLED":
+                self.calls["throttled"] += 1
+                return JSONResponse({"errors": [{"message": "Throttled", "extensions": {"code": error}}],
+                                     "extensions": extensions})
+            self.page_sizes.append(first)
+
+        edges = [
+            {"cursor": str(start + i), "node": {**order, "lineItems": self.line_items_page(order, query)}}
+            for i, order in enumerate(chunk)
+        ]
+        return JSONResponse({
+            "data": {"orders": {"pageInfo": {"hasNextPage": start + len(chunk) < len(matching)}, "edges": edges}},
+            "extensions": extensions,
+        })
+
+    def run_bulk(self, bulk_query):
+        self.calls["bulk_run"] += 1
+        operation_id = f"gid://shopify/BulkOperation/{len(self.bulk_operations) + 1}"
+        self.bulk_operations[operation_id] = {"search": self.search_of(bulk_query), "polls": 0}
+        return JSONResponse({
+            "data": {
+                "bulkOperationRunQuery": {
+                    "bulkOperation": {"id": operation_id, "status": "CREATED"},
+                    "userErrors": [],
+                }
+            }
+        })
+
+    def bulk_status(self, operation_id):
+        self.calls["bulk_poll"] += 1
+        operation = self.bulk_operations[operation_id]
+        operation["polls"] += 1
+        done = operation["polls"] > self.bulk_polls
+        number = operation_id.rsplit("/", 1)[-1]
+        return JSONResponse({
+            "data": {
+                "node": {
+                    "id": operation_id,
+                    "status": "COMPLETED" if done else "RUNNING",
+                    "errorCode": None,
+                    "objectCount": "0",
+                    "url": f"{FILE_HOST}/bulk/{number}.jsonl" if done else None,
+                }
+            }
+        })
+
+    async def bulk_file(self, operation: str):
+        self.calls["bulk_download"] += 1
+        search = self.bulk_operations[f"gid://shopify/BulkOperation/{operation}"]["search"]
+
+        def lines():
+            matching = [order for order in self.orders if matches_search(order, search)]
+            for start in range(0, len(matching), self.bulk_group):
+                group = matching[start:start + self.bulk_group]
+                for order in group:
+                    parent = {k: v for k, v in order.items() if k != "lineItems"}
+                    yield json.dumps(parent) + "\n"
+                for order in group:
+                    for edge in order["lineItems"]["edges"]:
+                        yield json.dumps({**edge["node"], "__parentId": order["id"]}) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/jsonl")
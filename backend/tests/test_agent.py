@@ -5,20 +5,50 @@ Tests for PopupOptimizationAgent
 
 import unittest
 import asyncio
+import contextlib
+import copy
+import json
 import sys
 import os
+import time
+from types import SimpleNamespace
 from unittest.mock import patch, MagicMock
 
 # Add src to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
 try:
-    from src.agents.popup_optimization_agent import PopupOptimizationAgent, create_popup_agent_stream
+    from src.agents.popup_optimization_agent import (
+        PopupOptimizationAgent,
+        create_popup_agent_stream,
+        create_popup_agent_stream_structured,
+        get_popup_agent,
+    )
+    from agents import RunContextWrapper
+    from src.agents import popup_optimization_agent
+    from src.tools.runtime import TOOL_FUNCTIONS, clear_memo, tool_name
+    from src.streaming import JsonArrayParser, coalesce_text_chunks, until_disconnected
+    from src.metrics import RunMetrics, events_per_run
     AGENT_AVAILABLE = True
 except ImportError as e:
     AGENT_AVAILABLE = False
     print(f"Warning: PopupOptimizationAgent not available - skipping agent tests: {e}")
 
+try:
+    import httpx
+    from openai import AsyncOpenAI
+    from src.agents.modification_agent import (
+        amodify_popup_configuration,
+        astream_popup_modification,
+        load_ui_schema,
+    )
+    from src.metrics import modification_tokens
+    from loadtest.openai_stub import StubSettings, create_app
+    MODIFICATION_AVAILABLE = True
+except ImportError as e:
+    MODIFICATION_AVAILABLE = False
+    print(f"Warning: Modification agent not available - skipping modification tests: {e}")
+
 
 @unittest.skipUnless(AGENT_AVAILABLE, "PopupOptimizationAgent not available")
 class TestPopupOptimizationAgent(unittest.TestCase):
@@ -146,6 +176,23 @@ class TestAgentStreamFactory(unittest.TestCase):
             # API errors are expected in test environment
             self.assertIsInstance(e, Exception)
     
+    def test_agent_is_shared_between_runs(self):
+        """The factory reuses one agent instead of rebuilding it per request"""
+        if not AGENT_AVAILABLE:
+            self.skipTest("PopupOptimizationAgent not available")
+
+        shared = get_popup_agent()
+        self.assertIs(get_popup_agent(), shared)
+        async def fake_stream(user_input, *thresholds):
+            yield f"chunk for {user_input}"
+
+        async def first_chunk():
+            return await create_popup_agent_stream("test store").__anext__()
+
+        with patch.object(PopupOptimizationAgent, "__init__", side_effect=AssertionError("agent rebuilt")), \
+                patch.object(shared, "create_simple_stream", fake_stream):
+            self.assertEqual(asyncio.run(first_chunk()), "chunk for test store")
+
     def test_factory_function_integration(self):
         """Test factory function integration"""
         try:
@@ -156,6 +203,674 @@ class TestAgentStreamFactory(unittest.TestCase):
             pass
 
 
+@unittest.skipUnless(AGENT_AVAILABLE, "PopupOptimizationAgent not available")
+class TestTextCoalescing(unittest.TestCase):
+    """Test size and time based coalescing of streamed text chunks"""
+
+    def collect(self, script, max_bytes=512, max_delay=0.05):
+        """Run a script of (delay before event, event) pairs through the coalescer"""
+        async def source():
+            for delay, event in script:
+                await asyncio.sleep(delay)
+                yield event
+
+        async def run():
+            loop = asyncio.get_event_loop()
+            started = loop.time()
+            return [(event, loop.time() - started)
+                    async for event in coalesce_text_chunks(source(), max_bytes, max_delay)]
+
+        return asyncio.run(run())
+
+    def text(self, content):
+        return {"type": "text_chunk", "content": content}
+
+    def test_first_chunk_is_immediate(self):
+        """The first text chunk is not held back for the window"""
+        events = self.collect([(0, self.text("Hi")), (0.3, self.text(" there"))], max_delay=1.0)
+
+        self.assertEqual(events[0][0]["content"], "Hi")
+        self.assertLess(events[0][1], 0.1)
+        self.assertEqual(events[1][0]["content"], " there")
+
+    def test_size_flush(self):
+        """Buffered text is flushed as soon as it reaches max_bytes"""
+        script = [(0, self.text("a"))] + [(0, self.text("b" * 10)) for _ in range(5)]
+        events = self.collect(script, max_bytes=20, max_delay=10)
+
+        self.assertEqual([e["content"] for e, _ in events], ["a", "b" * 20, "b" * 20, "b" * 10])
+
+    def test_time_flush(self):
+        """Text older than max_delay is flushed while the source is still waiting"""
+        script = [(0, self.text("a")), (0, self.text("b")), (0, self.text("c")), (0.4, self.text("d"))]
+        events = self.collect(script, max_delay=0.05)
+
+        self.assertEqual([e["content"] for e, _ in events], ["a", "bc", "d"])
+        self.assertLess(events[1][1], 0.2)
+
+    def test_other_events_flush_in_order(self):
+        """Non-text events flush pending text first and keep their position"""
+        complete = {"type": "analysis_complete"}
+        script = [(0, self.text("a")), (0, self.text("b")), (0, complete), (0, self.text("c"))]
+        events = self.collect(script, max_delay=10)
+
+        self.assertEqual([e.get("content", e["type"]) for e, _ in events], ["a", "b", "analysis_complete", "c"])
+
+
+@unittest.skipUnless(AGENT_AVAILABLE, "PopupOptimizationAgent not available")
+class TestDisconnectCancellation(unittest.TestCase):
+    """Test that runs stop when nobody reads the stream any more"""
+
+    def setUp(self):
+        self.result = MagicMock()
+        self.result.is_complete = False
+
+        async def endless():
+            while True:
+                await asyncio.sleep(0.01)
+                event = MagicMock()
+                event.type = "raw_response_event"
+                event.data.delta = "word "
+                yield event
+
+        self.result.stream_events.return_value = endless()
+        runner = patch.object(popup_optimization_agent.Runner, "run_streamed", return_value=self.result)
+        runner.start()
+        self.addCleanup(runner.stop)
+        metrics = patch.object(popup_optimization_agent, "run_metrics", RunMetrics())
+        self.metrics = metrics.start()
+        self.addCleanup(metrics.stop)
+        clear_memo()
+
+    def test_closing_the_stream_cancels_the_run(self):
+        """Closing the event stream mid-run cancels the model run and records it"""
+        async def read_some():
+            stream = PopupOptimizationAgent().create_stream("garden store")
+            async for event in stream:
+                if event["type"] == "text_chunk":
+                    break
+            await stream.aclose()
+
+        asyncio.run(read_some())
+
+        self.result.cancel.assert_called_once()
+        self.assertEqual(self.metrics.counters["runs_cancelled"], 1)
+        self.assertEqual(self.metrics.counters["runs_completed"], 0)
+
+    def test_disconnect_stops_a_quiet_stream(self):
+        """A disconnect is noticed while waiting for the next event and cancels the run"""
+        disconnected = False
+
+        async def is_disconnected():
+            return disconnected
+
+        async def scenario():
+            nonlocal disconnected
+            events = create_popup_agent_stream_structured("garden store", max_delay=10)
+            received = []
+
+            async def consume():
+                async for event in until_disconnected(events, is_disconnected, interval=0.02):
+                    received.append(event)
+
+            consumer = asyncio.create_task(consume())
+            await asyncio.sleep(0.2)
+            disconnected = True
+            await asyncio.wait_for(consumer, 1)
+            # Let the cancelled pump task unwind
+            await asyncio.sleep(0.05)
+            return received
+
+        popup_optimization_agent.run_cache.clear()
+        received = asyncio.run(scenario())
+
+        self.assertIn("text_chunk", [event["type"] for event in received])
+        self.result.cancel.assert_called_once()
+        self.assertEqual(self.metrics.counters["runs_cancelled"], 1)
+
+    def test_saved_tokens_are_estimated(self):
+        """Tokens saved are the average completed output minus what was already streamed"""
+        self.metrics.run_completed(400)
+        self.metrics.run_cancelled(100)
+
+        self.assertEqual(self.metrics.snapshot()["tokens_saved"], 300)
+
+
+@unittest.skipUnless(AGENT_AVAILABLE, "PopupOptimizationAgent not available")
+class TestToolPrefetch(unittest.TestCase):
+    """Test concurrent tool prefetch ahead of the model run"""
+
+    def setUp(self):
+        self.agent = PopupOptimizationAgent()
+        self.runs = []
+        clear_memo()
+        self.addCleanup(clear_memo)
+
+        def run_streamed(agent, input, context=None):
+            self.runs.append((agent, input, context))
+
+            async def no_events():
+                return
+                yield
+
+            result = MagicMock()
+            result.stream_events.return_value = no_events()
+            return result
+
+        self.runner = patch.object(popup_optimization_agent.Runner, "run_streamed", side_effect=run_streamed)
+        self.runner.start()
+        self.addCleanup(self.runner.stop)
+
+        # The stand-in tools below only exist in this process; keep CPU-bound tools off the process pool
+        workers = patch("src.tools.runtime.settings.TOOL_PROCESS_WORKERS", 0)
+        workers.start()
+        self.addCleanup(workers.stop)
+
+    def collect(self, user_input="baseball equipment store"):
+        async def run():
+            return [event async for event in self.agent.create_stream(user_input)]
+
+        return asyncio.run(run())
+
+    def slow_tool(self, delay, output):
+        def analyze(business_description=""):
+            time.sleep(delay)
+            return output
+
+        return analyze
+
+    def test_tools_run_concurrently(self):
+        """Three slow tools finish in roughly the time of one, in completion order"""
+        tools = {
+            "analyze_popup_history": self.slow_tool(0.3, "popup"),
+            "analyze_transaction_data": self.slow_tool(0.1, "transactions"),
+            "analyze_competitors": self.slow_tool(0.2, "competitors"),
+        }
+        with patch.dict(TOOL_FUNCTIONS, tools):
+            started = time.perf_counter()
+            events = self.collect()
+            elapsed = time.perf_counter() - started
+
+        self.assertLess(elapsed, 0.55)
+        self.assertEqual([e["type"] for e in events[:4]], ["analysis_start"] + ["tool_start"] * 3)
+        completed = [e["tool_name"] for e in events if e["type"] == "tool_complete"]
+        self.assertEqual(completed, ["analyze_transaction_data", "analyze_competitors", "analyze_popup_history"])
+
+    def enabled_tools(self, agent, context):
+        return [tool_name(t) for t in asyncio.run(agent.get_all_tools(RunContextWrapper(context)))]
+
+    def test_results_are_injected_and_tools_dropped(self):
+        """The model gets the prefetched results and no tools to call again"""
+        events = self.collect()
+
+        agent, agent_input, context = self.runs[0]
+        self.assertEqual(self.enabled_tools(agent, context), [])
+        self.assertIn("baseball equipment store", agent_input)
+        for event in events:
+            if event["type"] == "tool_complete":
+                self.assertFalse(event["error"])
+                self.assertIn(event["tool_output"], agent_input)
+        # Every run uses the shared agent, which keeps its tools for other runs
+        self.assertIs(agent, self.agent.agent)
+        self.assertEqual(len(self.enabled_tools(agent, None)), 3)
+
+    def test_failed_tool_stays_available(self):
+        """A tool that fails to prefetch is left for the model to call"""
+        def broken(business_description=""):
+            raise RuntimeError("data unavailable")
+
+        with patch.dict(TOOL_FUNCTIONS, {"analyze_competitors": broken}):
+            events = self.collect()
+
+        failed = [e for e in events if e["type"] == "tool_complete" and e["error"]]
+        self.assertEqual([e["tool_name"] for e in failed], ["analyze_competitors"])
+        agent, agent_input, context = self.runs[0]
+        self.assertEqual(self.enabled_tools(agent, context), ["analyze_competitors"])
+        self.assertNotIn("### analyze_competitors", agent_input)
+
+
+@unittest.skipUnless(AGENT_AVAILABLE, "PopupOptimizationAgent not available")
+class TestRunCacheIntegration(unittest.TestCase):
+    """Test replaying cached runs from the structured stream factory"""
+
+    def setUp(self):
+        self.runs = []
+
+        def run_streamed(agent, input, context=None):
+            self.runs.append(input)
+
+            async def events():
+                event = MagicMock()
+                event.type = "raw_response_event"
+                event.data.delta = "Use a bold red CTA."
+                yield event
+
+            result = MagicMock()
+            result.stream_events.return_value = events()
+            return result
+
+        runner = patch.object(popup_optimization_agent.Runner, "run_streamed", side_effect=run_streamed)
+        runner.start()
+        self.addCleanup(runner.stop)
+        popup_optimization_agent.run_cache.clear()
+        self.addCleanup(popup_optimization_agent.run_cache.clear)
+
+    def collect(self, user_input):
+        async def run():
+            return [event async for event in create_popup_agent_stream_structured(user_input)]
+
+        return asyncio.run(run())
+
+    def test_repeat_request_is_replayed(self):
+        """A near-duplicate request replays the recorded events without a model run"""
+        first = self.collect("Sporting goods store selling premium baseball bats")
+        second = self.collect("sporting goods store selling premium baseball bats!!")
+
+        self.assertEqual(len(self.runs), 1)
+        self.assertTrue(second[0]["cached"])
+        self.assertEqual([e["type"] for e in second], [e["type"] for e in first])
+        self.assertIn("Use a bold red CTA.", [e.get("content") for e in second])
+
+    def test_replayed_runs_are_counted(self):
+        """Cache hits show up in the run counters and metrics with their own label"""
+        hits = events_per_run.key({"outcome": "completed", "cache": "hit"})
+        runs, events = (sum(series[0]), series[1]) if (series := events_per_run.series.get(hits)) else (0, 0.0)
+
+        with patch.object(popup_optimization_agent, "run_metrics", RunMetrics()) as metrics:
+            self.collect("Sporting goods store selling premium baseball bats")
+            replayed = self.collect("sporting goods store selling premium baseball bats!!")
+
+        self.assertEqual(metrics.counters["runs_completed"], 2)
+        self.assertEqual(metrics.snapshot()["runs_cached"], 1)
+        self.assertEqual(sum(events_per_run.series[hits][0]), runs + 1)
+        self.assertEqual(events_per_run.series[hits][1], events + len(replayed))
+
+    def test_changed_tool_data_is_not_replayed(self):
+        """Editing a tool data file invalidates runs computed from it"""
+        with patch.object(popup_optimization_agent, "tool_data_version", return_value=("data", 1)):
+            self.collect("Sporting goods store selling premium baseball bats")
+        with patch.object(popup_optimization_agent, "tool_data_version", return_value=("data", 2)):
+            second = self.collect("Sporting goods store selling premium baseball bats")
+
+        self.assertEqual(len(self.runs), 2)
+        self.assertNotIn("cached", second[0])
+
+    def test_failed_runs_are_not_cached(self):
+        """Runs with a failed tool are not recorded"""
+        def broken(business_description=""):
+            raise RuntimeError("data unavailable")
+
+        with patch.dict(TOOL_FUNCTIONS, {"analyze_competitors": broken}):
+            clear_memo()
+            self.collect("Garden supply shop with seasonal promotions")
+        self.collect("Garden supply shop with seasonal promotions")
+
+        self.assertEqual(len(self.runs), 2)
+
+
+@unittest.skipUnless(MODIFICATION_AVAILABLE, "Modification agent not available")
+class TestModificationAgent(unittest.TestCase):
+    """Test the async modification pipeline against the OpenAI stand-in"""
+
+    CONFIG = {"components": [{"id": "heading", "type": "text", "content": "Welcome"}]}
+
+    async def modify(self, settings, requests=1):
+        http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app(settings)), base_url="http://stub")
+        client = AsyncOpenAI(api_key="stub", base_url="http://stub/v1", http_client=http_client, max_retries=0)
+        async with http_client:
+            return await asyncio.gather(*(
+                amodify_popup_configuration("Make the heading red", self.CONFIG, "", client=client)
+                for _ in range(requests)
+            ))
+
+    def test_returns_modified_configuration(self):
+        """The stand-in echoes the configuration back, which arrives parsed"""
+        [config] = asyncio.run(self.modify(StubSettings(TTFT_MS=0)))
+
+        self.assertEqual(config, self.CONFIG)
+
+    def test_concurrent_calls_do_not_block_each_other(self):
+        """Concurrent modifications overlap instead of running one after another"""
+        started = time.perf_counter()
+        configs = asyncio.run(self.modify(StubSettings(TTFT_MS=200), requests=5))
+
+        self.assertEqual(len(configs), 5)
+        self.assertLess(time.perf_counter() - started, 0.8)
+
+    def test_errors_return_current_configuration(self):
+        [config] = asyncio.run(self.modify(StubSettings(TTFT_MS=0, ERROR_RATE=1.0)))
+
+        self.assertEqual(config, self.CONFIG)
+
+
+class FakeResponses:
+    """
+    Answers each responses.create call with the next scripted output text;
+    streamed requests get it in small text deltas
+    """
+
+    USAGE = SimpleNamespace(input_tokens=1500, input_tokens_details=SimpleNamespace(cached_tokens=1024), output_tokens=40)
+
+    def __init__(self, texts, error=None):
+        self.texts = list(texts)
+        self.error = error
+        self.prompts = []
+        self.requests = []
+        self.deltas_sent = 0
+
+    async def create(self, model, input, **options):
+        self.prompts.append(input)
+        self.requests.append(options)
+        if self.error:
+            raise self.error
+        text = self.texts.pop(0)
+        if options.get("stream"):
+            return self.stream(text)
+        content = SimpleNamespace(text=text)
+        return SimpleNamespace(output=[SimpleNamespace(content=[content])], usage=self.USAGE)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, text):
+        async def events():
+            for start in range(0, len(text), 8):
+                self.deltas_sent += 1
+                yield SimpleNamespace(type="response.output_text.delta", delta=text[start:start + 8])
+            yield SimpleNamespace(type="response.completed", response=SimpleNamespace(usage=self.USAGE))
+
+        yield events()
+
+
+@unittest.skipUnless(MODIFICATION_AVAILABLE, "Modification agent not available")
+class TestSchemaDigest(unittest.TestCase):
+    """Test the schema digest that replaces the ui.py source in modification prompts"""
+
+    def test_lists_fields_enums_and_breakpoints(self):
+        digest = load_ui_schema()
+
+        self.assertIn("  sections: dict[str, Section]", digest)
+        self.assertIn('  type: "split" | "stacked" = "split"', digest)
+        self.assertIn("  input_type: str | null = null  # email, name, phone, quiz", digest)
+        self.assertIn("max-sm (@media (width < 40rem))", digest)
+        self.assertIn("ComponentType: text | image | button", digest)
+
+    def test_smaller_than_source_and_built_once(self):
+        with open(os.path.join(os.path.dirname(__file__), "..", "src", "ui.py"), encoding="utf-8") as f:
+            source = f.read()
+
+        digest = load_ui_schema()
+
+        self.assertLess(len(digest), len(source) * 0.6)
+        self.assertNotIn("def get_split_config", digest)
+        self.assertNotIn("import", digest)
+        self.assertIs(load_ui_schema(), digest)
+
+
+@unittest.skipUnless(MODIFICATION_AVAILABLE, "Modification agent not available")
+class TestModificationPatchOutput(unittest.TestCase):
+    """Test that JSON Patch output is applied and validated locally"""
+
+    CONFIG = {
+        "layout": {"type": "stacked"},
+        "sections": {
+            "main": {
+                "id": "main",
+                "name": "Main",
+                "components": [{"id": "heading", "type": "text", "properties": {"content": "Welcome"}}],
+            }
+        },
+    }
+
+    def modify(self, *texts, instructions="Change the heading"):
+        self.responses = FakeResponses(texts)
+        client = SimpleNamespace(responses=self.responses)
+        return asyncio.run(amodify_popup_configuration(
+            instructions, self.CONFIG, load_ui_schema(), client=client, output="patch"
+        ))
+
+    def test_patch_is_applied(self):
+        config = self.modify(json.dumps([
+            {"op": "replace", "path": "/sections/main/components/0/properties/content", "value": "Special Offer!"}
+        ]))
+
+        self.assertEqual(config["sections"]["main"]["components"][0]["properties"]["content"], "Special Offer!")
+        self.assertEqual(config["layout"], self.CONFIG["layout"])
+        self.assertEqual(self.CONFIG["sections"]["main"]["components"][0]["properties"]["content"], "Welcome")
+        self.assertEqual(len(self.responses.prompts), 1)
+        self.assertIn("JSON Patch", self.responses.prompts[0])
+
+    def test_static_prompt_prefix_and_token_usage(self):
+        """The schema and guidelines go first and are identical across requests; usage is recorded"""
+        counted = modification_tokens.series.get(("patch", "cached_input"), [[0], 0])[1]
+
+        self.modify("[]", instructions="Make it red")
+        first = self.responses.requests[0]
+        self.modify("[]", instructions="Make it blue")
+        second = self.responses.requests[0]
+
+        self.assertEqual(first["instructions"], second["instructions"])
+        self.assertEqual(first["prompt_cache_key"], second["prompt_cache_key"])
+        self.assertIn("ComponentType: text | image", first["instructions"])
+        self.assertIn("Make it blue", self.responses.prompts[0])
+        self.assertNotIn("Make it", first["instructions"])
+        self.assertEqual(modification_tokens.series[("patch", "cached_input")][1], counted + 2048)
+
+    def test_patch_breaking_the_schema_falls_back_to_full_output(self):
+        full = copy.deepcopy(self.CONFIG)
+        full["sections"]["main"]["components"][0]["properties"]["content"] = "Hello"
+
+        config = self.modify(
+            json.dumps([{"op": "replace", "path": "/sections/main/components/0/type", "value": "carousel"}]),
+            json.dumps(full),
+        )
+
+        self.assertEqual(config, full)
+        self.assertEqual(len(self.responses.prompts), 2)
+
+    def test_patch_with_bad_pointer_falls_back_to_full_output(self):
+        config = self.modify(
+            json.dumps([{"op": "remove", "path": "/sections/missing"}]),
+            json.dumps(self.CONFIG),
+        )
+
+        self.assertEqual(config, self.CONFIG)
+        self.assertEqual(len(self.responses.prompts), 2)
+
+
+@unittest.skipUnless(MODIFICATION_AVAILABLE, "Modification agent not available")
+class TestModificationStreaming(unittest.TestCase):
+    """Test that streamed patch operations reach the client as soon as they are parsed"""
+
+    CONFIG = TestModificationPatchOutput.CONFIG
+    OPERATIONS = [
+        {"op": "replace", "path": "/sections/main/components/0/properties/content", "value": "Special Offer!"},
+        {"op": "add", "path": "/sections/main/components/-", "value": {"id": "cta", "type": "button"}},
+        {"op": "add", "path": "/sections/main/components/1/properties", "value": {"content": "Shop now"}},
+    ]
+
+    def collect(self, *texts, error=None):
+        self.responses = FakeResponses(texts, error)
+        client = SimpleNamespace(responses=self.responses)
+
+        async def run():
+            events = []
+            async for event in astream_popup_modification("Add a CTA", self.CONFIG, load_ui_schema(), client=client):
+                events.append({**event, "deltas_sent": self.responses.deltas_sent})
+            return events
+
+        with patch("src.agents.modification_agent.settings.MODIFICATION_OUTPUT", "patch"):
+            return asyncio.run(run())
+
+    def test_operations_stream_before_generation_ends(self):
+        events = self.collect(json.dumps(self.OPERATIONS))
+
+        updates = [e for e in events if e["type"] == "config_update"]
+        complete = events[-1]
+        self.assertEqual(events[0]["type"], "modification_start")
+        self.assertEqual([u["operation"] for u in updates], self.OPERATIONS)
+        self.assertLess(updates[0]["deltas_sent"], complete["deltas_sent"] / 2)
+        self.assertEqual(updates[0]["config"]["sections"]["main"]["components"][0]["properties"]["content"],
+                         "Special Offer!")
+        self.assertEqual(len(updates[0]["config"]["sections"]["main"]["components"]), 1)
+        self.assertEqual(complete["type"], "modification_complete")
+        self.assertEqual(complete["config"], updates[-1]["config"])
+        self.assertEqual((complete["operations"], complete["fallback"]), (3, False))
+
+    def test_invalid_intermediate_states_are_held_back(self):
+        """An operation leaving the config invalid is only sent with the one that fixes it"""
+        operations = [
+            {"op": "add", "path": "/sections/main/components/-", "value": {"id": "cta"}},
+            {"op": "add", "path": "/sections/main/components/1/type", "value": "button"},
+        ]
+
+        events = self.collect(json.dumps(operations))
+
+        updates = [e for e in events if e["type"] == "config_update"]
+        self.assertEqual([u["operation"] for u in updates], operations[1:])
+        self.assertEqual(events[-1]["operations"], 2)
+
+    def test_unusable_patch_falls_back_to_full_configuration(self):
+        full = copy.deepcopy(self.CONFIG)
+        full["sections"]["main"]["name"] = "Hero"
+
+        events = self.collect(json.dumps([self.OPERATIONS[0], {"op": "remove", "path": "/missing"}]), json.dumps(full))
+
+        complete = events[-1]
+        self.assertEqual(len([e for e in events if e["type"] == "config_update"]), 1)
+        self.assertEqual(complete["config"], full)
+        self.assertTrue(complete["fallback"])
+        self.assertEqual(len(self.responses.prompts), 2)
+
+    def test_api_error_returns_current_configuration(self):
+        events = self.collect(error=RuntimeError("connection reset"))
+
+        self.assertEqual([e["type"] for e in events], ["modification_start", "error", "modification_complete"])
+        self.assertEqual(events[-1]["config"], self.CONFIG)
+
+
+@unittest.skipUnless(MODIFICATION_AVAILABLE, "Modification agent not available")
+class TestModificationScoping(unittest.TestCase):
+    """Test that only the parts an instruction is about are sent and merged back"""
+
+    CONFIG = {
+        "layout": {"type": "split", "slot_mapping": {"image": "left", "form": "right"}},
+        "sections": {
+            "image": {"id": "image", "name": "Image", "components": [
+                {"id": "hero", "type": "image", "properties": {"src": "https://example.com/hero.png"}},
+            ]},
+            "form": {"id": "form", "name": "Form", "components": [
+                {"id": "heading", "type": "text", "properties": {"content": "Welcome"}},
+                {"id": "email_input", "type": "input", "properties": {"placeholder": "Your email"}},
+                {"id": "submit_button", "type": "button", "properties": {"content": "Subscribe"}},
+            ]},
+        },
+    }
+
+    def modify(self, *texts, output="patch"):
+        self.responses = FakeResponses(texts)
+        client = SimpleNamespace(responses=self.responses)
+        return asyncio.run(amodify_popup_configuration(
+            "Change the heading to 'Special Offer!'", self.CONFIG, load_ui_schema(), client=client, output=output
+        ))
+
+    def test_only_the_scope_is_sent_and_merged_back(self):
+        config = self.modify(json.dumps([
+            {"op": "replace", "path": "/sections/form/components/0/properties/content", "value": "Special Offer!"},
+            {"op": "add", "path": "/sections/form/components/-",
+             "value": {"id": "subheading", "type": "text", "properties": {"content": "Today only"}}},
+        ]))
+
+        prompt = self.responses.prompts[0]
+        configuration = json.loads(prompt.split("Current Configuration:")[1].split("Return the")[0])
+        self.assertEqual(configuration, {"sections": {"form": {**self.CONFIG["sections"]["form"],
+                                                               "components": [self.CONFIG["sections"]["form"]["components"][0]]}}})
+        self.assertIn("  * heading: text \"Welcome\"", prompt)
+        self.assertIn("  submit_button: button \"Subscribe\"", prompt)
+        self.assertEqual([c["id"] for c in config["sections"]["form"]["components"]],
+                         ["heading", "subheading", "email_input", "submit_button"])
+        self.assertEqual(config["sections"]["form"]["components"][0]["properties"]["content"], "Special Offer!")
+        self.assertEqual(config["sections"]["image"], self.CONFIG["sections"]["image"])
+        self.assertEqual(config["layout"], self.CONFIG["layout"])
+
+    def test_full_output_is_merged_back(self):
+        scoped = {"sections": {"form": {**self.CONFIG["sections"]["form"], "components": [
+            {"id": "heading", "type": "text", "properties": {"content": "Special Offer!"}},
+        ]}}}
+
+        config = self.modify(json.dumps(scoped), output="full")
+
+        self.assertEqual(len(config["sections"]["form"]["components"]), 3)
+        self.assertEqual(config["sections"]["form"]["components"][0]["properties"]["content"], "Special Offer!")
+
+    def test_edits_outside_the_scope_retry_with_the_whole_configuration(self):
+        out_of_scope = {"op": "remove", "path": "/sections/image"}
+        whole = copy.deepcopy(self.CONFIG)
+        del whole["sections"]["image"]
+        removing_button = {"sections": {"form": {**self.CONFIG["sections"]["form"], "components": [
+            self.CONFIG["sections"]["form"]["components"][0], self.CONFIG["sections"]["form"]["components"][2],
+        ]}}}
+
+        config = self.modify(json.dumps([out_of_scope]), json.dumps(removing_button), json.dumps([out_of_scope]))
+
+        self.assertEqual(config, whole)
+        self.assertEqual(len(self.responses.prompts), 3)
+        self.assertNotIn("Popup outline", self.responses.prompts[2])
+
+    def test_scoping_can_be_disabled(self):
+        with patch("src.agents.modification_agent.settings.MODIFICATION_SCOPING", False):
+            self.modify("[]")
+
+        self.assertIn('"image":', self.responses.prompts[0])
+        self.assertNotIn("Popup outline", self.responses.prompts[0])
+
+    def test_streamed_updates_carry_the_whole_configuration(self):
+        self.responses = FakeResponses([json.dumps([
+            {"op": "replace", "path": "/sections/form/components/0/properties/content", "value": "Special Offer!"},
+        ])])
+        client = SimpleNamespace(responses=self.responses)
+
+        async def run():
+            return [event async for event in astream_popup_modification(
+                "Change the heading", self.CONFIG, load_ui_schema(), client=client
+            )]
+
+        with patch("src.agents.modification_agent.settings.MODIFICATION_OUTPUT", "patch"):
+            events = asyncio.run(run())
+
+        update, complete = events[1], events[-1]
+        self.assertEqual(update["type"], "config_update")
+        self.assertEqual(update["config"]["sections"]["image"], self.CONFIG["sections"]["image"])
+        self.assertEqual(len(update["config"]["sections"]["form"]["components"]), 3)
+        self.assertEqual(complete["config"], update["config"])
+        self.assertIn("Popup outline", self.responses.prompts[0])
+
+
+@unittest.skipUnless(AGENT_AVAILABLE, "PopupOptimizationAgent not available")
+class TestJsonArrayParser(unittest.TestCase):
+    """Test incremental parsing of a streamed JSON array"""
+
+    def test_elements_complete_as_soon_as_they_close(self):
+        parser = JsonArrayParser()
+
+        self.assertEqual(parser.feed('```json\n[{"op": "add", "value": {"a": '), [])
+        self.assertEqual(parser.feed('[1]}}, {"op"'), [{"op": "add", "value": {"a": [1]}}])
+        self.assertEqual(parser.feed(': "remove"}]\n```'), [{"op": "remove"}])
+        self.assertTrue(parser.done)
+
+    def test_brackets_and_quotes_inside_strings(self):
+        text = '["a]b", {"s": "}{\\"x"}, 3, true]'
+        parser = JsonArrayParser()
+
+        elements = [element for char in text for element in parser.feed(char)]
+
+        self.assertEqual(elements, ["a]b", {"s": '}{"x'}, 3, True])
+
+    def test_empty_array(self):
+        parser = JsonArrayParser()
+
+        self.assertEqual(parser.feed("[ ]"), [])
+        self.assertTrue(parser.done)
+
+
 class TestAgentMockIntegration(unittest.TestCase):
     """Test agent with mocked dependencies"""
     
@@ -40,6 +40,49 @@ class TestPopupGeniusAPI(unittest.TestCase):
         self.assertEqual(data["status"], "healthy")
         self.assertEqual(data["service"], "PopupGenius API")
     
+    @patch('main.amodify_popup_configuration', new_callable=AsyncMock)
+    def test_implement_popup_changes_endpoint(self, mock_modify):
+        """The modification is awaited on the event loop, not run with the blocking client"""
+        mock_modify.return_value = {"components": []}
+
+        response = self.client.post("/implement-popup-changes", json={
+            "insights": "Make the heading red",
+            "current_config": {"components": [{"id": "heading"}]}
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"components": []})
+        mock_modify.assert_awaited_once()
+
+    @patch('main.astream_popup_modification')
+    def test_implement_popup_changes_stream_endpoint(self, mock_stream):
+        """Each modification event is sent as its own data: line"""
+        async def events(**kwargs):
+            yield {"type": "config_update", "config": {"components": [{"id": "heading"}]}}
+            yield {"type": "modification_complete", "config": {"components": []}}
+        mock_stream.side_effect = events
+
+        response = self.client.post("/implement-popup-changes/stream", json={
+            "insights": "Make the heading red",
+            "current_config": {"components": [{"id": "heading"}]}
+        })
+
+        lines = [line for line in response.text.split("\n") if line.startswith("data: ")]
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([json.loads(line[6:])["type"] for line in lines], ["config_update", "modification_complete"])
+
+    def test_metrics_endpoint(self):
+        """Metrics are served in the Prometheus text format, including earlier requests"""
+        self.client.get("/health")
+
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain; version=0.0.4"))
+        self.assertIn('popupgenius_http_request_duration_seconds_count{method="GET",endpoint="/health",status="200"}',
+                      response.text)
+        self.assertIn("popupgenius_run_queue_depth 0", response.text)
+
     def test_app_title(self):
         """Test app configuration"""
         self.assertEqual(app.title, "PopupGenius: AI-Powered E-Commerce Optimization API")
@@ -68,6 +111,18 @@ class TestPopupGeniusAPI(unittest.TestCase):
         content = response.text
         self.assertIn("data:", content)
     
+    def test_popup_optimization_rejected_when_queue_full(self):
+        """A full run queue answers with a 429 and Retry-After before any streaming"""
+        from src.scheduler import RunScheduler
+
+        with patch('main.run_scheduler', RunScheduler(max_concurrent=0, max_queue=0, expected_run_seconds=20)):
+            response = self.client.post("/popup-optimization-structured", json={
+                "business_description": "Baseball equipment store"
+            })
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["retry-after"], "20")
+
     def test_popup_optimization_endpoint_minimal(self):
         """Test popup optimization with minimal data"""
         response = self.client.post("/popup-optimization", json={
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Tests for the TTL, analytics and agent run caches
+"""
+
+import unittest
+import asyncio
+import sys
+import os
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.cache import AnalyticsCache, TTLCache
+from src.run_cache import RunCache, guard_tokens, jaccard, shingles
+from src.utils import ShopifyClientPool, ShopifyService
+from tests.shopify_stub import ShopifyStub
+from tests.test_shopify import SAMPLE_ORDERS
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache(unittest.TestCase):
+    """Test LRU eviction and expiry"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TTLCache(maxsize=2, ttl=10, stale_ttl=5, clock=self.clock)
+
+    def test_fresh_stale_and_expired(self):
+        """Entries are fresh, then stale, then gone"""
+        self.cache.set("a", 1)
+        self.assertEqual(self.cache.lookup("a"), (1, True))
+
+        self.clock.now = 12
+        self.assertEqual(self.cache.lookup("a"), (1, False))
+        self.assertIsNone(self.cache.get("a"))
+
+        self.clock.now = 15
+        self.assertIsNone(self.cache.lookup("a"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_least_recently_used_is_evicted(self):
+        """Reading an entry protects it from eviction"""
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+
+        self.assertIn("a", self.cache)
+        self.assertNotIn("b", self.cache)
+        self.assertIn("c", self.cache)
+
+
+class TestAnalyticsCache(unittest.TestCase):
+    """Test stale-while-revalidate and single-flight loads around ShopifyService"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = AnalyticsCache(ttl=60, stale_ttl=600, clock=self.clock)
+        self.stub = ShopifyStub(SAMPLE_ORDERS, latency=0.05)
+        self.service = ShopifyService(pool=ShopifyClientPool(transport=self.stub.transport()))
+        self.service.access_token = "token"
+        self.service.scan_mode = "paginated"
+
+    def run_async(self, coro):
+        async def run():
+            try:
+                return await coro
+            finally:
+                await self.service.pool.aclose()
+
+        return asyncio.run(run())
+
+    def test_concurrent_misses_share_one_scan(self):
+        """A burst of callers on a cold key triggers a single scan"""
+        async def burst():
+            return await asyncio.gather(*(self.cache.fetch_30d_sales(self.service) for _ in range(20)))
+
+        results = self.run_async(burst())
+
+        self.assertEqual(self.cache.stats["loads"], 1)
+        self.assertEqual(self.stub.calls["orders_page"], 2)
+        self.assertTrue(all(result == results[0] for result in results))
+
+    def test_fresh_hits_skip_the_scan(self):
+        """Within the TTL the cached value is served without calling Shopify"""
+        async def twice():
+            first = await self.cache.calculate_aov(self.service)
+            self.clock.now = 30
+            return first, await self.cache.calculate_aov(self.service)
+
+        first, second = self.run_async(twice())
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.cache.stats["loads"], 1)
+        self.assertEqual(self.cache.stats["hits"], 1)
+
+    def test_stale_value_served_while_refreshing(self):
+        """An expired key returns immediately and refreshes in the background"""
+        async def scenario():
+            first = await self.cache.fetch_store_analytics(self.service)
+            pages = self.stub.calls["orders_page"]
+            self.clock.now = 120
+            stale = await self.cache.fetch_store_analytics(self.service)
+            # Returned before the background refresh touched Shopify
+            self.assertEqual(self.stub.calls["orders_page"], pages)
+            await asyncio.gather(*self.cache.in_flight.values())
+            return first, stale
+
+        first, stale = self.run_async(scenario())
+
+        self.assertIs(stale, first)
+        self.assertEqual(self.cache.stats["stale_hits"], 1)
+        self.assertEqual(self.cache.stats["loads"], 2)
+        self.assertEqual(self.cache.entries.lookup((self.service.store_url, "analytics", (7, 30, 90)))[1], True)
+
+    def test_keys_separate_windows(self):
+        """Different lookback windows are cached independently"""
+        async def scenario():
+            await self.cache.fetch_store_analytics(self.service, (7, 30))
+            await self.cache.fetch_store_analytics(self.service, (30, 7))
+            await self.cache.fetch_store_analytics(self.service, (90,))
+
+        self.run_async(scenario())
+
+        self.assertEqual(self.cache.stats["loads"], 2)
+        self.assertEqual(self.cache.stats["hits"], 1)
+
+
+class TestRunCache(unittest.TestCase):
+    """Test near-duplicate lookup and paced replay of recorded runs"""
+
+    BASE = "I run a baseball equipment store called ProVelocity selling $495 training bats"
+
+    def setUp(self):
+        self.cache = RunCache(similarity=0.85, near_duplicates=True)
+        self.events = [(0.0, {"type": "analysis_start", "timestamp": 1.0}), (0.2, {"type": "text_chunk", "content": "Hi"})]
+        self.cache.store(self.BASE, self.events)
+
+    def test_exact_and_normalized_inputs_hit(self):
+        """Case, punctuation and spacing differences count as the same input"""
+        hit = self.cache.lookup("i run a Baseball equipment store, called ProVelocity  selling $495 training bats!")
+
+        self.assertEqual(hit["similarity"], 1.0)
+        self.assertEqual(self.cache.stats["exact_hits"], 1)
+
+    def test_near_duplicate_hits(self):
+        """A small edit is matched through the MinHash index"""
+        edited = "I run a baseball equipment store called Pro Velocity selling $495 training bats"
+        self.assertGreater(jaccard(shingles(edited), shingles(self.BASE)), 0.85)
+
+        hit = self.cache.lookup(edited)
+
+        self.assertIsNotNone(hit)
+        self.assertEqual(hit["input"], self.BASE)
+        self.assertEqual(self.cache.stats["near_hits"], 1)
+
+    def test_different_inputs_miss(self):
+        """Substantively different businesses are not replayed"""
+        self.assertIsNone(self.cache.lookup("I run a baseball equipment store called ProVelocity selling $400 gloves and helmets"))
+        self.assertIsNone(self.cache.lookup("Small fashion boutique struggling with cart abandonment"))
+
+    def test_different_numbers_and_negations_miss(self):
+        """Near duplicates that change a number or add a negation mean something else"""
+        cache = RunCache(similarity=0.85, near_duplicates=True)
+        base = "Show the 10% off discount banner to visitors of my baseball equipment store"
+        cache.store(base, self.events)
+
+        for variant in (base.replace("10%", "15%"), base.replace("Show", "Do not show")):
+            with self.subTest(variant=variant):
+                self.assertGreater(jaccard(shingles(variant), shingles(base)), 0.85)
+                self.assertNotEqual(guard_tokens(variant), guard_tokens(base))
+                self.assertIsNone(cache.lookup(variant))
+        self.assertIsNotNone(cache.lookup(base.replace("visitors", "the visitors")))
+
+    def test_near_duplicates_are_opt_in(self):
+        """By default only the same normalized input is replayed"""
+        cache = RunCache(similarity=0.85)
+        cache.store(self.BASE, self.events)
+
+        self.assertIsNone(cache.lookup("I run a baseball equipment store called Pro Velocity selling $495 training bats"))
+        self.assertIsNotNone(cache.lookup(self.BASE.upper()))
+
+    def test_changed_data_invalidates_entries(self):
+        """An entry recorded under other tool data is dropped instead of replayed"""
+        self.cache.store(self.BASE, self.events, version=("data.json", 1))
+
+        self.assertIsNotNone(self.cache.lookup(self.BASE, version=("data.json", 1)))
+        self.assertIsNone(self.cache.lookup(self.BASE, version=("data.json", 2)))
+        self.assertIsNone(self.cache.lookup(self.BASE, version=("data.json", 1)))
+        self.assertEqual(self.cache.stats["stale"], 1)
+
+    def test_replay_refreshes_timestamps_and_paces(self):
+        """Replayed events are marked, re-timestamped and spaced by the recorded gaps"""
+        async def replay():
+            started = asyncio.get_event_loop().time()
+            events = [event async for event in self.cache.replay(self.cache.lookup(self.BASE), speed=2.0)]
+            return events, asyncio.get_event_loop().time() - started
+
+        events, elapsed = asyncio.run(replay())
+
+        self.assertTrue(events[0]["cached"])
+        self.assertNotEqual(events[0]["timestamp"], 1.0)
+        self.assertEqual(events[1]["content"], "Hi")
+        self.assertGreaterEqual(elapsed, 0.09)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Tests for scoping popup configurations to the parts an instruction is about
+"""
+
+import unittest
+import copy
+import sys
+import os
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.config_scope import scope_configuration
+
+
+def component(component_id, component_type, content=None):
+    properties = {"content": content} if content else {}
+    return {"id": component_id, "type": component_type, "properties": properties}
+
+
+CONFIG = {
+    "layout": {"type": "split", "slot_mapping": {"image_section": "left", "form_section": "right"}},
+    "sections": {
+        "image_section": {
+            "id": "image_section",
+            "name": "Image",
+            "components": [component("hero", "image")],
+        },
+        "form_section": {
+            "id": "form_section",
+            "name": "Form",
+            "styles": {"default": {"padding": "20px"}},
+            "components": [
+                component("heading-1", "text", "You've got"),
+                component("heading-2", "text", "Free Shipping"),
+                component("email_input", "input"),
+                component("submit_button", "button", "Get Free Shipping"),
+            ],
+        },
+    },
+}
+
+
+class TestConfigScope(unittest.TestCase):
+    """Test which parts are picked, the outline and merging the edits back"""
+
+    def test_components_are_picked_by_id_type_and_text(self):
+        cases = {
+            "Make the headings bigger": [0, 1],
+            "Make the CTA green": [3],
+            "Replace 'free shipping' with '20% off'": [1, 3],
+            "Shorten the email field placeholder": [2],
+        }
+        for instructions, indices in cases.items():
+            with self.subTest(instructions=instructions):
+                scope = scope_configuration(instructions, CONFIG)
+
+                self.assertEqual(scope.components, {"form_section": indices})
+                self.assertFalse(scope.layout)
+                self.assertEqual(list(scope.config), ["sections"])
+
+    def test_sections_and_layout(self):
+        scope = scope_configuration("Use a darker overlay and a bigger image section", CONFIG)
+
+        self.assertEqual(scope.components, {"image_section": None})
+        self.assertTrue(scope.layout)
+        self.assertEqual(scope.config["layout"], CONFIG["layout"])
+
+    def test_unscoped_instructions(self):
+        for instructions in ("Redesign the whole popup", "Add a countdown", "Make every text and image and input and button pop with a new overlay"):
+            with self.subTest(instructions=instructions):
+                self.assertIsNone(scope_configuration(instructions, CONFIG))
+        self.assertIsNone(scope_configuration("Make the heading red", {"components": []}))
+
+    def test_outline_marks_the_scope(self):
+        outline = scope_configuration("Make the CTA green", CONFIG).summary()
+
+        self.assertIn("layout: split", outline)
+        self.assertIn('section image_section "Image" (vertical):', outline)
+        self.assertIn("  hero: image", outline)
+        self.assertIn('  * submit_button: button "Get Free Shipping"', outline)
+        self.assertIn("  heading-1: text", outline)
+
+    def test_merge_keeps_positions_of_components_out_of_scope(self):
+        scope = scope_configuration("Make the headings bigger", CONFIG)
+        edited = copy.deepcopy(scope.config)
+        components = edited["sections"]["form_section"]["components"]
+        components[1]["properties"]["content"] = "Free Delivery"
+        components.insert(0, component("badge", "text", "New"))
+        del components[1]
+        edited["sections"]["form_section"]["styles"] = {"default": {"padding": "30px"}}
+
+        merged = scope.merge(edited)
+
+        section = merged["sections"]["form_section"]
+        self.assertEqual([c["id"] for c in section["components"]], ["badge", "heading-2", "email_input", "submit_button"])
+        self.assertEqual(section["components"][1]["properties"]["content"], "Free Delivery")
+        self.assertEqual(section["styles"], {"default": {"padding": "30px"}})
+        self.assertEqual(merged["sections"]["image_section"], CONFIG["sections"]["image_section"])
+        self.assertEqual(merged["layout"], CONFIG["layout"])
+        self.assertEqual(CONFIG["sections"]["form_section"]["components"][1]["properties"]["content"], "Free Shipping")
+
+    def test_new_components_follow_their_predecessor(self):
+        scope = scope_configuration("Make the headings bigger", CONFIG)
+        edited = copy.deepcopy(scope.config)
+        edited["sections"]["form_section"]["components"].insert(1, component("divider", "divider"))
+        edited["sections"]["form_section"]["components"].append(component("subtitle", "text", "Today only"))
+
+        merged = scope.merge(edited)
+
+        self.assertEqual([c["id"] for c in merged["sections"]["form_section"]["components"]],
+                         ["heading-1", "divider", "heading-2", "subtitle", "email_input", "submit_button"])
+
+    def test_edits_outside_the_scope_are_rejected(self):
+        scope = scope_configuration("Make the CTA green", CONFIG)
+        invalid = [
+            {},
+            {"sections": {"form_section": {"id": "form_section", "name": "Form"}}},
+            {"sections": {"form_section": {"components": [component("heading-1", "text", "Hi")]}}},
+            {"sections": {"form_section": {"components": [{"type": "text"}]}}},
+            {"sections": {"image_section": {"components": []}}},
+        ]
+        for edited in invalid:
+            with self.subTest(edited=edited), self.assertRaises(ValueError):
+                scope.merge(edited)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
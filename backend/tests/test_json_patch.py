@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Tests for RFC 6902 JSON Patch application
+"""
+
+import unittest
+import sys
+import os
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.json_patch import JsonPatchError, apply_patch, parse_pointer
+
+
+class TestJsonPatch(unittest.TestCase):
+    """Test the operations and error cases from RFC 6902 appendix A"""
+
+    def test_add_object_member_and_array_element(self):
+        document = {"foo": ["bar", "baz"]}
+
+        patched = apply_patch(document, [
+            {"op": "add", "path": "/baz", "value": "qux"},
+            {"op": "add", "path": "/foo/1", "value": "qux"},
+            {"op": "add", "path": "/foo/-", "value": "end"},
+        ])
+
+        self.assertEqual(patched, {"foo": ["bar", "qux", "baz", "end"], "baz": "qux"})
+        self.assertEqual(document, {"foo": ["bar", "baz"]})
+
+    def test_remove_and_replace(self):
+        patched = apply_patch({"baz": "qux", "foo": ["bar", "qux", "baz"]}, [
+            {"op": "remove", "path": "/foo/1"},
+            {"op": "replace", "path": "/baz", "value": "boo"},
+        ])
+
+        self.assertEqual(patched, {"baz": "boo", "foo": ["bar", "baz"]})
+
+    def test_move_and_copy(self):
+        document = {"foo": {"bar": "baz", "waldo": "fred"}, "qux": {"corge": "grault"}, "list": [1, 2, 3]}
+
+        patched = apply_patch(document, [
+            {"op": "move", "from": "/foo/waldo", "path": "/qux/thud"},
+            {"op": "move", "from": "/list/0", "path": "/list/2"},
+            {"op": "copy", "from": "/foo", "path": "/copied"},
+        ])
+
+        self.assertEqual(patched["qux"], {"corge": "grault", "thud": "fred"})
+        self.assertEqual(patched["list"], [2, 3, 1])
+        self.assertEqual(patched["copied"], {"bar": "baz"})
+        self.assertIsNot(patched["copied"], patched["foo"])
+
+    def test_escaped_pointer_tokens(self):
+        self.assertEqual(parse_pointer("/a~1b/m~0n"), ["a/b", "m~n"])
+        self.assertEqual(apply_patch({"a/b": 1}, [{"op": "replace", "path": "/a~1b", "value": 2}]), {"a/b": 2})
+
+    def test_failed_test_operation_rejects_patch(self):
+        with self.assertRaises(JsonPatchError):
+            apply_patch({"baz": "qux"}, [
+                {"op": "replace", "path": "/baz", "value": "boo"},
+                {"op": "test", "path": "/baz", "value": "qux"},
+            ])
+
+    def test_invalid_operations(self):
+        invalid = [
+            {"op": "remove", "path": "/missing"},
+            {"op": "replace", "path": "/missing", "value": 1},
+            {"op": "add", "path": "/foo/5", "value": 1},
+            {"op": "add", "path": "/foo/01", "value": 1},
+            {"op": "add", "path": "/missing/child", "value": 1},
+            {"op": "add", "path": "/foo/0"},
+            {"op": "move", "from": "/obj", "path": "/obj/child"},
+            {"op": "rename", "path": "/foo"},
+            {"op": "add", "path": "foo", "value": 1},
+        ]
+        for operation in invalid:
+            with self.subTest(operation=operation), self.assertRaises(JsonPatchError):
+                apply_patch({"foo": ["bar"], "obj": {}}, [operation])
+
+        with self.assertRaises(JsonPatchError):
+            apply_patch({}, {"op": "add", "path": "/a", "value": 1})
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Tests for the metrics registry and the request metrics middleware
+"""
+
+import unittest
+import asyncio
+import sys
+import os
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.metrics import Metric, MetricsMiddleware, Registry, active_streams, active_websockets, request_duration
+
+try:
+    from fastapi import FastAPI, WebSocket
+    from fastapi.responses import StreamingResponse
+    from fastapi.testclient import TestClient
+    FASTAPI_AVAILABLE = True
+except ImportError:
+    FASTAPI_AVAILABLE = False
+    print("Warning: FastAPI not available - skipping metrics middleware tests")
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    """Test the Prometheus text format of counters, gauges and histograms"""
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_and_gauge(self):
+        runs = self.registry.counter("runs_total", "Runs", ("outcome",))
+        open_sockets = self.registry.gauge("open_sockets", "Sockets", ("endpoint",))
+        depth = self.registry.gauge("queue_depth", "Waiting", function=lambda: 3)
+
+        runs.inc(outcome="completed")
+        runs.inc(2, outcome="completed")
+        with open_sockets.track(endpoint="/ws"):
+            open_sockets.inc(endpoint="/ws")
+        text = self.registry.render()
+
+        self.assertIn("# TYPE runs_total counter", text)
+        self.assertIn('runs_total{outcome="completed"} 3', text)
+        self.assertIn('open_sockets{endpoint="/ws"} 1', text)
+        self.assertIn("queue_depth 3", text)
+        self.assertTrue(text.endswith("\n"))
+
+    def test_metrics_must_render_samples(self):
+        """Metric types without samples() cannot be created"""
+        class Incomplete(Metric):
+            kind = "untyped"
+
+        with self.assertRaises(TypeError):
+            Incomplete("incomplete", "No samples")
+
+    def test_histogram_buckets_are_cumulative(self):
+        latency = self.registry.histogram("latency_seconds", "Latency", ("tool",), buckets=(0.1, 1.0))
+
+        for value in (0.05, 0.5, 0.5, 5.0):
+            latency.observe(value, tool="competitors")
+        text = self.registry.render()
+
+        self.assertIn('latency_seconds_bucket{tool="competitors",le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{tool="competitors",le="1"} 3', text)
+        self.assertIn('latency_seconds_bucket{tool="competitors",le="+Inf"} 4', text)
+        self.assertIn('latency_seconds_sum{tool="competitors"} 6.05', text)
+        self.assertIn('latency_seconds_count{tool="competitors"} 4', text)
+
+    def test_time_records_labels_set_in_block(self):
+        """Labels only known at the end (status, outcome) can be set inside the timed block"""
+        latency = self.registry.histogram("call_seconds", "Calls", ("status",))
+
+        with self.assertRaises(RuntimeError):
+            with latency.time(status="error"):
+                raise RuntimeError("boom")
+        with latency.time(status="error") as labels:
+            labels["status"] = 200
+        text = self.registry.render()
+
+        self.assertIn('call_seconds_count{status="error"} 1', text)
+        self.assertIn('call_seconds_count{status="200"} 1', text)
+
+    def test_label_values_are_escaped(self):
+        errors = self.registry.counter("errors_total", "Errors", ("message",))
+
+        errors.inc(message='bad "quote"\\')
+
+        self.assertIn('errors_total{message="bad \\"quote\\"\\\\"} 1', self.registry.render())
+
+
+@unittest.skipUnless(FASTAPI_AVAILABLE, "FastAPI not available")
+class TestMetricsMiddleware(unittest.TestCase):
+    """Test request timing by route template and stream/WebSocket gauges"""
+
+    def setUp(self):
+        app = FastAPI()
+        app.add_middleware(MetricsMiddleware)
+        self.stream_gauge_during = self.websocket_gauge_during = None
+
+        @app.get("/items/{item_id}")
+        async def item(item_id: int):
+            return {"id": item_id}
+
+        @app.get("/stream")
+        async def stream():
+            async def chunks():
+                yield "a"
+                await asyncio.sleep(0)
+                self.stream_gauge_during = active_streams.values[("/stream",)]
+                yield "b"
+            return StreamingResponse(chunks(), media_type="text/plain")
+
+        @app.websocket("/ws")
+        async def ws(websocket: WebSocket):
+            await websocket.accept()
+            self.websocket_gauge_during = active_websockets.values[("/ws",)]
+            await websocket.send_text(await websocket.receive_text())
+            await websocket.close()
+
+        self.client = TestClient(app)
+
+    def count(self, **labels):
+        series = request_duration.series.get(request_duration.key(labels))
+        return sum(series[0]) if series else 0
+
+    def test_requests_are_labelled_by_route_template(self):
+        before = self.count(method="GET", endpoint="/items/{item_id}", status=200)
+
+        self.client.get("/items/1")
+        self.client.get("/items/2")
+
+        self.assertEqual(self.count(method="GET", endpoint="/items/{item_id}", status=200), before + 2)
+
+    def test_streams_are_tracked_while_open(self):
+        response = self.client.get("/stream")
+
+        self.assertEqual(response.text, "ab")
+        self.assertGreaterEqual(self.stream_gauge_during, 1)
+        self.assertEqual(active_streams.values[("/stream",)], 0)
+
+    def test_websockets_are_tracked(self):
+        with self.client.websocket_connect("/ws") as websocket:
+            websocket.send_text("ping")
+            self.assertEqual(websocket.receive_text(), "ping")
+
+        self.assertEqual(self.websocket_gauge_during, 1)
+        self.assertEqual(active_websockets.values[("/ws",)], 0)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Tests for the load test tooling: the OpenAI Responses API stand-in and the
+benchmark report
+"""
+
+import unittest
+import asyncio
+import json
+import sys
+import os
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+try:
+    import httpx
+    from openai import AsyncOpenAI, InternalServerError
+    from loadtest.openai_stub import StubSettings, create_app
+    from loadtest.bench_streaming import compare, percentile
+    STUB_AVAILABLE = True
+except ImportError as e:
+    STUB_AVAILABLE = False
+    print(f"Warning: OpenAI stub not available - skipping stub tests: {e}")
+
+
+@unittest.skipUnless(STUB_AVAILABLE, "OpenAI stub not available")
+class TestOpenAIStub(unittest.TestCase):
+    """Test that the stand-in speaks the Responses API the OpenAI client expects"""
+
+    TOOL = {
+        "type": "function",
+        "name": "analyze_competitors",
+        "parameters": {"type": "object", "properties": {"business_description": {"type": "string"}}},
+    }
+
+    def call(self, settings, request):
+        async def run():
+            app = create_app(settings)
+            http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://stub")
+            client = AsyncOpenAI(api_key="stub", base_url="http://stub/v1", http_client=http_client, max_retries=0)
+            async with http_client:
+                return await request(client)
+
+        return asyncio.run(run())
+
+    def test_streamed_text_and_usage(self):
+        """Streamed requests emit text deltas and a completed response with usage"""
+        async def request(client):
+            stream = await client.responses.create(model="gpt-4.1", input="Baseball store", stream=True)
+            return [event async for event in stream]
+
+        events = self.call(StubSettings(TOKENS_PER_SECOND=0, TTFT_MS=0), request)
+
+        deltas = [e.delta for e in events if e.type == "response.output_text.delta"]
+        completed = events[-1].response
+        self.assertEqual(events[0].type, "response.created")
+        self.assertEqual(events[-1].type, "response.completed")
+        self.assertEqual("".join(deltas), completed.output[0].content[0].text)
+        self.assertEqual(completed.usage.output_tokens, len(deltas))
+
+    def test_tool_calls_then_text(self):
+        """The first turn calls the offered tools; the turn with their outputs gets text"""
+        async def request(client):
+            first = await client.responses.create(model="gpt-4.1", input="Baseball store", tools=[self.TOOL])
+            call = first.output[0]
+            follow_up = await client.responses.create(model="gpt-4.1", tools=[self.TOOL], input=[
+                {"role": "user", "content": "Baseball store"},
+                {"type": "function_call", "call_id": call.call_id, "name": call.name, "arguments": call.arguments},
+                {"type": "function_call_output", "call_id": call.call_id, "output": "3 competitors"},
+            ])
+            return call, follow_up
+
+        call, follow_up = self.call(StubSettings(TTFT_MS=0), request)
+
+        self.assertEqual(call.type, "function_call")
+        self.assertEqual(json.loads(call.arguments), {"business_description": "Baseball store"})
+        self.assertEqual(follow_up.output[0].type, "message")
+
+    def test_modification_prompt_echoes_configuration(self):
+        """Non-streamed modification prompts get the current configuration back as JSON"""
+        config = {"components": [{"id": "heading", "type": "text"}]}
+        prompt = f"Current Configuration:\n{json.dumps(config, indent=2)}\n\nReturn the modified configuration as JSON."
+
+        async def request(client):
+            return await client.responses.create(model="gpt-4.1", input=prompt)
+
+        response = self.call(StubSettings(TTFT_MS=0), request)
+
+        self.assertEqual(json.loads(response.output_text), config)
+
+    def test_error_rate(self):
+        """Injected failures surface as API errors"""
+        async def request(client):
+            return await client.responses.create(model="gpt-4.1", input="Baseball store")
+
+        with self.assertRaises(InternalServerError):
+            self.call(StubSettings(TTFT_MS=0, ERROR_RATE=1.0), request)
+
+
+@unittest.skipUnless(STUB_AVAILABLE, "Load test tooling not available")
+class TestBenchmarkReport(unittest.TestCase):
+    """Test percentiles and regression detection of benchmark results"""
+
+    def result(self, **overrides):
+        endpoint = {
+            "ttfe_p50_ms": 40.0, "ttfe_p95_ms": 90.0, "e2e_p50_ms": 800.0, "e2e_p95_ms": 1000.0, "e2e_p99_ms": 1100.0,
+            "events_per_second": 250.0, "requests_per_second": 12.0, "errors": 0,
+        }
+        return {"endpoints": {"popup-optimization-structured": {**endpoint, **overrides}}}
+
+    def test_nearest_rank_percentiles(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([], 95), 0.0)
+
+    def test_regressions_beyond_tolerance(self):
+        """Slower latencies, lower throughput and new errors are flagged"""
+        current = self.result(e2e_p95_ms=1300.0, events_per_second=150.0, errors=2)
+
+        regressions = compare(self.result(), current, tolerance=0.15)
+
+        self.assertEqual(len(regressions), 3)
+        self.assertTrue(any("e2e_p95_ms" in r for r in regressions))
+
+    def test_noise_within_tolerance(self):
+        current = self.result(e2e_p95_ms=1100.0, events_per_second=230.0)
+
+        self.assertEqual(compare(self.result(), current, tolerance=0.15), [])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Tests for agent run admission control
+"""
+
+import unittest
+import asyncio
+import sys
+import os
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.scheduler import QueueFull, RunScheduler, client_address, scheduled
+
+
+class TestRunScheduler(unittest.TestCase):
+    """Test global and per-client limits and the bounded wait queue"""
+
+    def setUp(self):
+        self.scheduler = RunScheduler(max_concurrent=2, max_per_client=1, max_queue=2, expected_run_seconds=10)
+
+    def test_global_limit_queues_in_order(self):
+        """Runs beyond the global limit wait and are granted first come, first served"""
+        running = [self.scheduler.enqueue("a"), self.scheduler.enqueue("b")]
+        first, second = self.scheduler.enqueue("c"), self.scheduler.enqueue("d")
+
+        self.assertTrue(all(ticket.granted for ticket in running))
+        self.assertEqual((first.position, second.position), (1, 2))
+
+        running[0].release()
+        self.assertTrue(first.granted)
+        self.assertEqual(second.position, 1)
+
+    def test_per_client_limit_skips_busy_client(self):
+        """A client at its own limit waits while other clients go ahead"""
+        self.scheduler.enqueue("a")
+        busy = self.scheduler.enqueue("a")
+        other = self.scheduler.enqueue("b")
+
+        self.assertFalse(busy.granted)
+        self.assertTrue(other.granted)
+        self.assertEqual(busy.position, 1)
+
+    def test_full_queue_rejects_with_retry_after(self):
+        """Once the queue is full new runs fail fast with a Retry-After estimate"""
+        for client in "abcd":
+            self.scheduler.enqueue(client)
+
+        with self.assertRaises(QueueFull) as raised:
+            self.scheduler.enqueue("e")
+
+        # Three turns of two slots at ten seconds a run
+        self.assertEqual(raised.exception.retry_after, 15)
+        self.assertEqual(len(self.scheduler.waiting), 2)
+        self.assertEqual(self.scheduler.stats["rejected"], 1)
+
+    def test_release_is_idempotent(self):
+        """Releasing twice frees the slot once"""
+        ticket = self.scheduler.enqueue("a")
+        ticket.release()
+        ticket.release()
+
+        self.assertEqual(self.scheduler.running, 0)
+        self.assertNotIn("a", self.scheduler.per_client)
+
+    def test_queued_events_then_run(self):
+        """A waiting stream reports its position, runs once admitted and frees its slot"""
+        async def events():
+            yield {"type": "text_chunk", "content": "done"}
+
+        async def scenario():
+            blockers = [self.scheduler.enqueue("a"), self.scheduler.enqueue("b")]
+            ticket = self.scheduler.enqueue("c")
+            collected = []
+
+            async def consume():
+                async for event in scheduled(ticket, events()):
+                    collected.append(event)
+
+            consumer = asyncio.create_task(consume())
+            await asyncio.sleep(0.01)
+            blockers[0].release()
+            await consumer
+            return collected
+
+        collected = asyncio.run(scenario())
+
+        self.assertEqual(collected[0]["type"], "queued")
+        self.assertEqual(collected[0]["position"], 1)
+        self.assertEqual(collected[-1]["content"], "done")
+        self.assertEqual(self.scheduler.running, 1)
+
+    def test_abandoned_wait_leaves_queue(self):
+        """A client that goes away while queued gives up its place"""
+        async def scenario():
+            self.scheduler.enqueue("a")
+            self.scheduler.enqueue("b")
+            ticket = self.scheduler.enqueue("c")
+            stream = scheduled(ticket, iter(()))
+            await stream.__anext__()
+            await stream.aclose()
+
+        asyncio.run(scenario())
+
+        self.assertEqual(self.scheduler.waiting, [])
+
+
+class TestClientAddress(unittest.TestCase):
+    """Test which address per-client limits are keyed on"""
+
+    PROXIES = ["10.0.0.0/8", "192.168.1.5"]
+
+    def test_peer_address_without_trusted_proxies(self):
+        self.assertEqual(client_address("203.0.113.7", None, []), "203.0.113.7")
+        # Anyone can send X-Forwarded-For; it only counts from a trusted proxy
+        self.assertEqual(client_address("203.0.113.7", "198.51.100.1", self.PROXIES), "203.0.113.7")
+
+    def test_forwarded_address_behind_trusted_proxies(self):
+        self.assertEqual(client_address("10.1.2.3", "198.51.100.1", self.PROXIES), "198.51.100.1")
+        # Entries added by trusted proxies are skipped, spoofed ones before the client are ignored
+        self.assertEqual(
+            client_address("10.1.2.3", "1.1.1.1, 198.51.100.1, 192.168.1.5", self.PROXIES), "198.51.100.1"
+        )
+        self.assertEqual(client_address("192.168.1.5", "", self.PROXIES), "192.168.1.5")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,675 @@
+#!/usr/bin/env python3
+"""
+Tests for ShopifyService order scanning and aggregation
+"""
+
+import unittest
+import asyncio
+import json
+import sys
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, patch
+
+import httpx
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.config import settings
+from src.metrics import shopify_bulk_orphans
+from src.utils import (
+    LOOKBACK_DAYS,
+    ORDER_SCAN_QUERY,
+    AOVAggregator,
+    CostThrottle,
+    DailySalesAggregator,
+    OrderAggregator,
+    OrderBatch,
+    ProductSalesAggregator,
+    SalesRollupStore,
+    ShopifyClientPool,
+    ShopifyService,
+    WindowRollupAggregator,
+    parse_minor_units,
+    parse_minor_units_array,
+    shopify_timestamp,
+)
+from tests.shopify_stub import ShopifyStub
+
+
+NOW = datetime.now(timezone.utc)
+ORDER_IDS = iter(range(1, 1_000_000))
+
+
+def make_order(days_ago, total, line_items):
+    """Build an order node in the shape returned by the orders connection"""
+    return {
+        "id": f"gid://shopify/Order/{next(ORDER_IDS)}",
+        "processedAt": shopify_timestamp(NOW - timedelta(days=days_ago)),
+        "totalPriceSet": {"shopMoney": {"amount": total}},
+        "lineItems": {
+            "edges": [
+                {
+                    "node": {
+                        "quantity": quantity,
+                        "originalTotalSet": {"shopMoney": {"amount": amount}},
+                        "product": {"id": gid} if gid else None,
+                    }
+                }
+                for gid, quantity, amount in line_items
+            ]
+        },
+    }
+
+
+def make_pages(orders, page_size=2):
+    """Split orders into GraphQL response pages"""
+    pages = []
+    for start in range(0, len(orders), page_size):
+        chunk = orders[start:start + page_size]
+        pages.append({
+            "data": {
+                "orders": {
+                    "pageInfo": {"hasNextPage": start + page_size < len(orders)},
+                    "edges": [{"cursor": f"c{start + i}", "node": node} for i, node in enumerate(chunk)],
+                }
+            }
+        })
+    return pages
+
+
+SAMPLE_ORDERS = [
+    make_order(1, "100.00", [("gid://shopify/Product/1", 2, "80.00"), ("gid://shopify/Product/2", 1, "20.00")]),
+    make_order(5, "50.10", [("gid://shopify/Product/1", 1, "50.10")]),
+    make_order(20, "19.90", [("gid://shopify/Product/2", 1, "19.90"), (None, 1, "0.00")]),
+    make_order(60, "300.00", [("gid://shopify/Product/3", 3, "300.00")]),
+]
+
+
+class TestOrderScan(unittest.TestCase):
+    """Test the shared order scan and its aggregators"""
+
+    def setUp(self):
+        self.service = ShopifyService()
+        self.service.scan_mode = "paginated"
+        self.pages = make_pages(SAMPLE_ORDERS)
+
+    def test_fetch_30d_sales_ignores_older_orders(self):
+        """Per-product totals only include orders in the 30 day window"""
+        with patch.object(self.service, "make_graphql_request", AsyncMock(side_effect=self.pages)):
+            sales = asyncio.run(self.service.fetch_30d_sales())
+
+        self.assertEqual(sales["gid://shopify/Product/1"], {"unitsSold30d": 3, "grossSales30d": 130.10})
+        self.assertEqual(sales["gid://shopify/Product/2"], {"unitsSold30d": 2, "grossSales30d": 39.90})
+        self.assertNotIn("gid://shopify/Product/3", sales)
+
+    def test_aggregators_must_implement_the_interface(self):
+        """Aggregators missing part of the interface cannot be created"""
+        class Partial(OrderAggregator):
+            def reset(self):
+                pass
+
+            def consume(self, order):
+                pass
+
+        with self.assertRaises(TypeError):
+            Partial()
+
+    def test_calculate_aov(self):
+        """AOV is computed over orders in the window"""
+        with patch.object(self.service, "make_graphql_request", AsyncMock(side_effect=self.pages)):
+            aov = asyncio.run(self.service.calculate_aov())
+
+        self.assertAlmostEqual(aov, (100.00 + 50.10 + 19.90) / 3)
+
+    def test_store_analytics_single_pass(self):
+        """Sales, AOV and rollups come out of one walk of the orders connection"""
+        mock_request = AsyncMock(side_effect=self.pages)
+        with patch.object(self.service, "make_graphql_request", mock_request):
+            analytics = asyncio.run(self.service.fetch_store_analytics())
+
+        self.assertEqual(mock_request.await_count, len(self.pages))
+        self.assertEqual(analytics["products"]["gid://shopify/Product/1"]["unitsSold30d"], 3)
+        self.assertAlmostEqual(analytics["aov"], (100.00 + 50.10 + 19.90) / 3)
+
+        windows = analytics["windows"]
+        self.assertEqual(windows["7d"]["orders"], 2)
+        self.assertEqual(windows["30d"]["orders"], 3)
+        self.assertEqual(windows["90d"]["orders"], 4)
+        self.assertEqual(windows["90d"]["units"], 9)
+        self.assertAlmostEqual(windows["90d"]["revenue"], 470.00)
+
+    def test_empty_store(self):
+        """A store without orders yields empty aggregates"""
+        empty = {"data": {"orders": {"pageInfo": {"hasNextPage": False}, "edges": []}}}
+        with patch.object(self.service, "make_graphql_request", AsyncMock(return_value=empty)):
+            analytics = asyncio.run(self.service.fetch_store_analytics())
+
+        self.assertEqual(analytics["products"], {})
+        self.assertEqual(analytics["aov"], 0.0)
+        self.assertEqual(analytics["windows"]["30d"]["orders"], 0)
+
+
+class TestShopifyClientPool(unittest.TestCase):
+    """Test the shared Shopify HTTP client pool"""
+
+    def test_scan_reuses_one_client(self):
+        """Every page of a scan goes through the same pooled client"""
+        pages = iter(make_pages(SAMPLE_ORDERS, page_size=1))
+
+        def handler(request):
+            self.assertEqual(request.headers["X-Shopify-Access-Token"], "token")
+            return httpx.Response(200, json=next(pages))
+
+        pool = ShopifyClientPool(transport=httpx.MockTransport(handler))
+        service = ShopifyService(pool=pool)
+        service.access_token = "token"
+        service.scan_mode = "paginated"
+
+        async def run():
+            analytics = await service.fetch_store_analytics()
+            stats = pool.stats()
+            await pool.aclose()
+            return analytics, stats
+
+        analytics, stats = asyncio.run(run())
+
+        self.assertEqual(analytics["windows"]["90d"]["orders"], 4)
+        store_stats = stats[service.store_url]
+        self.assertEqual(store_stats["requests"], len(SAMPLE_ORDERS))
+        self.assertEqual(store_stats["clients_created"], 1)
+        self.assertEqual(store_stats["in_flight"], 0)
+
+    def test_per_store_limits(self):
+        """Stores can get their own connection limits"""
+        pool = ShopifyClientPool(max_connections=10)
+        pool.set_store_limits("big-store.myshopify.com", max_connections=2, max_keepalive_connections=1)
+
+        async def run():
+            pool.get_client("big-store.myshopify.com")
+            pool.get_client("small-store.myshopify.com")
+            stats = pool.stats()
+            await pool.aclose()
+            return stats
+
+        stats = asyncio.run(run())
+        self.assertEqual(stats["big-store.myshopify.com"]["max_connections"], 2)
+        self.assertEqual(stats["small-store.myshopify.com"]["max_connections"], 10)
+
+    def test_graphql_errors_raise(self):
+        """GraphQL errors surface as HTTPException"""
+        from fastapi import HTTPException
+
+        def handler(request):
+            return httpx.Response(200, content=json.dumps({"errors": [{"message": "boom"}]}))
+
+        pool = ShopifyClientPool(transport=httpx.MockTransport(handler))
+        service = ShopifyService(pool=pool)
+        service.access_token = "token"
+        with self.assertRaises(HTTPException):
+            asyncio.run(service.make_graphql_request("{ shop { name } }"))
+
+
+class TestBulkOperations(unittest.TestCase):
+    """Test bulk operation scans against the local Shopify stand-in"""
+
+    def setUp(self):
+        self.stub = ShopifyStub(SAMPLE_ORDERS, page_size=1, bulk_polls=2)
+        self.pool = ShopifyClientPool(transport=self.stub.transport())
+        self.service = ShopifyService(pool=self.pool)
+        self.service.access_token = "token"
+        patcher = patch.object(settings, "SHOPIFY_BULK_POLL_INTERVAL", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_scan(self, coro):
+        async def run():
+            try:
+                return await coro
+            finally:
+                await self.pool.aclose()
+
+        return asyncio.run(run())
+
+    def test_bulk_matches_paginated(self):
+        """Bulk and paginated scans produce identical aggregates"""
+        self.service.scan_mode = "bulk"
+        bulk = self.run_scan(self.service.fetch_store_analytics())
+
+        self.service.scan_mode = "paginated"
+        paginated = self.run_scan(self.service.fetch_store_analytics())
+
+        self.assertEqual(bulk, paginated)
+        self.assertEqual(self.stub.calls["bulk_run"], 1)
+        self.assertEqual(self.stub.calls["bulk_poll"], 3)
+        self.assertEqual(self.stub.calls["bulk_download"], 1)
+
+    def test_line_items_are_attached_to_their_parent(self):
+        """Line items that do not directly follow their order still count towards it"""
+        self.stub.bulk_group = 3
+        self.service.scan_mode = "bulk"
+        bulk = self.run_scan(self.service.fetch_store_analytics())
+
+        self.service.scan_mode = "paginated"
+        paginated = self.run_scan(self.service.fetch_store_analytics())
+
+        self.assertEqual(bulk, paginated)
+
+    def test_orphaned_line_items_are_counted(self):
+        """Line items whose order was already handed to the aggregators are counted, not attached elsewhere"""
+        self.stub.bulk_group = 2
+        self.service.scan_mode = "bulk"
+        orphans = shopify_bulk_orphans.values[()]
+        with patch.object(settings, "SHOPIFY_PAGE_SIZE", 1):
+            sales = self.run_scan(self.service.fetch_30d_sales())
+
+        # Orders in the window come oldest first in pairs; the first of the pair
+        # (SAMPLE_ORDERS[2]) is flushed before its line items arrive
+        self.assertEqual(shopify_bulk_orphans.values[()] - orphans, len(SAMPLE_ORDERS[2]["lineItems"]["edges"]))
+        self.assertEqual(sales["gid://shopify/Product/1"]["unitsSold30d"], 3)
+        self.assertEqual(sales["gid://shopify/Product/2"]["unitsSold30d"], 1)
+
+    def test_default_mode_skips_the_order_count(self):
+        """Scans page through orders without an ordersCount round trip unless auto mode is chosen"""
+        self.run_scan(self.service.fetch_30d_sales())
+
+        self.assertEqual(self.stub.calls["count"], 0)
+        self.assertEqual(self.stub.calls["bulk_run"], 0)
+        self.assertGreater(self.stub.calls["orders_page"], 0)
+
+    def test_auto_mode_uses_paginated_for_small_stores(self):
+        """Auto mode stays on cursor pagination below the bulk threshold"""
+        self.service.scan_mode = "auto"
+        with patch.object(settings, "SHOPIFY_BULK_MIN_ORDERS", 100):
+            self.run_scan(self.service.fetch_30d_sales())
+
+        self.assertEqual(self.stub.calls["count"], 1)
+        self.assertEqual(self.stub.calls["bulk_run"], 0)
+        self.assertGreater(self.stub.calls["orders_page"], 0)
+
+    def test_auto_mode_uses_bulk_for_large_stores(self):
+        """Auto mode switches to a bulk operation at the threshold"""
+        self.service.scan_mode = "auto"
+        with patch.object(settings, "SHOPIFY_BULK_MIN_ORDERS", 2):
+            sales = self.run_scan(self.service.fetch_30d_sales())
+
+        self.assertEqual(self.stub.calls["bulk_run"], 1)
+        self.assertEqual(self.stub.calls["orders_page"], 0)
+        self.assertEqual(sales["gid://shopify/Product/1"]["unitsSold30d"], 3)
+
+
+class TestIncrementalSales(unittest.TestCase):
+    """Test watermark-based incremental sales refreshes"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.rollups = SalesRollupStore(os.path.join(tmp.name, "store.json"))
+        self.stub = ShopifyStub(SAMPLE_ORDERS, page_size=1)
+        self.service = ShopifyService(pool=ShopifyClientPool(transport=self.stub.transport()))
+        self.service.access_token = "token"
+        self.service.scan_mode = "paginated"
+
+    def run_async(self, coro):
+        async def run():
+            try:
+                return await coro
+            finally:
+                await self.service.pool.aclose()
+
+        return asyncio.run(run())
+
+    def test_first_refresh_matches_full_scan(self):
+        """Without persisted state the whole window is scanned"""
+        incremental = self.run_async(self.service.refresh_30d_sales(self.rollups))
+        full = self.run_async(self.service.fetch_30d_sales())
+
+        self.assertEqual(incremental, full)
+        state = self.rollups.load(self.service.store_url)
+        self.assertEqual(state["watermark"], SAMPLE_ORDERS[0]["processedAt"])
+
+    def test_refresh_only_fetches_new_orders(self):
+        """Later refreshes start at the watermark and skip already counted orders"""
+        self.run_async(self.service.refresh_30d_sales(self.rollups))
+        pages_before = self.stub.calls["orders_page"]
+
+        new_order = make_order(0, "10.00", [("gid://shopify/Product/2", 4, "10.00")])
+        self.stub.orders.append(new_order)
+        sales = self.run_async(self.service.refresh_30d_sales(self.rollups))
+
+        # The watermark order is returned again by processed_at:>= and deduplicated;
+        # the (empty) first day of the window is re-scanned with one more page
+        self.assertEqual(self.stub.calls["orders_page"] - pages_before, 3)
+        self.assertEqual(sales["gid://shopify/Product/2"], {"unitsSold30d": 6, "grossSales30d": 49.90})
+        self.assertEqual(sales["gid://shopify/Product/1"], {"unitsSold30d": 3, "grossSales30d": 130.10})
+        self.assertEqual(self.rollups.load(self.service.store_url)["watermark"], new_order["processedAt"])
+
+    def test_days_outside_window_are_dropped(self):
+        """Buckets older than the lookback window are pruned on refresh"""
+        self.rollups.save(self.service.store_url, {
+            "watermark": SAMPLE_ORDERS[0]["processedAt"],
+            "watermark_ids": [SAMPLE_ORDERS[0]["id"]],
+            "days": {"2000-01-01": {"gid://shopify/Product/9": {"units": 5, "sales": "50.00"}}},
+        })
+        sales = self.run_async(self.service.refresh_30d_sales(self.rollups))
+
+        self.assertNotIn("gid://shopify/Product/9", sales)
+        self.assertNotIn("2000-01-01", self.rollups.load(self.service.store_url)["days"])
+
+    def test_first_day_is_trimmed_at_window_start(self):
+        """The first day of the window only counts orders from the exact window start"""
+        self.run_async(self.service.refresh_30d_sales(self.rollups))
+        state = self.rollups.load(self.service.store_url)
+        # Counted on the first day of the window, but before the window started
+        first_day = (datetime.now(timezone.utc) - timedelta(days=LOOKBACK_DAYS)).date().isoformat()
+        state["days"][first_day] = {"gid://shopify/Product/9": {"units": 5, "sales": "50.00"}}
+        self.rollups.save(self.service.store_url, state)
+        # Older than the watermark, so only the re-scan of the first day can find it
+        self.stub.orders.append(make_order(LOOKBACK_DAYS - 1 / 24, "10.00", [("gid://shopify/Product/2", 1, "10.00")]))
+
+        incremental = self.run_async(self.service.refresh_30d_sales(self.rollups))
+        full = self.run_async(self.service.fetch_30d_sales())
+
+        self.assertNotIn("gid://shopify/Product/9", incremental)
+        self.assertEqual(incremental, full)
+
+
+class TestCostThrottling(unittest.TestCase):
+    """Test cost-based throttling against the stand-in's leaky bucket"""
+
+    def make_service(self, stub):
+        service = ShopifyService(pool=ShopifyClientPool(transport=stub.transport()), throttle=CostThrottle())
+        service.access_token = "token"
+        service.scan_mode = "paginated"
+        return service
+
+    def run_async(self, service, coro):
+        async def run():
+            try:
+                return await coro
+            finally:
+                await service.pool.aclose()
+
+        return asyncio.run(run())
+
+    def test_page_size_adapts_to_query_cost(self):
+        """Pages shrink to fit the single query cost limit"""
+        orders = [make_order(1, "10.00", [("gid://shopify/Product/1", 1, "10.00")]) for _ in range(25)]
+        stub = ShopifyStub(orders, order_cost=100, restore_rate=100000.0)
+        service = self.make_service(stub)
+
+        sales = self.run_async(service, service.fetch_30d_sales())
+
+        self.assertEqual(sales["gid://shopify/Product/1"]["unitsSold30d"], 25)
+        self.assertEqual(stub.calls["max_cost_exceeded"], 1)
+        self.assertEqual(stub.calls["throttled"], 0)
+        # 2 + 9 * 100 is the largest page under the 1000 limit
+        self.assertEqual(set(stub.page_sizes), {9})
+
+    def test_cost_errors_without_a_cost_still_shrink_the_page(self):
+        """MAX_COST_EXCEEDED without cost details halves the page instead of retrying it forever"""
+        orders = [make_order(1, "10.00", [("gid://shopify/Product/1", 1, "10.00")]) for _ in range(5)]
+        page_sizes = []
+
+        def handler(request):
+            first = json.loads(request.content)["variables"]["first"]
+            page_sizes.append(first)
+            if first > 20:
+                # The error without extensions must not hide the cost error next to it
+                return httpx.Response(200, json={"errors": [
+                    {"message": "Field is deprecated"},
+                    {"message": "Query cost too high", "extensions": {"code": "MAX_COST_EXCEEDED"}},
+                ]})
+            edges = [{"cursor": str(i), "node": order} for i, order in enumerate(orders)]
+            return httpx.Response(200, json={"data": {"orders": {"pageInfo": {"hasNextPage": False}, "edges": edges}}})
+
+        service = ShopifyService(pool=ShopifyClientPool(transport=httpx.MockTransport(handler)), throttle=CostThrottle())
+        service.access_token = "token"
+        service.scan_mode = "paginated"
+
+        sales = self.run_async(service, service.fetch_30d_sales())
+
+        self.assertEqual(sales["gid://shopify/Product/1"]["unitsSold30d"], 5)
+        self.assertEqual(page_sizes, [250, 125, 62, 31, 15])
+        self.assertNotIn(ORDER_SCAN_QUERY, service.throttle.item_costs)
+
+    def test_throttled_requests_are_retried(self):
+        """THROTTLED responses wait for the bucket instead of failing"""
+        stub = ShopifyStub(SAMPLE_ORDERS, order_cost=1, restore_rate=100000.0, throttle_first=2)
+        service = self.make_service(stub)
+
+        sales = self.run_async(service, service.fetch_30d_sales())
+
+        self.assertEqual(stub.calls["throttled"], 2)
+        self.assertEqual(sales["gid://shopify/Product/1"]["unitsSold30d"], 3)
+
+    def test_concurrent_callers_share_the_bucket(self):
+        """Concurrent scans are paced so Shopify never has to throttle them"""
+        orders = [make_order(1, "10.00", [("gid://shopify/Product/1", 1, "10.00")]) for _ in range(40)]
+        stub = ShopifyStub(orders, order_cost=50, restore_rate=20000.0)
+        service = self.make_service(stub)
+
+        async def scans():
+            return await asyncio.gather(*(service.fetch_30d_sales() for _ in range(3)))
+
+        results = self.run_async(service, scans())
+
+        for sales in results:
+            self.assertEqual(sales["gid://shopify/Product/1"]["unitsSold30d"], 40)
+        self.assertEqual(stub.calls["throttled"], 0)
+        self.assertEqual(set(stub.page_sizes), {19})
+
+    def test_bucket_waits_for_restore(self):
+        """acquire() sleeps until enough cost has been restored"""
+        throttle = CostThrottle(maximum_available=100.0, restore_rate=1000.0)
+
+        async def run():
+            await throttle.acquire(100)
+            start = time.monotonic()
+            await throttle.acquire(50)
+            return time.monotonic() - start
+
+        self.assertGreaterEqual(asyncio.run(run()), 0.04)
+
+
+class TestShardedScan(unittest.TestCase):
+    """Test time-sharded concurrent pagination"""
+
+    def setUp(self):
+        orders = [
+            # Half-day offsets keep orders away from the 7/30/90 day window edges
+            make_order(days - 0.5, f"{days}.25", [(f"gid://shopify/Product/{days % 3}", 1, f"{days}.25")])
+            for days in range(1, 85, 2)
+        ]
+        self.stub = ShopifyStub(orders, page_size=3, latency=0.01)
+        throttle = CostThrottle(restore_rate=100000.0)
+        self.service = ShopifyService(pool=ShopifyClientPool(transport=self.stub.transport()), throttle=throttle)
+        self.service.access_token = "token"
+        self.service.scan_mode = "paginated"
+
+    def run_async(self, coro):
+        async def run():
+            try:
+                return await coro
+            finally:
+                await self.service.pool.aclose()
+
+        return asyncio.run(run())
+
+    def test_sharded_scan_matches_sequential(self):
+        """Merged shard aggregates are identical to a single sequential scan"""
+        sequential = self.run_async(self.service.fetch_store_analytics())
+        self.assertEqual(self.stub.max_in_flight, 1)
+
+        with patch.object(settings, "SHOPIFY_SCAN_SHARDS", 6), patch.object(settings, "SHOPIFY_SCAN_MAX_IN_FLIGHT", 3):
+            sharded = self.run_async(self.service.fetch_store_analytics())
+
+        self.assertEqual(sharded, sequential)
+        self.assertEqual(self.stub.max_in_flight, 3)
+
+    def test_shards_do_not_overlap(self):
+        """Every order is counted exactly once across shard boundaries"""
+        with patch.object(settings, "SHOPIFY_SCAN_SHARDS", 7):
+            analytics = self.run_async(self.service.fetch_store_analytics())
+
+        self.assertEqual(analytics["windows"]["90d"]["orders"], len(self.stub.orders))
+
+
+class TestLineItemPagination(unittest.TestCase):
+    """Test follow-up pagination of orders with more line items than one page"""
+
+    def setUp(self):
+        self.large = make_order(2, "260.00", [(f"gid://shopify/Product/{i % 5}", 1, "2.00") for i in range(130)])
+        self.huge = make_order(3, "500.00", [("gid://shopify/Product/9", 2, "2.00") for _ in range(250)])
+        self.small = make_order(4, "10.00", [("gid://shopify/Product/0", 1, "10.00")])
+        self.stub = ShopifyStub([self.large, self.huge, self.small], page_size=3)
+        self.service = ShopifyService(pool=ShopifyClientPool(transport=self.stub.transport()))
+        self.service.access_token = "token"
+        self.service.scan_mode = "paginated"
+
+    def run_async(self, coro):
+        async def run():
+            try:
+                return await coro
+            finally:
+                await self.service.pool.aclose()
+
+        return asyncio.run(run())
+
+    def test_truncated_orders_are_completed(self):
+        """Line items past the first page are fetched and counted"""
+        sales = self.run_async(self.service.fetch_30d_sales())
+
+        self.assertEqual(sales["gid://shopify/Product/9"]["unitsSold30d"], 500)
+        self.assertEqual(sum(sales[f"gid://shopify/Product/{i}"]["unitsSold30d"] for i in range(5)), 131)
+        self.assertAlmostEqual(sales["gid://shopify/Product/0"]["grossSales30d"], 62.0)
+
+    def test_follow_ups_are_batched(self):
+        """Truncated orders share follow-up requests until each is exhausted"""
+        with patch.object(settings, "SHOPIFY_LINE_ITEM_PAGE_SIZE", 50):
+            self.run_async(self.service.fetch_30d_sales())
+
+        # Both orders continue together; only the 250-item order needs pages 3 and 4
+        self.assertEqual(self.stub.calls["line_items_page"], 3)
+
+    def test_shards_share_the_in_flight_limit(self):
+        """Follow-ups of every shard count against the same in-flight limit as the pages"""
+        orders = [
+            make_order(days, "100.00", [("gid://shopify/Product/1", 1, "2.00") for _ in range(50)])
+            for days in range(1, 13)
+        ]
+        stub = ShopifyStub(orders, page_size=4, latency=0.01)
+        service = ShopifyService(pool=ShopifyClientPool(transport=stub.transport()), throttle=CostThrottle())
+        service.access_token = "token"
+        service.scan_mode = "paginated"
+
+        async def run():
+            try:
+                return await service.fetch_30d_sales()
+            finally:
+                await service.pool.aclose()
+
+        with patch.object(settings, "SHOPIFY_SCAN_SHARDS", 6), patch.object(settings, "SHOPIFY_SCAN_MAX_IN_FLIGHT", 2), \
+                patch.object(settings, "SHOPIFY_SCAN_LINE_ITEMS", 10), patch.object(settings, "SHOPIFY_LINE_ITEM_BATCH", 1):
+            sales = asyncio.run(run())
+
+        self.assertEqual(sales["gid://shopify/Product/1"]["unitsSold30d"], 600)
+        self.assertGreater(stub.calls["line_items_page"], 0)
+        self.assertEqual(stub.max_in_flight, 2)
+
+    def test_orders_that_fit_skip_follow_ups(self):
+        """No follow-up requests are made when the first page holds every line item"""
+        with patch.object(settings, "SHOPIFY_SCAN_LINE_ITEMS", 250):
+            self.run_async(self.service.fetch_30d_sales())
+
+        self.assertEqual(self.stub.calls["line_items_page"], 0)
+
+
+class TestBatchAggregation(unittest.TestCase):
+    """Test integer-cents parsing and the vectorized aggregation path"""
+
+    def setUp(self):
+        self.orders = [
+            make_order(
+                days % 45 + 0.5,
+                f"{days * 7}.{days % 10}",
+                [
+                    (f"gid://shopify/Product/{days % 4}", days % 3 + 1, "0.10"),
+                    (None, 1, "5.05"),
+                    (f"gid://shopify/Product/{days % 5}", 2, f"{days}.99"),
+                ],
+            )
+            for days in range(120)
+        ]
+        self.now = datetime.now(timezone.utc)
+
+    def aggregators(self):
+        return [
+            ProductSalesAggregator(now=self.now),
+            AOVAggregator(now=self.now),
+            WindowRollupAggregator(now=self.now),
+            DailySalesAggregator(self.now - timedelta(days=20), now=self.now),
+        ]
+
+    def test_parse_minor_units(self):
+        """Amount strings parse to exact integer minor units, including three-decimal currencies"""
+        self.assertEqual(parse_minor_units("12.34"), 12340)
+        self.assertEqual(parse_minor_units("12.5"), 12500)
+        self.assertEqual(parse_minor_units("7"), 7000)
+        self.assertEqual(parse_minor_units("-0.05"), -50)
+        self.assertEqual(parse_minor_units("12.345"), 12345)
+        self.assertEqual(parse_minor_units("3.1000"), 3100)
+        self.assertEqual(parse_minor_units("1.0005"), 1000)
+        self.assertEqual(parse_minor_units("1.0015"), 1002)
+        self.assertEqual(list(parse_minor_units_array(["12.345", "0.1", "1.0015"])), [12345, 100, 1002])
+
+    def test_batch_matches_per_order(self):
+        """Vectorized consume_batch agrees exactly with per-order consume"""
+        per_order, batched = self.aggregators(), self.aggregators()
+        for order in self.orders:
+            for aggregator in per_order:
+                aggregator.consume(order)
+        for start in range(0, len(self.orders), 25):
+            batch = OrderBatch(self.orders[start:start + 25])
+            for aggregator in batched:
+                aggregator.consume_batch(batch)
+
+        for expected, actual in zip(per_order, batched):
+            self.assertEqual(actual.result(), expected.result())
+        self.assertEqual(batched[3].watermark, per_order[3].watermark)
+        self.assertEqual(batched[3].watermark_ids, per_order[3].watermark_ids)
+
+    def test_sums_are_exact(self):
+        """Many small amounts add up without float drift"""
+        orders = [make_order(1, "0.10", [("gid://shopify/Product/1", 1, "0.10")]) for _ in range(1000)]
+        sales, aov = ProductSalesAggregator(now=self.now), AOVAggregator(now=self.now)
+        batch = OrderBatch(orders)
+        sales.consume_batch(batch)
+        aov.consume_batch(batch)
+
+        self.assertEqual(sales.totals["gid://shopify/Product/1"]["sales"], 100000)
+        self.assertEqual(sales.result()["gid://shopify/Product/1"]["grossSales30d"], 100.0)
+        self.assertEqual(aov.result(), 0.1)
+
+    def test_three_decimal_currencies(self):
+        """KWD-style amounts aggregate exactly, per order and batched, in every aggregator"""
+        orders = [make_order(days, "12.345", [("gid://shopify/Product/1", 1, "12.345")]) for days in range(3)]
+        per_order, batched = self.aggregators(), self.aggregators()
+        for order in orders:
+            for aggregator in per_order:
+                aggregator.consume(order)
+        for aggregator in batched:
+            aggregator.consume_batch(OrderBatch(orders))
+
+        for expected, actual in zip(per_order, batched):
+            self.assertEqual(actual.result(), expected.result())
+        self.assertEqual(batched[0].result()["gid://shopify/Product/1"]["grossSales30d"], 37.035)
+        self.assertEqual(batched[1].result(), 12.345)
+        daily = batched[3].result()
+        self.assertEqual(sum(bucket["sales"] for products in daily.values() for bucket in products.values()), 37035)
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -4,15 +4,21 @@ Unit tests for PopupGenius analysis tools
 """
 
 import unittest
+import asyncio
 import sys
 import os
+import tempfile
+import time
+from unittest.mock import patch
 
 # Add src to path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
-from tools.popup import analyze_popup_history
-from tools.transaction import analyze_transaction_data
-from tools.competitor import analyze_competitors
+from src.tools.popup import analyze_popup_history
+from src.tools.transaction import analyze_transaction_data
+from src.tools.competitor import analyze_competitors
+from src.tools.runtime import TOOL_FUNCTIONS, TOOL_OPTIONS, ToolTimeout, clear_memo, run_tool, tool
+from src.config import settings
 
 
 class TestPopupAnalysis(unittest.TestCase):
@@ -211,6 +217,113 @@ class TestToolsIntegration(unittest.TestCase):
         self.assertIsInstance(popup_result, dict)
 
 
+def slow_test_tool(delay: float = 0.2):
+    time.sleep(delay)
+    return {"slept": delay}
+
+
+class TestToolRuntime(unittest.TestCase):
+    """Test running tools off the event loop"""
+
+    def setUp(self):
+        tool(timeout=1.0)(slow_test_tool)
+        self.addCleanup(TOOL_FUNCTIONS.pop, "slow_test_tool")
+        self.addCleanup(TOOL_OPTIONS.pop, "slow_test_tool")
+
+    def test_calls_run_in_parallel_without_blocking_the_loop(self):
+        """Concurrent calls overlap and the event loop keeps ticking meanwhile"""
+        async def scenario():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            ticking = asyncio.create_task(ticker())
+            started = time.perf_counter()
+            results = await asyncio.gather(*(run_tool("slow_test_tool", delay=0.2) for _ in range(4)))
+            elapsed = time.perf_counter() - started
+            ticking.cancel()
+            return results, elapsed, ticks
+
+        results, elapsed, ticks = asyncio.run(scenario())
+
+        self.assertEqual(results, [{"slept": 0.2}] * 4)
+        self.assertLess(elapsed, 0.6)
+        self.assertGreater(ticks, 5)
+
+    def test_timeout(self):
+        """A call over its timeout raises ToolTimeout; settings override the decorator"""
+        with patch.object(settings, "TOOL_TIMEOUTS", {"slow_test_tool": 0.05}):
+            with self.assertRaises(ToolTimeout):
+                asyncio.run(run_tool("slow_test_tool", delay=0.3))
+
+    def test_cpu_bound_tool_runs_in_process_pool(self):
+        """The pandas transaction analysis gives the same result from a worker process"""
+        self.assertTrue(TOOL_OPTIONS["analyze_transaction_data"]["cpu_bound"])
+        result = asyncio.run(run_tool("analyze_transaction_data", "baseball equipment store"))
+        self.assertEqual(result, TOOL_FUNCTIONS["analyze_transaction_data"]("baseball equipment store"))
+
+
+class TestToolMemoization(unittest.TestCase):
+    """Test memoized tool results"""
+
+    def setUp(self):
+        self.calls = 0
+        self.data_file = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+        self.data_file.write('{"rate": 1}')
+        self.data_file.close()
+        self.addCleanup(os.unlink, self.data_file.name)
+
+        def memo_test_tool(business_description: str = "", industry: str = ""):
+            self.calls += 1
+            with open(self.data_file.name) as f:
+                return {"description": business_description.lower(), "industry": industry, "data": f.read()}
+
+        tool(memoize=True, data_files=(self.data_file.name,), casefold=("business_description",))(memo_test_tool)
+        self.addCleanup(TOOL_FUNCTIONS.pop, "memo_test_tool")
+        self.addCleanup(TOOL_OPTIONS.pop, "memo_test_tool")
+        clear_memo()
+        self.addCleanup(clear_memo)
+
+    def call(self, *args, **kwargs):
+        return asyncio.run(run_tool("memo_test_tool", *args, **kwargs))
+
+    def test_normalized_inputs_share_a_result(self):
+        """Whitespace and case differences in the description hit the same entry"""
+        first = self.call("Baseball  equipment store")
+        second = self.call(business_description=" baseball equipment STORE ")
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.calls, 1)
+
+    def test_case_sensitive_arguments_stay_distinct(self):
+        """Arguments not marked casefold keep their case in the key"""
+        self.call("store", "fashion")
+        self.call("store", "Fashion")
+
+        self.assertEqual(self.calls, 2)
+
+    def test_data_file_change_invalidates(self):
+        """Editing a data file recomputes the result"""
+        self.call("store")
+        with open(self.data_file.name, "w") as f:
+            f.write('{"rate": 22}')
+
+        result = self.call("store")
+
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(result["data"], '{"rate": 22}')
+
+    def test_cached_results_are_copies(self):
+        """Mutating a returned result does not change the cached one"""
+        self.call("store")["data"] = "changed"
+
+        self.assertEqual(self.call("store")["data"], '{"rate": 1}')
+
+
 if __name__ == "__main__":
     # Run tests with verbose output
     unittest.main(verbosity=2)
\ No newline at end of file
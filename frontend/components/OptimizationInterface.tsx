@@ -231,7 +231,7 @@ export function OptimizationInterface({ popupConfig, onBack, onPopupUpdate }: Op
     try {
       const uiInsights = extractUIInsights(messages)
       
-      const response = await fetch('http://localhost:8000/implement-popup-changes', {
+      const response = await fetch('http://localhost:8000/implement-popup-changes/stream', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -246,8 +246,46 @@ export function OptimizationInterface({ popupConfig, onBack, onPopupUpdate }: Op
         throw new Error(`Failed to implement changes: ${response.statusText}`)
       }
       
-      const newConfig = await response.json()
-      onPopupUpdate(newConfig)
+      const reader = response.body?.getReader()
+      const decoder = new TextDecoder()
+
+      if (!reader) {
+        throw new Error('No response body available')
+      }
+
+      let buffer = ''
+      let failure: string | null = null
+
+      while (true) {
+        const { done, value } = await reader.read()
+
+        if (done) break
+
+        buffer += decoder.decode(value, { stream: true })
+        const lines = buffer.split('\n')
+
+        // Keep the last incomplete line in buffer
+        buffer = lines.pop() || ''
+
+        for (const line of lines) {
+          if (!line.startsWith('data: ')) continue
+          try {
+            const event = JSON.parse(line.slice(6))
+            // Each applied change is previewed as soon as it is generated
+            if (event.type === 'config_update' || event.type === 'modification_complete') {
+              onPopupUpdate(event.config)
+            } else if (event.type === 'error') {
+              failure = event.message || 'Failed to implement changes'
+            }
+          } catch (e) {
+            console.error('Error parsing event:', e)
+          }
+        }
+      }
+
+      if (failure) {
+        throw new Error(failure)
+      }
       
       // Replace current analysis with success message
       reset()
@@ -13,6 +13,7 @@ export interface StreamMessage {
   content: string
   timestamp: Date
   isComplete?: boolean
+  toolName?: string
 }
 
 interface ErrorInfo {
@@ -92,7 +93,13 @@ export function useOptimizationStream() {
       const response = await Promise.race([fetchPromise, timeoutPromise]) as Response
 
       if (!response.ok) {
-        throw new Error(`Server error: ${response.status} ${response.statusText}`)
+        const serverError: Error & { retryAfterMs?: number } = new Error(`Server error: ${response.status} ${response.statusText}`)
+        // The server is at capacity; it says when to come back
+        const retryAfter = Number(response.headers.get('Retry-After'))
+        if (response.status === 429 && retryAfter > 0) {
+          serverError.retryAfterMs = retryAfter * 1000
+        }
+        throw serverError
       }
 
       setConnectionState(prev => ({ 
@@ -159,7 +166,8 @@ export function useOptimizationStream() {
       
       // Auto-retry logic
       if (connectionState.retryCount < maxRetries) {
-        const delay = baseRetryDelay * Math.pow(2, connectionState.retryCount) // Exponential backoff
+        const retryAfterMs = (err as { retryAfterMs?: number }).retryAfterMs
+        const delay = retryAfterMs ?? baseRetryDelay * Math.pow(2, connectionState.retryCount) // Exponential backoff
         
         reconnectTimeoutRef.current = setTimeout(() => {
           attemptConnection(popupConfig, true)
@@ -204,17 +212,22 @@ export function useOptimizationStream() {
         type: 'tool_start',
         content: `${event.tool_description || event.tool_name}`,
         timestamp: new Date(),
-        isComplete: false
+        isComplete: false,
+        toolName: event.tool_name
       }])
     }
     else if (event.type === 'tool_complete') {
       setMessages(prev => {
         const updated = [...prev]
-        const lastToolIndex = updated.map(m => m.type).lastIndexOf('tool_start')
-        if (lastToolIndex !== -1 && !updated[lastToolIndex].isComplete) {
-          updated[lastToolIndex] = {
-            ...updated[lastToolIndex],
-            content: updated[lastToolIndex].content.replace('...', ' ✓'),
+        // Tools run concurrently and complete in any order, so match by name
+        let toolIndex = updated.findIndex(m => m.type === 'tool_start' && !m.isComplete && m.toolName === event.tool_name)
+        if (toolIndex === -1) {
+          toolIndex = updated.map(m => m.type).lastIndexOf('tool_start')
+        }
+        if (toolIndex !== -1 && !updated[toolIndex].isComplete) {
+          updated[toolIndex] = {
+            ...updated[toolIndex],
+            content: updated[toolIndex].content.replace('...', ' ✓'),
             isComplete: true
           }
         }
@@ -245,9 +258,23 @@ export function useOptimizationStream() {
         return updated
       })
     }
+    else if (event.type === 'queued') {
+      // Waiting for a free analysis slot; keep a single status line up to date
+      setMessages(prev => {
+        const queued = {
+          id: 'queued',
+          type: 'tool_start' as const,
+          content: event.message || `Waiting in queue (position ${event.position})...`,
+          timestamp: new Date(),
+          isComplete: false
+        }
+        const index = prev.findIndex(m => m.id === 'queued')
+        return index === -1 ? [...prev, queued] : prev.map(m => m.id === 'queued' ? queued : m)
+      })
+    }
     else if (event.type === 'analysis_start') {
       // Optional: Add a start message
-      setMessages(prev => [...prev, {
+      setMessages(prev => [...prev.map(m => m.id === 'queued' ? { ...m, isComplete: true } : m), {
         id: messageId,
         type: 'tool_start',
         content: event.message || 'Starting analysis...',